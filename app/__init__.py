@@ -22,10 +22,45 @@ def create_app():
 
     app.config.from_object("app.config.Config")
 
+    from app.log import configure_logging
+    configure_logging(app)
+
     db.init_app(app)
     login_manager.init_app(app)
 
+    from app.compression import compression
+    from app.contraction import contraction, build_contraction_command
+    from app.graph_snapshot import graph_snapshot, build_graph_snapshot_command
+    from app.metrics import metrics
+    from app.obstacle_feed import obstacle_feed
+    from app.osrm_client import osrm_client
+    from app.route_cache import route_cache
+    from app.route_table import route_table, build_route_table_command
+    from app.spatial_index import spatial_index
+    from app.tiles import tile_cache
+    metrics.init_app(app)
+    compression.init_app(app)
+    obstacle_feed.init_app(app)
+    contraction.init_app(app)
+    graph_snapshot.init_app(app)
+    osrm_client.init_app(app)
+    route_cache.init_app(app)
+    route_table.init_app(app)
+    spatial_index.init_app(app)
+    tile_cache.init_app(app)
+
     from app.routes import main
     app.register_blueprint(main)
 
+    from app.bulk import import_campus_command, export_campus_command
+    from app.elevation import import_dem_command
+    from app.sync import purge_tombstones_command
+    app.cli.add_command(import_campus_command)
+    app.cli.add_command(export_campus_command)
+    app.cli.add_command(import_dem_command)
+    app.cli.add_command(build_route_table_command)
+    app.cli.add_command(build_contraction_command)
+    app.cli.add_command(build_graph_snapshot_command)
+    app.cli.add_command(purge_tombstones_command)
+
     return app
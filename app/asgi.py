@@ -0,0 +1,172 @@
+"""
+ASGI entry point with a non-blocking /api/get_route.
+
+Under the WSGI server a get_route request that goes to OSRM holds a worker
+thread until OSRM answers, so a handful of slow OSRM responses can stall
+every worker. RoutingASGI serves GET /api/get_route from an event loop
+instead (routes.get_route_async): the OSRM call is awaited through
+AsyncOSRMClient (non-blocking with httpx installed), database and graph
+work runs in a pool of ROUTE_ASYNC_THREADS threads, and concurrent routes
+are bounded by OSRM_MAX_CONCURRENCY rather than by the number of workers.
+
+Each request gets ROUTE_ASYNC_DEADLINE_S to answer (504 after that) and is
+cancelled as soon as the client disconnects; an OSRM call in flight is
+abandoned, a graph search already running in a thread finishes first.
+The Flask request context, before/after_request hooks (metrics,
+compression, CORS) and response format are the same as under WSGI.
+
+Every other request is handed to the Flask app through asgiref's
+WsgiToAsgi when asgiref is installed, so one ASGI server can run
+everything (`uvicorn run_asgi:application`). Without it, keep serving the
+CRUD endpoints from the WSGI server and send only /api/get_route to the
+ASGI server.
+"""
+import asyncio
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import jsonify
+
+from app import routes
+from app.osrm_client import async_osrm_client
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:  # optional dependency
+    WsgiToAsgi = None
+
+logger = logging.getLogger(__name__)
+
+# Paths served by coroutines; everything else goes to the WSGI app
+ASYNC_VIEWS = {"/api/get_route": routes.get_route_async}
+
+
+def _environ(scope):
+    """A WSGI environ for a body-less ASGI HTTP request, enough for Flask's request context."""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(),
+        "wsgi.errors": io.StringIO(),
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        key = name.decode("latin-1").upper().replace("-", "_")
+        if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            key = "HTTP_" + key
+        value = value.decode("latin-1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def _disconnected(receive):
+    """Return once the client has gone away."""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+class RoutingASGI:
+    """ASGI app: coroutine views for ASYNC_VIEWS, the Flask WSGI app for the rest."""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.deadline_s = flask_app.config["ROUTE_ASYNC_DEADLINE_S"]
+        self.threads = flask_app.config["ROUTE_ASYNC_THREADS"]
+        self._loop = None
+        self.wsgi = WsgiToAsgi(flask_app) if WsgiToAsgi is not None else None
+        self.requests = 0
+        self.timeouts = 0
+        self.disconnects = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        view = ASYNC_VIEWS.get(scope.get("path"))
+        if scope["type"] == "http" and view is not None and scope["method"] in ("GET", "HEAD"):
+            return await self._serve(view, scope, receive, send)
+        if self.wsgi is not None:
+            return await self.wsgi(scope, receive, send)
+        if scope["type"] == "http":
+            await send({"type": "http.response.start", "status": 404,
+                        "headers": [(b"content-type", b"text/plain")]})
+            await send({"type": "http.response.body", "body": b"Served by the WSGI app"})
+
+    def _use_loop(self):
+        """Size the running loop's default executor, which runs every _to_thread step."""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            loop.set_default_executor(ThreadPoolExecutor(self.threads, thread_name_prefix="route"))
+            self._loop = loop
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await async_osrm_client.aclose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _dispatch(self, view):
+        """Run view like Flask's full_dispatch_request: before_request hooks, the view, after_request hooks."""
+        app = self.flask_app
+        try:
+            rv = app.preprocess_request()
+            if rv is None:
+                rv = await view()
+        except Exception as e:
+            rv = app.handle_exception(e)
+        return app.process_response(app.make_response(rv))
+
+    async def _serve(self, view, scope, receive, send):
+        app = self.flask_app
+        self._use_loop()
+        self.requests += 1
+        with app.request_context(_environ(scope)):
+            # Both tasks run in a copy of this context, request context included
+            dispatch = asyncio.ensure_future(self._dispatch(view))
+            disconnect = asyncio.ensure_future(_disconnected(receive))
+            try:
+                await asyncio.wait({dispatch, disconnect}, timeout=self.deadline_s,
+                                   return_when=asyncio.FIRST_COMPLETED)
+                if not dispatch.done():
+                    dispatch.cancel()
+                    # Let blocking work already in a thread finish before the context is popped
+                    await asyncio.wait({dispatch})
+                    if disconnect.done():
+                        self.disconnects += 1
+                        logger.info("Route request cancelled, client disconnected", extra={"path": scope["path"]})
+                        return
+                    self.timeouts += 1
+                    logger.warning("Route request timed out", extra={"deadline_s": self.deadline_s})
+                    response = app.process_response(app.make_response(
+                        (jsonify({"error": f"No route within {self.deadline_s:g} s"}), 504)))
+                else:
+                    response = dispatch.result()
+            finally:
+                disconnect.cancel()
+
+            await send({
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                            for name, value in response.headers.items()],
+            })
+            await send({"type": "http.response.body",
+                        "body": b"" if scope["method"] == "HEAD" else response.get_data()})
@@ -0,0 +1,478 @@
+"""
+Streaming bulk import/export of campus data.
+
+Input is read incrementally and written in batches, so memory stays flat
+whatever the file size. Accepted input formats:
+  NDJSON (one JSON object per line; GeoJSON text sequences also work)
+  JSON: a top-level array of records or a GeoJSON FeatureCollection
+Each record is either
+  {"layer": "building" | "entrance" | "floor" | "indoor" | "path" | "closure",
+   <columns>...}
+  a GeoJSON Feature whose properties carry "layer" and the columns (an
+  "indoor" feature's geometry is stored as its floor plan geometry)
+  a campus building in the data/buildings.json format, with nested
+  "entrances" and "floors"
+Rows are upserted with chunked multi-row INSERT ... ON CONFLICT statements,
+one transaction per batch. Parents must come before their children in the
+stream (exports are written in that order).
+"""
+import codecs
+import json
+import re
+from datetime import date, datetime
+from decimal import Decimal
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DataError, IntegrityError
+
+from app import db
+from app.hooks import campus_reloaded
+from app.models import Building, Closure, Entrance, Floor, IndoorFeature, Path, utcnow
+
+# layer -> (model, primary key, conflict columns for upserts)
+LAYERS = {
+    'building': (Building, 'building_id', ('building_id',)),
+    'entrance': (Entrance, 'entrance_id', ('entrance_id',)),
+    'floor': (Floor, 'floor_id', ('building_id', 'level')),
+    'indoor': (IndoorFeature, 'feature_id', ('feature_id',)),
+    'path': (Path, 'path_id', ('path_id',)),
+    'closure': (Closure, 'closure_id', ('closure_id',)),
+}
+# Keys a record of each layer must carry (not null)
+REQUIRED = {
+    'building': (),
+    'entrance': ('building_id',),
+    'floor': ('building_id', 'level'),
+    'indoor': ('building_id', 'level', 'category', 'geometry'),
+    'path': ('start_location_id', 'end_location_id'),
+    'closure': (),
+}
+# Parents first so foreign keys resolve inside each batch
+LAYER_ORDER = ('building', 'entrance', 'floor', 'indoor', 'path', 'closure')
+
+READ_CHUNK = 64 * 1024
+
+
+#-------------------------------------------------------------------------
+# Input parsing
+#-------------------------------------------------------------------------
+
+def iter_ndjson(stream):
+    """Yield one decoded object per non-blank line of a binary stream."""
+    for line_no, line in enumerate(stream, start=1):
+        # GeoJSON text sequences prefix each record with an RS character
+        line = line.strip().lstrip(b"\x1e")
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"Line {line_no}: {e}")
+
+
+class _JSONStreamReader:
+    """Minimal incremental reader for the items of one (possibly nested) JSON array."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = self.stream.read(READ_CHUNK)
+        if not chunk:
+            self.eof = True
+            self.buf += self.decoder.decode(b"", final=True)
+            return False
+        # Drop what was consumed so the buffer never grows past a record or two
+        self.buf = self.buf[self.pos:] + self.decoder.decode(chunk)
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Next non-whitespace character (None at end of input)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return None
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected '{char}' but found {found!r}")
+        self.pos += 1
+
+    def value(self):
+        """Decode one complete JSON value, reading more input until it parses."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.json.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if self.eof or not self._fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self.buf) and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def items(self):
+        """Yield the elements of the array at the current position."""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            char = self.peek()
+            self.pos += 1
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError(f"Expected ',' or ']' but found {char!r}")
+
+
+def iter_json(stream):
+    """Yield the records of a top-level JSON array or a FeatureCollection's features."""
+    reader = _JSONStreamReader(stream)
+    if reader.peek() == "[":
+        yield from reader.items()
+        return
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        key = reader.value()
+        reader.expect(":")
+        if key == "features":
+            yield from reader.items()
+        else:
+            reader.value()
+        char = reader.peek()
+        reader.pos += 1
+        if char == "}":
+            return
+        if char != ",":
+            raise ValueError(f"Expected ',' or '}}' but found {char!r}")
+
+
+#-------------------------------------------------------------------------
+# Records -> rows
+#-------------------------------------------------------------------------
+
+def _campus_id(value):
+    """'building12' -> 12 (data/buildings.json uses string ids)."""
+    if isinstance(value, int):
+        return value
+    match = re.search(r"\d+", str(value or ""))
+    if not match:
+        raise ValueError(f"Campus building id {value!r} has no number in it")
+    return int(match.group())
+
+
+def _parse_floor(label):
+    """Floor labels from data/buildings.json: 'B' -> -1, 'G' -> 0, '2' -> 2."""
+    label = str(label).strip().upper()
+    if label.startswith("B"):
+        depth = int(label[1:] or 1)
+        return -depth, "Basement" if depth == 1 else f"Basement {depth}"
+    if label == "G":
+        return 0, "Ground Floor"
+    level = int(label)
+    return level, f"Floor {level}"
+
+
+def _campus_building(item):
+    building_id = _campus_id(item.get("id"))
+    name = item.get("name")
+    location = item.get("location") or {}
+    yield 'building', {
+        'building_id': building_id,
+        'name': name,
+        'latitude': location.get("lat"),
+        'longitude': location.get("lng"),
+    }
+    for i, entrance in enumerate(item.get("entrances") or [], start=1):
+        yield 'entrance', {
+            'building_id': building_id,
+            'entrance_name': entrance.get("name") or f"{name} Entrance {i}",
+            'latitude': entrance.get("lat"),
+            'longitude': entrance.get("lng"),
+            'floor_level': entrance.get("floor_level", 1),
+            'wheelchair_accessible': bool(entrance.get("accessible", False)),
+        }
+    floors = [_parse_floor(label) for label in item.get("floors") or []]
+    default = 1 if any(level == 1 for level, _ in floors) else (floors[0][0] if floors else None)
+    for level, floor_name in floors:
+        yield 'floor', {
+            'building_id': building_id,
+            'level': level,
+            'name': floor_name,
+            'is_default': level == default,
+        }
+
+
+def _columns(layer, values):
+    model = LAYERS[layer][0]
+    names = model.__table__.columns.keys()
+    row = {name: values[name] for name in names if name in values}
+    if layer == 'floor':
+        # Floors are matched on (building_id, level), not on their surrogate id
+        row.pop('floor_id', None)
+    for name in ('updated_at', 'reported_at', 'starts_at', 'ends_at'):
+        if isinstance(row.get(name), str):
+            row[name] = datetime.fromisoformat(row[name])
+    return row
+
+
+def iter_rows(items):
+    """Turn decoded input items into (layer, row dict) pairs."""
+    for n, item in enumerate(items, start=1):
+        if not isinstance(item, dict):
+            raise ValueError(f"Record {n}: expected an object")
+        if item.get("type") == "Feature":
+            values = dict(item.get("properties") or {})
+            geometry = item.get("geometry") or {}
+            if values.get("layer") == 'indoor':
+                values.setdefault('geometry', geometry)
+            elif geometry.get("type") == "Point":
+                values.setdefault('longitude', geometry["coordinates"][0])
+                values.setdefault('latitude', geometry["coordinates"][1])
+        elif "location" in item and "layer" not in item:
+            for layer, row in _campus_building(item):
+                yield layer, row
+            continue
+        else:
+            values = item
+        layer = values.get("layer")
+        if layer not in LAYERS:
+            raise ValueError(f"Record {n}: unknown layer {layer!r}")
+        missing = [key for key in REQUIRED[layer] if values.get(key) is None]
+        if missing:
+            raise ValueError(f"Record {n}: {layer} is missing {', '.join(missing)}")
+        yield layer, _columns(layer, values)
+
+
+#-------------------------------------------------------------------------
+# Batched upserts
+#-------------------------------------------------------------------------
+
+def _insert_for_dialect(table):
+    name = db.session.get_bind().dialect.name
+    if name == "postgresql":
+        return postgresql.insert(table)
+    if name == "sqlite":
+        return sqlite.insert(table)
+    return None
+
+
+def _resolve_entrance_ids(rows):
+    """Give id-less entrances the id of an existing one at the same spot, so reimports update."""
+    pending = [r for r in rows if r.get('entrance_id') is None]
+    if not pending:
+        return
+    building_ids = {r['building_id'] for r in pending}
+    existing = db.session.query(
+        Entrance.entrance_id, Entrance.building_id, Entrance.latitude, Entrance.longitude
+    ).filter(Entrance.building_id.in_(building_ids))
+    known = {(b, round(float(lat), 6), round(float(lng), 6)): e
+             for e, b, lat, lng in existing if lat is not None and lng is not None}
+    for row in pending:
+        if row.get('latitude') is not None and row.get('longitude') is not None:
+            key = (row['building_id'], round(float(row['latitude']), 6), round(float(row['longitude']), 6))
+            if key in known:
+                row['entrance_id'] = known[key]
+
+
+def _write(layer, rows):
+    model, pk, conflict = LAYERS[layer]
+    table = model.__table__
+    if layer == 'entrance':
+        _resolve_entrance_ids(rows)
+    if 'updated_at' in table.c:
+        # Upserts skip onupdate, and delta sync needs the time of this write
+        now = utcnow()
+        for row in rows:
+            row['updated_at'] = now
+
+    # executemany needs every row in a statement to carry the same keys
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+
+    for keys, group in groups.items():
+        keyed = all(column in keys for column in conflict)
+        if not keyed:
+            db.session.execute(table.insert(), group)
+            continue
+        insert = _insert_for_dialect(table)
+        if insert is None:
+            for row in group:
+                db.session.merge(model(**row))
+            continue
+        updates = {k: insert.excluded[k] for k in keys if k not in conflict and k != pk}
+        if updates:
+            stmt = insert.on_conflict_do_update(index_elements=list(conflict), set_=updates)
+        else:
+            stmt = insert.on_conflict_do_nothing(index_elements=list(conflict))
+        db.session.execute(stmt, group)
+
+
+def _fix_sequences():
+    """Explicit ids don't advance PostgreSQL serials; move them past the imported rows."""
+    if db.session.get_bind().dialect.name != "postgresql":
+        return
+    for model, pk, _ in LAYERS.values():
+        table = model.__tablename__
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', '{pk}'), "
+            f"COALESCE((SELECT MAX({pk}) FROM {table}), 0) + 1, false)"
+        ))
+    db.session.commit()
+
+
+def import_rows(rows, batch_size=1000):
+    """
+    Upsert (layer, row) pairs in batches of batch_size, one transaction per
+    batch. Returns the number of rows written per layer.
+    """
+    counts = {layer: 0 for layer in LAYER_ORDER}
+    buffers = {layer: [] for layer in LAYER_ORDER}
+    pending = 0
+
+    def flush():
+        try:
+            for layer in LAYER_ORDER:
+                if buffers[layer]:
+                    _write(layer, buffers[layer])
+                    counts[layer] += len(buffers[layer])
+                    buffers[layer] = []
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    try:
+        for layer, row in rows:
+            buffers[layer].append(row)
+            pending += 1
+            if pending >= batch_size:
+                flush()
+                pending = 0
+        flush()
+        _fix_sequences()
+    finally:
+        # Even a failed import may have committed earlier batches
+        campus_reloaded()
+    return counts
+
+
+#-------------------------------------------------------------------------
+# Export
+#-------------------------------------------------------------------------
+
+def _jsonable(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def export_rows(layers=LAYER_ORDER, chunk_size=1000):
+    """Yield (layer, row dict) for every row, reading chunk_size rows at a time."""
+    for layer in LAYER_ORDER:
+        if layer not in layers:
+            continue
+        model, pk, _ = LAYERS[layer]
+        columns = list(model.__table__.columns)
+        query = db.session.query(*columns).order_by(getattr(model, pk)).yield_per(chunk_size)
+        for row in query:
+            yield layer, {c.key: _jsonable(v) for c, v in zip(columns, row)}
+
+
+def to_ndjson(rows):
+    for layer, row in rows:
+        yield json.dumps({'layer': layer, **row}) + "\n"
+
+
+def to_geojson(rows):
+    """Stream a FeatureCollection; buildings/entrances get Point geometry, indoor features their own."""
+    yield '{"type":"FeatureCollection","features":['
+    first = True
+    for layer, row in rows:
+        properties = {'layer': layer, **row}
+        geometry = None
+        lat, lng = row.get('latitude'), row.get('longitude')
+        if layer == 'indoor':
+            geometry = properties.pop('geometry')
+        elif lat is not None and lng is not None:
+            properties.pop('latitude')
+            properties.pop('longitude')
+            geometry = {"type": "Point", "coordinates": [lng, lat]}
+        feature = {"type": "Feature", "geometry": geometry, "properties": properties}
+        yield ("" if first else ",") + json.dumps(feature)
+        first = False
+    yield "]}\n"
+
+
+FORMATS = {
+    'ndjson': (to_ndjson, 'application/x-ndjson'),
+    'geojson': (to_geojson, 'application/geo+json'),
+}
+
+
+def parse_layers(value):
+    if not value:
+        return LAYER_ORDER
+    layers = tuple(v.strip() for v in value.split(",") if v.strip())
+    unknown = [layer for layer in layers if layer not in LAYERS]
+    if unknown:
+        raise ValueError(f"Unknown layer(s): {', '.join(unknown)}")
+    return layers
+
+
+#-------------------------------------------------------------------------
+# CLI
+#-------------------------------------------------------------------------
+
+@click.command('import-campus')
+@click.argument('source', type=click.File('rb'))
+@click.option('--format', 'fmt', type=click.Choice(['auto', 'ndjson', 'json']), default='auto',
+              help='Input format; auto picks ndjson for .ndjson/.jsonl/.geojsonl files.')
+@click.option('--batch-size', type=int, default=None, help='Rows per batch (default BULK_BATCH_SIZE).')
+@with_appcontext
+def import_campus_command(source, fmt, batch_size):
+    """Import campus data (e.g. data/buildings.json) from SOURCE ('-' for stdin)."""
+    if fmt == 'auto':
+        fmt = 'ndjson' if source.name.endswith(('.ndjson', '.jsonl', '.geojsonl')) else 'json'
+    items = iter_ndjson(source) if fmt == 'ndjson' else iter_json(source)
+    try:
+        counts = import_rows(iter_rows(items), batch_size=batch_size or current_app.config["BULK_BATCH_SIZE"])
+    except (ValueError, IntegrityError, DataError) as e:
+        raise click.ClickException(f"Invalid campus data: {getattr(e, 'orig', e)}")
+    click.echo(", ".join(f"{count} {layer}(s)" for layer, count in counts.items()))
+
+
+@click.command('export-campus')
+@click.argument('target', type=click.File('w'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(list(FORMATS)), default='ndjson', show_default=True)
+@click.option('--layers', default='', help='Comma-separated subset of building,entrance,floor,indoor,path.')
+@with_appcontext
+def export_campus_command(target, fmt, layers):
+    """Export campus data to TARGET (default stdout)."""
+    encode = FORMATS[fmt][0]
+    for chunk in encode(export_rows(parse_layers(layers))):
+        target.write(chunk)
@@ -0,0 +1,174 @@
+"""
+Filtered, paginated reads for the collection endpoints.
+
+Supports, on /api/entrances, /api/paths and /api/obstacles:
+  bbox=minLng,minLat,maxLng,maxLat   only rows inside the box (in SQL)
+  fields=a,b,c                       only these columns are SELECTed
+  after_id=<id>&limit=<n>            keyset pagination ordered by id
+
+Requests without any of these keep using the cached full-list response.
+"""
+from flask import Response, current_app
+from sqlalchemy import and_, or_, select
+
+from app import db
+from app.models import Building, Entrance, Path, Obstacle
+
+QUERY_PARAMS = ("bbox", "fields", "after_id", "limit")
+
+
+def _float(value):
+    return float(value) if value is not None else None
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+# --- Field specs: output name -> (column, converter) ---
+BUILDING_FIELDS = {
+    'building_id': (Building.building_id, None),
+    'name': (Building.name, None),
+    'address': (Building.address, None),
+    'street': (Building.street, None),
+    'city': (Building.city, None),
+    'state': (Building.state, None),
+    'zip_code': (Building.zip_code, None),
+    'latitude': (Building.latitude, _float),
+    'longitude': (Building.longitude, _float),
+    'updated_at': (Building.updated_at, _iso),
+}
+
+ENTRANCE_FIELDS = {
+    'entrance_id': (Entrance.entrance_id, None),
+    'building_id': (Entrance.building_id, None),
+    'entrance_name': (Entrance.entrance_name, None),
+    'latitude': (Entrance.latitude, _float),
+    'longitude': (Entrance.longitude, _float),
+    'floor_level': (Entrance.floor_level, None),
+    'wheelchair_accessible': (Entrance.wheelchair_accessible, None),
+    'opening_hours': (Entrance.opening_hours, None),
+    'updated_at': (Entrance.updated_at, _iso),
+}
+
+PATH_FIELDS = {
+    'path_id': (Path.path_id, None),
+    'start_location_id': (Path.start_location_id, None),
+    'end_location_id': (Path.end_location_id, None),
+    'had_incline': (Path.had_incline, None),
+    'has_stairs': (Path.has_stairs, None),
+    'is_wheelchair_accessible': (Path.is_wheelchair_accessible, None),
+    'is_paved': (Path.is_paved, None),
+    'path_type': (Path.path_type, None),
+    'distance': (Path.distance, _float),
+    'max_grade': (Path.max_grade, None),
+    'updated_at': (Path.updated_at, _iso),
+}
+
+OBSTACLE_FIELDS = {
+    'obstacle_id': (Obstacle.obstacle_id, None),
+    'latitude': (Obstacle.latitude, None),
+    'longitude': (Obstacle.longitude, None),
+    'obstacle_type': (Obstacle.obstacle_type, None),
+    'user_id': (Obstacle.user_id, None),
+    'building_id': (Obstacle.building_id, None),
+    'path_id': (Obstacle.path_id, None),
+    'entrance_id': (Obstacle.entrance_id, None),
+    'description': (Obstacle.description, None),
+    'severity_level': (Obstacle.severity_level, None),
+    'reported_at': (Obstacle.reported_at, _iso),
+    'status': (Obstacle.status, None),
+    'report_count': (Obstacle.report_count, None),
+    'starts_at': (Obstacle.starts_at, _iso),
+    'ends_at': (Obstacle.ends_at, _iso),
+}
+
+
+def _point_in_bbox(lat_col, lng_col, bbox):
+    min_lng, min_lat, max_lng, max_lat = bbox
+    return and_(lat_col.between(min_lat, max_lat), lng_col.between(min_lng, max_lng))
+
+
+def _path_in_bbox(bbox):
+    # Paths have no geometry of their own; keep those with an endpoint building inside
+    inside = select(Building.building_id).where(
+        _point_in_bbox(Building.latitude, Building.longitude, bbox))
+    return or_(Path.start_location_id.in_(inside), Path.end_location_id.in_(inside))
+
+
+COLLECTIONS = {
+    'entrances': (ENTRANCE_FIELDS, 'entrance_id',
+                  lambda bbox: _point_in_bbox(Entrance.latitude, Entrance.longitude, bbox)),
+    'paths': (PATH_FIELDS, 'path_id', _path_in_bbox),
+    'obstacles': (OBSTACLE_FIELDS, 'obstacle_id',
+                  lambda bbox: _point_in_bbox(Obstacle.latitude, Obstacle.longitude, bbox)),
+}
+
+
+def wants_query(args):
+    """True when a request uses any filtering/pagination parameter."""
+    return any(name in args for name in QUERY_PARAMS)
+
+
+def parse_args(args, field_specs):
+    """Validate the query parameters; raises ValueError with a readable message."""
+    bbox = args.get("bbox")
+    if bbox is not None:
+        bbox = tuple(float(v) for v in bbox.split(","))
+        if len(bbox) != 4:
+            raise ValueError("bbox must be minLng,minLat,maxLng,maxLat")
+        if bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            raise ValueError("bbox minimums must not exceed maximums")
+
+    fields = args.get("fields")
+    if fields is not None:
+        fields = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in fields if f not in field_specs]
+        if unknown:
+            raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+        if not fields:
+            raise ValueError("fields must name at least one field")
+    else:
+        fields = list(field_specs)
+
+    after_id = args.get("after_id", type=int)
+    if "after_id" in args and after_id is None:
+        raise ValueError("after_id must be an integer")
+
+    max_limit = current_app.config["COLLECTION_MAX_LIMIT"]
+    limit = args.get("limit", type=int)
+    if "limit" in args and (limit is None or limit < 1):
+        raise ValueError("limit must be a positive integer")
+    limit = min(limit or max_limit, max_limit)
+    return bbox, fields, after_id, limit
+
+
+def response(name, args):
+    """Run the filtered query for a collection and build the JSON response."""
+    field_specs, id_field, bbox_filter = COLLECTIONS[name]
+    bbox, fields, after_id, limit = parse_args(args, field_specs)
+
+    id_column = field_specs[id_field][0]
+    columns = [field_specs[f][0] for f in fields]
+    # The id is always selected so the next page's cursor can be computed
+    query = db.session.query(id_column, *columns)
+    if bbox is not None:
+        query = query.filter(bbox_filter(bbox))
+    if after_id is not None:
+        query = query.filter(id_column > after_id)
+    rows = query.order_by(id_column).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    converters = [field_specs[f][1] for f in fields]
+    result = []
+    for row in rows:
+        item = {}
+        for field, convert, value in zip(fields, converters, row[1:]):
+            item[field] = convert(value) if convert else value
+        result.append(item)
+
+    resp = Response(current_app.json.dumps(result), mimetype="application/json")
+    if has_more:
+        resp.headers["X-Next-After-Id"] = str(rows[-1][0])
+    return resp
@@ -0,0 +1,117 @@
+"""
+Transparent response compression.
+
+An after_request hook compresses JSON, GeoJSON, vector tile and other
+compressible bodies of at least COMPRESS_MIN_BYTES with brotli (when the
+brotli package is installed and the client accepts it) or gzip.
+Streaming responses (bulk export, the obstacle stream) and bodies that
+already carry a Content-Encoding (pre-compressed floor plans) are left
+alone.
+
+Compressed bytes of responses with an ETag are kept in a small LRU keyed
+by (ETag, encoding), so the cached collection lists and tiles are only
+compressed once per version rather than on every request. The ETag of a
+compressed response is sent weak: it names the same content in another
+encoding, and If-None-Match keeps matching it.
+"""
+import gzip
+import threading
+from collections import OrderedDict
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from app.metrics import metrics
+
+COMPRESSIBLE = {
+    "application/json",
+    "application/geo+json",
+    "application/msgpack",
+    "application/vnd.mapbox-vector-tile",
+    "application/x-ndjson",
+    "image/svg+xml",
+}
+
+
+def _compressible(mimetype):
+    return mimetype in COMPRESSIBLE or (mimetype.startswith("text/") and mimetype != "text/event-stream")
+
+
+class Compression:
+    """after_request compression with an ETag-keyed cache of compressed bodies."""
+
+    def __init__(self):
+        self.enabled = True
+        self.min_bytes = 1024
+        self.gzip_level = 6
+        self.brotli_quality = 4
+        self.cache_entries = 256
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config["COMPRESS_ENABLED"]
+        self.min_bytes = config["COMPRESS_MIN_BYTES"]
+        self.gzip_level = config["COMPRESS_GZIP_LEVEL"]
+        self.brotli_quality = config["COMPRESS_BROTLI_QUALITY"]
+        self.cache_entries = config["COMPRESS_CACHE_ENTRIES"]
+        if self.enabled:
+            app.after_request(self._after_request)
+
+    def _encoding(self):
+        accepted = request.accept_encodings
+        if brotli is not None and accepted["br"]:
+            return "br"
+        if accepted["gzip"]:
+            return "gzip"
+        return None
+
+    def _compress(self, body, encoding):
+        with metrics.span("compress"):
+            if encoding == "br":
+                return brotli.compress(body, quality=self.brotli_quality)
+            # mtime=0 keeps the bytes identical across workers
+            return gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+
+    def _cached(self, key, body, encoding):
+        if key is None:
+            return self._compress(body, encoding)
+        with self._lock:
+            compressed = self._cache.get(key)
+            if compressed is not None:
+                self._cache.move_to_end(key)
+                return compressed
+        compressed = self._compress(body, encoding)
+        with self._lock:
+            self._cache[key] = compressed
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+        return compressed
+
+    def _after_request(self, response):
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or "Content-Encoding" in response.headers or not _compressible(response.mimetype)):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = self._encoding()
+        if encoding is None:
+            return response
+        body = response.get_data()
+        if len(body) < self.min_bytes:
+            return response
+
+        etag, weak = response.get_etag()
+        key = (etag, encoding) if etag and not weak else None
+        response.set_data(self._cached(key, body, encoding))
+        response.headers["Content-Encoding"] = encoding
+        if etag:
+            response.set_etag(etag, weak=True)
+        return response
+
+
+compression = Compression()
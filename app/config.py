@@ -17,3 +17,167 @@ class Config:
     )
     
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # --- OSRM ---
+    # Example: OSRM_URL=http://localhost:5000 in your .env file
+    OSRM_URL = os.getenv("OSRM_URL", "http://10.96.33.120:5002")
+    # Overall deadline per OSRM call, including retries
+    OSRM_TIMEOUT_S = float(os.getenv("OSRM_TIMEOUT_S", "10"))
+    OSRM_MAX_RETRIES = int(os.getenv("OSRM_MAX_RETRIES", "2"))
+    OSRM_RETRY_BACKOFF_S = float(os.getenv("OSRM_RETRY_BACKOFF_S", "0.1"))
+    OSRM_POOL_SIZE = int(os.getenv("OSRM_POOL_SIZE", "16"))
+    OSRM_MAX_CONCURRENCY = int(os.getenv("OSRM_MAX_CONCURRENCY", "16"))
+    # Consecutive failures that open the circuit, and how long it stays open
+    OSRM_BREAKER_FAILURES = int(os.getenv("OSRM_BREAKER_FAILURES", "5"))
+    OSRM_BREAKER_RESET_S = float(os.getenv("OSRM_BREAKER_RESET_S", "30"))
+
+    # --- Async routing (run_asgi.py) ---
+    # Deadline for one /api/get_route served by the ASGI app before it answers 504
+    ROUTE_ASYNC_DEADLINE_S = float(os.getenv("ROUTE_ASYNC_DEADLINE_S", "15"))
+    # Worker threads for the blocking steps (database, graph search; OSRM calls too without httpx)
+    ROUTE_ASYNC_THREADS = int(os.getenv("ROUTE_ASYNC_THREADS", "32"))
+
+    # --- Routing ---
+    # "local" answers from the in-process Path graph and falls back to OSRM
+    # when the graph has no route; "osrm" does the opposite.
+    ROUTING_ENGINE = os.getenv("ROUTING_ENGINE", "local")
+    WALKING_SPEED_MPS = float(os.getenv("WALKING_SPEED_MPS", "1.4"))
+    # Points farther than this from any building/entrance are not snapped
+    ROUTING_MAX_SNAP_M = float(os.getenv("ROUTING_MAX_SNAP_M", "500"))
+
+    # --- Elevation (flask import-dem) ---
+    # Distance between DEM samples along a path; finer than the raster adds nothing
+    DEM_SAMPLE_STEP_M = float(os.getenv("DEM_SAMPLE_STEP_M", "5"))
+
+    # --- Time windows (closures, opening hours, obstacle windows) ---
+    # Naive times in the database and depart_at without an offset are in this zone
+    CAMPUS_TIMEZONE = os.getenv("CAMPUS_TIMEZONE", "America/New_York")
+    # Longest walk a schedule check covers; routes are not cached this close to a window change
+    ROUTE_SCHEDULE_HORIZON_S = float(os.getenv("ROUTE_SCHEDULE_HORIZON_S", "3600"))
+
+    # --- Route alternatives (/api/get_route?alternatives=k) ---
+    ROUTE_ALTERNATIVES_MAX = int(os.getenv("ROUTE_ALTERNATIVES_MAX", "5"))
+    # Weight factor on the edges of each route found before the next search
+    ROUTE_ALTERNATIVE_PENALTY = float(os.getenv("ROUTE_ALTERNATIVE_PENALTY", "1.4"))
+    # Most of an alternative's length that may be shared with a better route
+    ROUTE_ALTERNATIVE_MAX_OVERLAP = float(os.getenv("ROUTE_ALTERNATIVE_MAX_OVERLAP", "0.6"))
+    # Longest alternative, relative to the shortest route
+    ROUTE_ALTERNATIVE_MAX_STRETCH = float(os.getenv("ROUTE_ALTERNATIVE_MAX_STRETCH", "1.5"))
+    # Score charged per unit of obstacle warning weight (severity, less with distance)
+    ROUTE_OBSTACLE_SCORE_M = float(os.getenv("ROUTE_OBSTACLE_SCORE_M", "100"))
+
+    # --- Route cache ---
+    ROUTE_CACHE_MAX_ENTRIES = int(os.getenv("ROUTE_CACHE_MAX_ENTRIES", "2048"))
+    ROUTE_CACHE_TTL_S = float(os.getenv("ROUTE_CACHE_TTL_S", "600"))
+    # Endpoints within this many meters of an entrance share its cache key;
+    # otherwise they are snapped to a grid of this many degrees (~11 m)
+    ROUTE_CACHE_ENTRANCE_SNAP_M = float(os.getenv("ROUTE_CACHE_ENTRANCE_SNAP_M", "15"))
+    ROUTE_CACHE_GRID_DEG = float(os.getenv("ROUTE_CACHE_GRID_DEG", "0.0001"))
+    # Obstacles this close to a cached route's bounding box invalidate it
+    ROUTE_CACHE_OBSTACLE_BUFFER_M = float(os.getenv("ROUTE_CACHE_OBSTACLE_BUFFER_M", "25"))
+
+    # --- Route matrix ---
+    # Largest sources x destinations product accepted by /api/route_matrix
+    ROUTE_MATRIX_MAX_CELLS = int(os.getenv("ROUTE_MATRIX_MAX_CELLS", "2500"))
+
+    # --- Spatial index ---
+    # Grid cell size in degrees (~55 m); a few points per cell keeps lookups cheap
+    SPATIAL_INDEX_CELL_DEG = float(os.getenv("SPATIAL_INDEX_CELL_DEG", "0.0005"))
+    # Nearest/radius lookups never look farther than this, so points far off campus find nothing (0 disables)
+    SPATIAL_INDEX_MAX_RADIUS_M = float(os.getenv("SPATIAL_INDEX_MAX_RADIUS_M", "5000"))
+
+    # --- Obstacle checks on routes ---
+    # Obstacles within this distance of a route produce a warning
+    OBSTACLE_BUFFER_M = float(os.getenv("OBSTACLE_BUFFER_M", "15"))
+    # Routes are recomputed around obstacles whose severity_level exceeds this
+    OBSTACLE_REROUTE_SEVERITY = int(os.getenv("OBSTACLE_REROUTE_SEVERITY", "3"))
+    # severity_level of an obstacle report runs from 1 to this
+    OBSTACLE_MAX_SEVERITY = int(os.getenv("OBSTACLE_MAX_SEVERITY", "5"))
+    # Obstacle statuses (lower-case) that no longer affect routing
+    OBSTACLE_INACTIVE_STATUSES = [
+        s.strip().lower() for s in os.getenv("OBSTACLE_INACTIVE_STATUSES", "resolved,closed,cleared,rejected").split(",")
+    ]
+    # How often a worker looks for obstacle changes made by other workers (0 = never)
+    OBSTACLE_VERSION_CHECK_S = float(os.getenv("OBSTACLE_VERSION_CHECK_S", "2"))
+
+    # --- Collection endpoints ---
+    # Largest page returned by a filtered/paginated collection request
+    COLLECTION_MAX_LIMIT = int(os.getenv("COLLECTION_MAX_LIMIT", "1000"))
+    # Most buildings one /api/buildings/full?ids= request may ask for
+    BUILDING_FULL_MAX_IDS = int(os.getenv("BUILDING_FULL_MAX_IDS", "100"))
+
+    # --- Bulk import ---
+    # Rows per INSERT ... ON CONFLICT batch (and per transaction)
+    BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "1000"))
+
+    # --- Logging ---
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    # "json" (one object per line) or "text"
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+    # At most LOG_RATE_LIMIT identical messages per LOG_RATE_PERIOD_S (0 disables)
+    LOG_RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", "10"))
+    LOG_RATE_PERIOD_S = float(os.getenv("LOG_RATE_PERIOD_S", "60"))
+
+    # --- Metrics ---
+    # Request/DB/span histograms on /metrics and Server-Timing headers
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    # Allow ?profile=1 to return a sampled stack profile of the request (debugging only)
+    PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false").lower() == "true"
+    PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "1"))
+
+    # --- Shared routing graph snapshot ---
+    GRAPH_SNAPSHOT_ENABLED = os.getenv("GRAPH_SNAPSHOT_ENABLED", "true").lower() == "true"
+    # Memory-mapped graph file shared by all workers (default: <instance folder>/graph.bin)
+    GRAPH_SNAPSHOT_PATH = os.getenv("GRAPH_SNAPSHOT_PATH", "")
+    # How often a worker looks for campus changes made by other workers or the CLI (0 = never)
+    GRAPH_SNAPSHOT_CHECK_S = float(os.getenv("GRAPH_SNAPSHOT_CHECK_S", "5"))
+
+    # --- All-pairs building route table ---
+    ROUTE_TABLE_ENABLED = os.getenv("ROUTE_TABLE_ENABLED", "true").lower() == "true"
+    # Memory-mapped table file shared by all workers (default: <instance folder>/route_table.bin)
+    ROUTE_TABLE_PATH = os.getenv("ROUTE_TABLE_PATH", "")
+    # Above this many buildings the table (3 x buildings^2 cells per profile) is not used
+    ROUTE_TABLE_MAX_BUILDINGS = int(os.getenv("ROUTE_TABLE_MAX_BUILDINGS", "2000"))
+
+    # --- Contraction hierarchy ---
+    # Answer non-building routes with a contraction hierarchy instead of A*
+    ROUTING_CH_ENABLED = os.getenv("ROUTING_CH_ENABLED", "false").lower() == "true"
+    # Memory-mapped hierarchy file (default: <instance folder>/contraction.bin)
+    ROUTING_CH_PATH = os.getenv("ROUTING_CH_PATH", "")
+    # Nodes settled per witness search while contracting; lower builds faster but adds shortcuts
+    ROUTING_CH_SETTLE_LIMIT = int(os.getenv("ROUTING_CH_SETTLE_LIMIT", "50"))
+
+    # --- Vector tiles ---
+    TILE_CACHE_ENABLED = os.getenv("TILE_CACHE_ENABLED", "true").lower() == "true"
+    # Rendered tiles shared by all workers (default: <instance folder>/tiles)
+    TILE_CACHE_DIR = os.getenv("TILE_CACHE_DIR", "")
+    TILE_MAX_ZOOM = int(os.getenv("TILE_MAX_ZOOM", "20"))
+    # Douglas-Peucker tolerance in tile units (4096 per tile), i.e. coarser on lower zooms
+    TILE_SIMPLIFY_TOLERANCE = float(os.getenv("TILE_SIMPLIFY_TOLERANCE", "1.0"))
+
+    # --- Obstacle change stream ---
+    # Events kept for clients resuming with Last-Event-ID
+    OBSTACLE_FEED_REPLAY = int(os.getenv("OBSTACLE_FEED_REPLAY", "1000"))
+    OBSTACLE_FEED_KEEPALIVE_S = float(os.getenv("OBSTACLE_FEED_KEEPALIVE_S", "15"))
+
+    # --- Obstacle report ingestion ---
+    # Reports of the same type this close to a recent active obstacle are merged into it
+    OBSTACLE_DEDUP_RADIUS_M = float(os.getenv("OBSTACLE_DEDUP_RADIUS_M", "15"))
+    OBSTACLE_DEDUP_WINDOW_S = float(os.getenv("OBSTACLE_DEDUP_WINDOW_S", "900"))
+    # Most reports written by one group commit
+    OBSTACLE_BATCH_MAX = int(os.getenv("OBSTACLE_BATCH_MAX", "200"))
+
+    # --- Response compression ---
+    COMPRESS_ENABLED = os.getenv("COMPRESS_ENABLED", "true").lower() == "true"
+    COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+    COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+    # Used when the brotli package is installed
+    COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+    # Compressed bodies kept per ETag (collections, tiles)
+    COMPRESS_CACHE_ENTRIES = int(os.getenv("COMPRESS_CACHE_ENTRIES", "256"))
+
+    # --- Delta sync ---
+    # Older cursors get a full changeset; tombstones past this can be purged
+    SYNC_TOMBSTONE_RETENTION_DAYS = int(os.getenv("SYNC_TOMBSTONE_RETENTION_DAYS", "30"))
+    # Cursors point this far before the read so slower in-flight writes are not missed
+    SYNC_CURSOR_GRACE_S = float(os.getenv("SYNC_CURSOR_GRACE_S", "5"))
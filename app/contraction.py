@@ -0,0 +1,445 @@
+"""
+Contraction hierarchies over the campus graph.
+
+Preprocessing contracts nodes one at a time in order of importance (edge
+difference plus contracted-neighbour count, updated lazily), adding a
+shortcut between two neighbours whenever the contracted node lies on
+their only shortest connection. A query is then a bidirectional Dijkstra
+that only ever moves to higher-ranked nodes, so it settles a small part
+of the graph however many corridors, elevators and floors are added.
+Shortcuts remember the node they bypass and are unpacked back into
+CampusGraph edge indices, so routes are formatted by build_route exactly
+like A* results.
+
+One hierarchy is built per routing profile (forbidden edges are left out
+and penalties are part of the weights). All of them are stored in one
+memory-mapped file keyed by a fingerprint of the graph, so workers and
+restarts reload it instead of contracting again.
+"""
+import hashlib
+import heapq
+import logging
+import os
+import threading
+
+import click
+import numpy as np
+from flask.cli import with_appcontext
+
+from app import routing_engine
+from app.mmap_store import open_if_changed, write_arrays
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; builds are then only serialized per process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+INF = float("inf")
+
+# Per-profile arrays in the file, stored as <name>_<profile index>
+ARRAYS = ("rank", "up_offsets", "up_targets", "up_weights", "up_edges",
+          "edge_u", "edge_mid", "edge_c1", "edge_c2", "edge_uv", "edge_vu")
+
+
+def graph_fingerprint(graph):
+    """Hash of everything a hierarchy depends on: graph structure, weights inputs and profiles."""
+    digest = hashlib.sha1()
+    for part in (graph.node_kind, graph.node_ref, graph.offsets, graph.targets,
+                 graph.lengths, graph.flags, graph.path_ids):
+        digest.update(memoryview(part).tobytes())
+    digest.update(repr(sorted((name, spec["forbidden"], sorted(spec["penalties"].items()))
+                              for name, spec in routing_engine.PROFILES.items())).encode())
+    return digest.hexdigest()
+
+
+class Hierarchy:
+    """
+    Contraction hierarchy for one profile.
+
+    CH edge i joins edge_u[i] to the other endpoint stored in the upward
+    adjacency. Original edges keep their CampusGraph edge in each direction
+    (edge_uv / edge_vu); shortcuts have edge_mid >= 0 and two child CH
+    edges: edge_c1 between edge_u and the middle node, edge_c2 between the
+    middle node and the other endpoint.
+    """
+
+    def __init__(self, rank, up_offsets, up_targets, up_weights, up_edges,
+                 edge_u, edge_mid, edge_c1, edge_c2, edge_uv, edge_vu):
+        self.rank = rank
+        self.up_offsets = up_offsets
+        self.up_targets = up_targets
+        self.up_weights = up_weights
+        self.up_edges = up_edges
+        self.edge_u = edge_u
+        self.edge_mid = edge_mid
+        self.edge_c1 = edge_c1
+        self.edge_c2 = edge_c2
+        self.edge_uv = edge_uv
+        self.edge_vu = edge_vu
+
+    @classmethod
+    def contract(cls, graph, profile, settle_limit=50):
+        """Build the hierarchy for a profile. settle_limit bounds each witness search."""
+        weights = graph.weights(profile)
+        n = graph.node_count
+        offsets, targets, path_ids = graph.offsets, graph.targets, graph.path_ids
+
+        # Cheapest usable edge per unordered node pair, with both directions' edge ids
+        by_key = {}
+        for u in range(n):
+            for e in range(offsets[u], offsets[u + 1]):
+                by_key[(u, targets[e], path_ids[e])] = e
+        best = {}
+        for (u, v, pid), e in by_key.items():
+            w = weights[e]
+            if u >= v or w == INF:
+                continue
+            twin = by_key.get((v, u, pid))
+            if twin is None or weights[twin] != w:
+                continue
+            if (u, v) not in best or w < best[(u, v)][0]:
+                best[(u, v)] = (w, e, twin)
+
+        edge_u, edge_w, edge_mid, edge_c1, edge_c2, edge_uv, edge_vu = [], [], [], [], [], [], []
+        adj = [dict() for _ in range(n)]
+        for (u, v), (w, e, twin) in best.items():
+            adj[u][v] = adj[v][u] = len(edge_u)
+            edge_u.append(u)
+            edge_w.append(w)
+            edge_mid.append(-1)
+            edge_c1.append(-1)
+            edge_c2.append(-1)
+            edge_uv.append(e)
+            edge_vu.append(twin)
+
+        def witness(source, skip, goals, limit):
+            """Shortest distances from source to goals avoiding skip, up to limit."""
+            dist = {source: 0.0}
+            found = {}
+            heap = [(0.0, source)]
+            settled = 0
+            while heap and len(found) < len(goals) and settled < settle_limit:
+                d, x = heapq.heappop(heap)
+                if d > limit:
+                    break
+                if d > dist[x]:
+                    continue
+                settled += 1
+                if x in goals:
+                    found[x] = d
+                for y, eid in adj[x].items():
+                    if y == skip:
+                        continue
+                    nd = d + edge_w[eid]
+                    if nd < dist.get(y, INF):
+                        dist[y] = nd
+                        heapq.heappush(heap, (nd, y))
+            return found
+
+        def shortcuts_for(v):
+            neighbours = list(adj[v].items())
+            needed = []
+            for i, (u, eu) in enumerate(neighbours):
+                goals = {x: (edge_w[eu] + edge_w[ex], ex) for x, ex in neighbours[i + 1:]}
+                if not goals:
+                    continue
+                found = witness(u, v, goals, max(c for c, _ in goals.values()))
+                for x, (c, ex) in goals.items():
+                    if found.get(x, INF) > c:
+                        needed.append((u, x, c, eu, ex))
+            return needed
+
+        contracted_neighbours = [0] * n
+
+        def priority(v, needed):
+            return len(needed) - len(adj[v]) + contracted_neighbours[v]
+
+        heap = [(priority(v, shortcuts_for(v)), v) for v in range(n)]
+        heapq.heapify(heap)
+        rank = [0] * n
+        up = [None] * n
+        done = bytearray(n)
+        order = 0
+        while heap:
+            _, v = heapq.heappop(heap)
+            if done[v]:
+                continue
+            needed = shortcuts_for(v)
+            p = priority(v, needed)
+            if heap and p > heap[0][0]:
+                # Lazy update: importance grew since it was queued
+                heapq.heappush(heap, (p, v))
+                continue
+
+            for u, x, c, eu, ex in needed:
+                existing = adj[u].get(x)
+                if existing is not None and edge_w[existing] <= c:
+                    continue
+                adj[u][x] = adj[x][u] = len(edge_u)
+                edge_u.append(u)
+                edge_w.append(c)
+                edge_mid.append(v)
+                edge_c1.append(eu)
+                edge_c2.append(ex)
+                edge_uv.append(-1)
+                edge_vu.append(-1)
+
+            rank[v] = order
+            order += 1
+            done[v] = 1
+            # Every remaining neighbour is contracted later, so these edges all lead upwards
+            up[v] = [(x, edge_w[eid], eid) for x, eid in adj[v].items()]
+            for x in adj[v]:
+                del adj[x][v]
+                contracted_neighbours[x] += 1
+            adj[v] = {}
+
+        up_offsets = [0]
+        up_targets, up_weights, up_edges = [], [], []
+        for v in range(n):
+            for x, w, eid in up[v] or ():
+                up_targets.append(x)
+                up_weights.append(w)
+                up_edges.append(eid)
+            up_offsets.append(len(up_targets))
+        return cls(rank, up_offsets, up_targets, up_weights, up_edges,
+                   edge_u, edge_mid, edge_c1, edge_c2, edge_uv, edge_vu)
+
+    def arrays(self):
+        return {
+            "rank": np.array(self.rank, dtype=np.int32),
+            "up_offsets": np.array(self.up_offsets, dtype=np.int32),
+            "up_targets": np.array(self.up_targets, dtype=np.int32),
+            "up_weights": np.array(self.up_weights, dtype=np.float64),
+            "up_edges": np.array(self.up_edges, dtype=np.int32),
+            "edge_u": np.array(self.edge_u, dtype=np.int32),
+            "edge_mid": np.array(self.edge_mid, dtype=np.int32),
+            "edge_c1": np.array(self.edge_c1, dtype=np.int32),
+            "edge_c2": np.array(self.edge_c2, dtype=np.int32),
+            "edge_uv": np.array(self.edge_uv, dtype=np.int32),
+            "edge_vu": np.array(self.edge_vu, dtype=np.int32),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        # Plain lists index several times faster than NumPy scalars in the query loop
+        return cls(*(arrays[name].tolist() for name in ARRAYS))
+
+    def query(self, source, target):
+        """
+        Bidirectional upward Dijkstra. Returns (cost, graph edges, nodes settled)
+        or None when target is unreachable.
+        """
+        if source == target:
+            return 0.0, [], 0
+        up_offsets, up_targets, up_weights, up_edges = (
+            self.up_offsets, self.up_targets, self.up_weights, self.up_edges)
+        dist = ({source: 0.0}, {target: 0.0})
+        parent = ({source: None}, {target: None})
+        heaps = ([(0.0, source)], [(0.0, target)])
+        best, meet = INF, -1
+        settled = 0
+        while True:
+            # Each side stops once nothing left in it can beat the best meeting point
+            live = [side for side in (0, 1) if heaps[side] and heaps[side][0][0] < best]
+            if not live:
+                break
+            side = min(live, key=lambda s: heaps[s][0][0])
+            d, u = heapq.heappop(heaps[side])
+            if d > dist[side][u]:
+                continue
+            settled += 1
+            other = dist[1 - side].get(u)
+            if other is not None and d + other < best:
+                best, meet = d + other, u
+            for i in range(up_offsets[u], up_offsets[u + 1]):
+                x = up_targets[i]
+                nd = d + up_weights[i]
+                if nd < dist[side].get(x, INF):
+                    dist[side][x] = nd
+                    parent[side][x] = (u, up_edges[i])
+                    heapq.heappush(heaps[side], (nd, x))
+        if meet < 0:
+            return None
+
+        # source -> meet walks each CH edge upwards from its parent node
+        forward = []
+        node = meet
+        while parent[0][node] is not None:
+            prev, eid = parent[0][node]
+            forward.append((eid, prev))
+            node = prev
+        forward.reverse()
+        # meet -> target walks each CH edge downwards, from the higher node
+        backward = []
+        node = meet
+        while parent[1][node] is not None:
+            prev, eid = parent[1][node]
+            backward.append((eid, node))
+            node = prev
+
+        edges = []
+        for eid, start in forward + backward:
+            self._unpack(eid, start, edges)
+        return best, edges, settled
+
+    def _unpack(self, eid, start, out):
+        """Append the CampusGraph edges of CH edge eid, walked from node start."""
+        stack = [(eid, start)]
+        while stack:
+            eid, start = stack.pop()
+            mid = self.edge_mid[eid]
+            if mid < 0:
+                out.append(self.edge_uv[eid] if start == self.edge_u[eid] else self.edge_vu[eid])
+                continue
+            if start == self.edge_u[eid]:
+                first, second = self.edge_c1[eid], self.edge_c2[eid]
+            else:
+                first, second = self.edge_c2[eid], self.edge_c1[eid]
+            # LIFO: the half starting at `start` is unpacked first
+            stack.append((second, mid))
+            stack.append((first, start))
+
+
+class ContractionIndex:
+    """Per-graph hierarchies for every profile, persisted to disk and loaded lazily."""
+
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.settle_limit = 50
+        self._loaded = None      # (graph, {profile: Hierarchy})
+        self._file = None
+        self._lock = threading.Lock()
+        self._building = False
+        self.queries = 0
+        self.settled = 0
+        self.nodes = 0
+        self.builds = 0
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config["ROUTING_CH_ENABLED"]
+        self.path = config["ROUTING_CH_PATH"] or os.path.join(app.instance_path, "contraction.bin")
+        self.settle_limit = config["ROUTING_CH_SETTLE_LIMIT"]
+        self._loaded = None
+        self._file = None
+
+    def _load(self, graph, fingerprint):
+        """Hierarchies for graph from the file on disk, or None if it was built for another graph."""
+        self._file = open_if_changed(self.path, self._file)
+        mapped = self._file
+        if mapped is None or mapped.meta.get("fingerprint") != fingerprint:
+            return None
+        hierarchies = {}
+        for p, profile in enumerate(mapped.meta["profiles"]):
+            arrays = {name: getattr(mapped, f"{name}_{p}") for name in ARRAYS}
+            hierarchies[profile] = Hierarchy.from_arrays(arrays)
+        return hierarchies
+
+    def build(self, graph, fingerprint=None):
+        """Contract graph for every profile and write the file; returns the hierarchies."""
+        fingerprint = fingerprint or graph_fingerprint(graph)
+        profiles = list(routing_engine.PROFILES)
+        hierarchies = {profile: Hierarchy.contract(graph, profile, self.settle_limit) for profile in profiles}
+        arrays = {}
+        for p, profile in enumerate(profiles):
+            for name, value in hierarchies[profile].arrays().items():
+                arrays[f"{name}_{p}"] = value
+        write_arrays(self.path, {"kind": "contraction", "fingerprint": fingerprint,
+                                 "profiles": profiles, "nodes": graph.node_count}, arrays)
+        self.builds += 1
+        logger.info("Contraction hierarchy built", extra={
+            "nodes": graph.node_count, "edges": graph.edge_count,
+            "shortcuts": {p: len(h.edge_mid) - h.edge_mid.count(-1) for p, h in hierarchies.items()}})
+        return hierarchies
+
+    def _build_locked(self, graph, fingerprint):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".lock", "a") as lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return None
+            try:
+                return self._load(graph, fingerprint) or self.build(graph, fingerprint)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _schedule_build(self, graph, fingerprint):
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+
+        def run():
+            try:
+                hierarchies = self._build_locked(graph, fingerprint)
+                if hierarchies is not None:
+                    with self._lock:
+                        self._loaded = (graph, hierarchies)
+            except Exception:
+                logger.exception("Contraction hierarchy build failed")
+            finally:
+                with self._lock:
+                    self._building = False
+
+        threading.Thread(target=run, name="contraction-build", daemon=True).start()
+
+    def hierarchies(self, graph):
+        """Hierarchies for graph if ready; otherwise None, starting a load or build."""
+        loaded = self._loaded
+        if loaded is not None and loaded[0] is graph:
+            return loaded[1]
+        fingerprint = graph_fingerprint(graph)
+        hierarchies = self._load(graph, fingerprint)
+        if hierarchies is None:
+            self._schedule_build(graph, fingerprint)
+            return None
+        with self._lock:
+            self._loaded = (graph, hierarchies)
+        return hierarchies
+
+    def lookup(self, source, target, profile):
+        """(nodes, edges) like CampusGraph.shortest_path, or None when not available."""
+        if not self.enabled:
+            return None
+        graph = routing_engine.get_graph()
+        hierarchies = self.hierarchies(graph)
+        if hierarchies is None or profile not in hierarchies:
+            return None
+        found = hierarchies[profile].query(source, target)
+        self.queries += 1
+        self.nodes += graph.node_count
+        if found is None:
+            return None
+        _, edges, settled = found
+        self.settled += settled
+        nodes = [source]
+        nodes.extend(graph.targets[e] for e in edges)
+        return nodes, edges
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "queries": self.queries,
+            "builds": self.builds,
+            # Share of the graph a query settles on average
+            "settled_fraction": self.settled / self.nodes if self.nodes else 0.0,
+        }
+
+
+contraction = ContractionIndex()
+
+
+@click.command('build-contraction')
+@with_appcontext
+def build_contraction_command():
+    """Contract the current campus graph for every profile and save it."""
+    graph = routing_engine.get_graph()
+    contraction.build(graph)
+    click.echo(f"{graph.node_count} node(s), {len(routing_engine.PROFILES)} profile(s) -> {contraction.path}")
@@ -0,0 +1,307 @@
+"""
+Path grades from a digital elevation model (DEM).
+
+`flask --app run import-dem campus-dem.tif` samples the DEM every
+DEM_SAMPLE_STEP_M along every Path (the straight line between its two
+buildings) and stores
+  Path.grade_profile  [[length_m, grade_pct], ...] from the start building
+                      to the end building, uphill positive
+  Path.max_grade      the steepest |grade_pct| on it
+get_route?maxIncline=<percent> leaves out paths steeper than that, and a
+path steeper than routing_engine.INCLINE_GRADE_PCT counts as an incline
+even when had_incline is not set.
+
+The DEM is a single-band, uncompressed GeoTIFF (stripped or tiled) with
+elevations in meters, in lat/lng or, with pyproj installed, in a projected
+CRS given by its EPSG code (`gdal_translate -co COMPRESS=NONE` converts
+other rasters). It is memory-mapped, not read: the sample points of all
+paths are computed as NumPy arrays and their pixels gathered in one pass,
+so only the pages under the campus are ever touched, whatever the size of
+the raster.
+"""
+import math
+
+import click
+import numpy as np
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import update
+from sqlalchemy.orm import aliased
+
+try:
+    from pyproj import Transformer
+except ImportError:
+    Transformer = None
+
+from app import db
+from app.hooks import campus_reloaded
+from app.models import Building, Path, utcnow
+from app.routing_engine import EARTH_RADIUS_M
+
+# --- TIFF tags ---
+TAG_WIDTH = 256
+TAG_HEIGHT = 257
+TAG_BITS_PER_SAMPLE = 258
+TAG_COMPRESSION = 259
+TAG_STRIP_OFFSETS = 273
+TAG_SAMPLES_PER_PIXEL = 277
+TAG_ROWS_PER_STRIP = 278
+TAG_TILE_WIDTH = 322
+TAG_TILE_LENGTH = 323
+TAG_TILE_OFFSETS = 324
+TAG_SAMPLE_FORMAT = 339
+TAG_PIXEL_SCALE = 33550
+TAG_TIEPOINT = 33922
+TAG_GEO_KEYS = 34735
+TAG_GDAL_NODATA = 42113
+
+# --- GeoKeys ---
+KEY_MODEL_TYPE = 1024  # 1 projected, 2 geographic
+KEY_RASTER_TYPE = 1025  # 1 PixelIsArea, 2 PixelIsPoint
+KEY_PROJECTED_CRS = 3072
+MODEL_PROJECTED = 1
+MODEL_GEOGRAPHIC = 2
+
+# TIFF field type -> NumPy type code (rationals and the like are never needed)
+_FIELD_TYPES = {1: "u1", 2: "S1", 3: "u2", 4: "u4", 6: "i1", 7: "u1", 8: "i2", 9: "i4",
+                11: "f4", 12: "f8", 16: "u8", 17: "i8"}
+# (SampleFormat, BitsPerSample) -> NumPy type code
+_SAMPLE_TYPES = {(1, 8): "u1", (1, 16): "u2", (1, 32): "u4", (2, 8): "i1", (2, 16): "i2",
+                 (2, 32): "i4", (3, 32): "f4", (3, 64): "f8"}
+
+
+def _read_tags(data, order):
+    """{tag: ndarray of values (str for ASCII)} of the first image directory."""
+    (ifd,) = np.frombuffer(data, dtype=order + "u4", count=1, offset=4)
+    (count,) = np.frombuffer(data, dtype=order + "u2", count=1, offset=int(ifd))
+    tags = {}
+    for i in range(int(count)):
+        entry = int(ifd) + 2 + 12 * i
+        tag, kind = np.frombuffer(data, dtype=order + "u2", count=2, offset=entry)
+        (n,) = np.frombuffer(data, dtype=order + "u4", count=1, offset=entry + 4)
+        code = _FIELD_TYPES.get(int(kind))
+        if code is None:
+            continue
+        dtype = np.dtype(order + code)
+        offset = entry + 8
+        if dtype.itemsize * int(n) > 4:
+            (offset,) = np.frombuffer(data, dtype=order + "u4", count=1, offset=entry + 8)
+        values = np.frombuffer(data, dtype=dtype, count=int(n), offset=int(offset))
+        if code == "S1":
+            values = values.tobytes().rstrip(b"\0").decode("ascii", "replace")
+        tags[int(tag)] = values
+    return tags
+
+
+def _geo_keys(directory):
+    """{key: value} of the GeoKeyDirectory's short-valued keys."""
+    if directory is None or len(directory) < 4:
+        return {}
+    entries = directory[4:4 + 4 * int(directory[3])].reshape(-1, 4)
+    return {int(key): int(value) for key, location, _, value in entries if location == 0}
+
+
+class DEM:
+    """
+    A memory-mapped GeoTIFF elevation raster. Raises ValueError for files
+    it cannot read (see the module docstring).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        data = self._data = np.memmap(path, dtype=np.uint8, mode="r")
+        order = {b"II": "<", b"MM": ">"}.get(data[:2].tobytes())
+        if order is None:
+            raise ValueError(f"{path} is not a TIFF file")
+        (version,) = np.frombuffer(data, dtype=order + "u2", count=1, offset=2)
+        if version != 42:
+            raise ValueError(f"{path}: only classic (not BigTIFF) files are supported")
+        tags = _read_tags(data, order)
+
+        def tag(number, default=None):
+            values = tags.get(number)
+            return default if values is None else int(values[0])
+
+        self.width, self.height = tag(TAG_WIDTH), tag(TAG_HEIGHT)
+        if tag(TAG_COMPRESSION, 1) != 1:
+            raise ValueError(f"{path} is compressed; convert it with gdal_translate -co COMPRESS=NONE")
+        if tag(TAG_SAMPLES_PER_PIXEL, 1) != 1:
+            raise ValueError(f"{path} has more than one band")
+        code = _SAMPLE_TYPES.get((tag(TAG_SAMPLE_FORMAT, 1), tag(TAG_BITS_PER_SAMPLE, 8)))
+        if code is None:
+            raise ValueError(f"{path} has an unsupported sample type")
+        self.dtype = np.dtype(order + code)
+
+        # Strips are tiles as wide as the image, so both index the same way
+        if TAG_TILE_OFFSETS in tags:
+            self._block = (tag(TAG_TILE_LENGTH), tag(TAG_TILE_WIDTH))
+            offsets = tags[TAG_TILE_OFFSETS]
+        else:
+            self._block = (min(tag(TAG_ROWS_PER_STRIP, self.height), self.height), self.width)
+            offsets = tags[TAG_STRIP_OFFSETS]
+        self._offsets = offsets.astype(np.int64)
+        self._blocks_across = -(-self.width // self._block[1])
+
+        scale, tiepoint = tags.get(TAG_PIXEL_SCALE), tags.get(TAG_TIEPOINT)
+        if scale is None or tiepoint is None:
+            raise ValueError(f"{path} is not georeferenced (no pixel scale and tiepoint)")
+        keys = _geo_keys(tags.get(TAG_GEO_KEYS))
+        # Pixel centers sit half a pixel in from the corner a PixelIsArea tiepoint names
+        half = 0.5 if keys.get(KEY_RASTER_TYPE, 1) == 1 else 0.0
+        self._scale = (float(scale[0]), float(scale[1]))
+        self._origin = (float(tiepoint[3]), float(tiepoint[4]))
+        self._tie = (float(tiepoint[0]) - half, float(tiepoint[1]) - half)
+
+        self._project = None
+        model = keys.get(KEY_MODEL_TYPE, MODEL_GEOGRAPHIC)
+        if model == MODEL_PROJECTED:
+            epsg = keys.get(KEY_PROJECTED_CRS)
+            if Transformer is None or epsg is None or epsg == 32767:
+                raise ValueError(f"{path} is projected; install pyproj (EPSG-coded CRS only) "
+                                 "or reproject it with gdalwarp -t_srs EPSG:4326")
+            self._project = Transformer.from_crs("EPSG:4326", f"EPSG:{epsg}", always_xy=True).transform
+        elif model != MODEL_GEOGRAPHIC:
+            raise ValueError(f"{path} has an unsupported model type {model}")
+
+        nodata = tags.get(TAG_GDAL_NODATA)
+        self.nodata = float(nodata) if isinstance(nodata, str) and nodata.strip() else None
+
+    def _pixels(self, rows, cols):
+        """Values of the pixels at integer (rows, cols), NaN where nodata."""
+        block_rows, block_cols = self._block
+        block = (rows // block_rows) * self._blocks_across + cols // block_cols
+        within = (rows % block_rows) * block_cols + cols % block_cols
+        start = self._offsets[block] + within * self.dtype.itemsize
+        raw = self._data[start[:, None] + np.arange(self.dtype.itemsize)]
+        values = raw.reshape(-1).view(self.dtype).astype(np.float64)
+        if self.nodata is not None:
+            values[values == self.nodata] = np.nan
+        return values
+
+    def sample(self, lat, lng):
+        """Bilinearly interpolated elevations at arrays of points, NaN outside the raster."""
+        x, y = (lng, lat) if self._project is None else self._project(lng, lat)
+        col = (np.asarray(x) - self._origin[0]) / self._scale[0] + self._tie[0]
+        row = (self._origin[1] - np.asarray(y)) / self._scale[1] + self._tie[1]
+        # The outer half pixel takes the edge pixels' values
+        inside = (col >= -0.5) & (row >= -0.5) & (col <= self.width - 0.5) & (row <= self.height - 0.5)
+        c0 = np.clip(np.floor(col), 0, max(self.width - 2, 0)).astype(np.int64)
+        r0 = np.clip(np.floor(row), 0, max(self.height - 2, 0)).astype(np.int64)
+        c1 = np.minimum(c0 + 1, self.width - 1)
+        r1 = np.minimum(r0 + 1, self.height - 1)
+        fc = np.clip(col - c0, 0.0, 1.0)
+        fr = np.clip(row - r0, 0.0, 1.0)
+        # One gather for all four neighbours
+        n = len(c0)
+        z = self._pixels(np.concatenate((r0, r0, r1, r1)), np.concatenate((c0, c1, c0, c1)))
+        top = z[:n] * (1 - fc) + z[n:2 * n] * fc
+        bottom = z[2 * n:3 * n] * (1 - fc) + z[3 * n:] * fc
+        elevation = top * (1 - fr) + bottom * fr
+        elevation[~inside] = np.nan
+        return elevation
+
+
+def _haversine_m(lat1, lng1, lat2, lng2):
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    a = (np.sin((phi2 - phi1) / 2) ** 2
+         + np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+def grade_profiles(dem, lat1, lng1, lat2, lng2, step_m):
+    """
+    Grades along straight lines, all sampled in one vectorized pass. Each
+    line is cut into equal segments of at most step_m.
+    Returns (counts, lengths, grades): the number and length (m) of each
+    line's segments, and the signed grade (%) of every segment, line after
+    line; NaN where the DEM has no data.
+    """
+    length = _haversine_m(lat1, lng1, lat2, lng2)
+    counts = np.maximum(1, np.ceil(length / step_m)).astype(np.int64)
+    points = counts + 1
+    line = np.repeat(np.arange(len(counts)), points)
+    first = np.cumsum(points) - points
+    t = (np.arange(int(points.sum())) - first[line]) / counts[line]
+    elevation = dem.sample(lat1[line] + (lat2 - lat1)[line] * t, lng1[line] + (lng2 - lng1)[line] * t)
+    rise = np.delete(np.diff(elevation), first[1:] - 1)  # drop the steps from one line to the next
+    lengths = length / counts
+    return counts, lengths, 100.0 * rise / np.repeat(lengths, counts)
+
+
+def ingest(dem, step_m, batch_size=1000):
+    """
+    Store the grade profile and maximum grade of every path the DEM covers.
+    Rows whose profile did not change are not written, so a re-import only
+    resyncs the paths it actually moved.
+    Returns (updated, unchanged, uncovered) path counts.
+    """
+    start, end = aliased(Building), aliased(Building)
+    rows = [row for row in db.session.query(
+        Path.path_id, start.latitude, start.longitude, end.latitude, end.longitude,
+        Path.max_grade, Path.grade_profile,
+    ).join(start, Path.start_location_id == start.building_id).join(
+        end, Path.end_location_id == end.building_id
+    ) if None not in row[1:5] and row[1:3] != row[3:5]]
+    if not rows:
+        return 0, 0, 0
+
+    coords = np.array([row[1:5] for row in rows], dtype=np.float64)
+    counts, lengths, grades = grade_profiles(dem, *coords.T, step_m)
+    bounds = np.cumsum(counts) - counts
+    # NaN (no data anywhere along a path) propagates into its maximum
+    steepest = np.maximum.reduceat(np.abs(grades), bounds)
+    grades = np.round(grades, 2).tolist()
+    lengths = np.round(lengths, 2).tolist()
+
+    changes = []
+    unchanged = uncovered = 0
+    for i, (path_id, *_, old_max, old_profile) in enumerate(rows):
+        if math.isnan(steepest[i]):
+            uncovered += 1
+            continue
+        profile = [[lengths[i], g] for g in grades[bounds[i]:bounds[i] + counts[i]]]
+        max_grade = round(float(steepest[i]), 2)
+        if old_max == max_grade and old_profile == profile:
+            unchanged += 1
+            continue
+        changes.append({"path_id": path_id, "max_grade": max_grade, "grade_profile": profile})
+
+    if changes:
+        # Bulk updates skip onupdate, and delta sync needs the time of this write
+        now = utcnow()
+        try:
+            for i in range(0, len(changes), batch_size):
+                batch = changes[i:i + batch_size]
+                for change in batch:
+                    change["updated_at"] = now
+                db.session.execute(update(Path), batch)
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            campus_reloaded()
+    return len(changes), unchanged, uncovered
+
+
+#-------------------------------------------------------------------------
+# CLI
+#-------------------------------------------------------------------------
+
+@click.command('import-dem')
+@click.argument('source', type=click.Path(exists=True, dir_okay=False))
+@click.option('--step', 'step_m', type=float, default=None,
+              help='Sampling interval in meters (default DEM_SAMPLE_STEP_M).')
+@with_appcontext
+def import_dem_command(source, step_m):
+    """Store path grades sampled from the GeoTIFF elevation model SOURCE."""
+    try:
+        dem = DEM(source)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    if step_m is None:
+        step_m = current_app.config["DEM_SAMPLE_STEP_M"]
+    if not step_m > 0:
+        raise click.BadParameter("must be a positive number of meters", param_hint="--step")
+    updated, unchanged, uncovered = ingest(dem, step_m)
+    click.echo(f"{updated} path(s) updated, {unchanged} unchanged, {uncovered} outside the DEM")
@@ -0,0 +1,107 @@
+"""
+Compact encodings for route geometry.
+
+Routes are computed and cached with geometry as a list of {"lat", "lng"}
+points (plus "level" indoors); this module only changes how a response
+spells it out:
+
+  geojson    the list of point objects (default)
+  polyline6  Google encoded polyline at 1e-6 degrees, as OSRM and most
+             map SDKs decode it
+  delta      base64 of zigzag varint deltas at 1e-6 degrees, lat then lng
+
+Either encoding can be combined with Douglas-Peucker simplification
+within `tolerance` meters. Points where the floor level changes are
+always kept, and encoded routes list the per-point levels in
+"geometry_levels" when any point is indoors.
+"""
+import base64
+import math
+
+from app.mvt import simplify_mask
+
+FORMATS = ("geojson", "polyline6", "delta")
+SCALE = 1e6
+METERS_PER_DEG_LAT = 111320.0
+
+
+def simplify_points(points, tolerance_m):
+    """Douglas-Peucker over {"lat", "lng"} points, separately on every floor level run."""
+    if tolerance_m <= 0 or len(points) < 3:
+        return list(points)
+    kx = math.cos(math.radians(points[0]["lat"])) * METERS_PER_DEG_LAT
+    out = []
+    start = 0
+    for end in range(1, len(points) + 1):
+        if end < len(points) and points[end].get("level") == points[start].get("level"):
+            continue
+        run = points[start:end]
+        mask = simplify_mask([(p["lng"] * kx, p["lat"] * METERS_PER_DEG_LAT) for p in run], tolerance_m)
+        out.extend(p for p, kept in zip(run, mask) if kept)
+        start = end
+    return out
+
+
+def _polyline_value(value, out):
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        out.append(chr((0x20 | (value & 0x1F)) + 63))
+        value >>= 5
+    out.append(chr(value + 63))
+
+
+def encode_polyline(points):
+    out = []
+    prev_lat = prev_lng = 0
+    for p in points:
+        lat = int(round(p["lat"] * SCALE))
+        lng = int(round(p["lng"] * SCALE))
+        _polyline_value(lat - prev_lat, out)
+        _polyline_value(lng - prev_lng, out)
+        prev_lat, prev_lng = lat, lng
+    return "".join(out)
+
+
+def _varint(value, out):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def encode_delta(points):
+    out = bytearray()
+    prev_lat = prev_lng = 0
+    for p in points:
+        lat = int(round(p["lat"] * SCALE))
+        lng = int(round(p["lng"] * SCALE))
+        for delta in (lat - prev_lat, lng - prev_lng):
+            _varint((delta << 1) ^ (delta >> 63), out)
+        prev_lat, prev_lng = lat, lng
+    return base64.b64encode(bytes(out)).decode("ascii")
+
+
+ENCODERS = {"polyline6": encode_polyline, "delta": encode_delta}
+
+
+def _format_one(route, fmt, tolerance_m):
+    route = dict(route)
+    points = simplify_points(route["geometry"], tolerance_m)
+    if fmt == "geojson":
+        route["geometry"] = points
+        return route
+    route["geometry"] = ENCODERS[fmt](points)
+    route["geometry_format"] = fmt
+    if any("level" in p for p in points):
+        route["geometry_levels"] = [p.get("level") for p in points]
+    return route
+
+
+def format_route(route, fmt="geojson", tolerance_m=0.0):
+    """A route response (and its alternatives) with geometry in fmt, simplified within tolerance_m."""
+    if fmt == "geojson" and tolerance_m <= 0:
+        return route
+    formatted = _format_one(route, fmt, tolerance_m)
+    if route.get("alternatives"):
+        formatted["alternatives"] = [_format_one(r, fmt, tolerance_m) for r in route["alternatives"]]
+    return formatted
@@ -0,0 +1,135 @@
+"""
+Shared, versioned snapshot of the routing graph.
+
+Under a multi-worker server every process used to load the Building,
+Entrance, Path and IndoorFeature rows and build its own CampusGraph (plus
+the per-profile weights and the A* heuristic scale). Instead the first
+worker to need a graph writes it to one memory-mapped file (see
+app/mmap_store.py) and every worker wraps those arrays in place: the pages
+are shared through the OS page cache, and a worker that starts after the
+file exists only maps it.
+
+The file records the campus version it was built from, a fingerprint of
+the campus tables (row counts and latest updated_at). Every
+GRAPH_SNAPSHOT_CHECK_S a worker stats the file for a newer one published
+by another worker and compares its version against the database, so
+changes made through another worker or the CLI reach every process.
+New versions replace the file atomically; a worker keeps using the graph
+it has mapped until it swaps to the new one.
+
+The route table and contraction hierarchies are already shared the same
+way (app/route_table.py, app/contraction.py). The spatial index stays per
+process: obstacle reports update it incrementally every few seconds.
+"""
+import os
+import threading
+import time
+
+import click
+from flask.cli import with_appcontext
+
+from app.mmap_store import MappedArrays, open_if_changed, write_arrays
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; writes are then only serialized per process
+    fcntl = None
+
+
+class GraphSnapshot:
+    """The graph snapshot file of this deployment and when to look at it again."""
+
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.check_s = 5.0
+        self._mapped = None
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.writes = 0
+        self.checks = 0
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config["GRAPH_SNAPSHOT_ENABLED"]
+        self.path = config["GRAPH_SNAPSHOT_PATH"] or os.path.join(app.instance_path, "graph.bin")
+        self.check_s = config["GRAPH_SNAPSHOT_CHECK_S"]
+        self._mapped = None
+
+    def check_due(self, last_check):
+        """Whether a graph last checked at last_check (time.monotonic()) should be checked again."""
+        return self.enabled and self.check_s > 0 and time.monotonic() - last_check >= self.check_s
+
+    def read(self):
+        """The current snapshot file, or None if there is none (or it is not a graph snapshot)."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            mapped = open_if_changed(self.path, self._mapped)
+            if mapped is not None and mapped.meta.get("kind") != "graph":
+                mapped = None
+            if mapped is not None and mapped is not self._mapped:
+                self.loads += 1
+            self._mapped = mapped
+            return mapped
+
+    def newer(self, identity):
+        """The snapshot file if it was replaced since the one with identity was read, else None."""
+        self.checks += 1
+        mapped = self.read()
+        if mapped is None or mapped.identity == identity:
+            return None
+        return mapped
+
+    def write(self, meta, arrays):
+        """
+        Publish a new snapshot and return it mapped, or None when disabled
+        or another process is writing one right now.
+        """
+        if not self.enabled:
+            return None
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".lock", "a") as lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return None
+            try:
+                write_arrays(self.path, dict(meta, kind="graph"), arrays)
+                mapped = MappedArrays(self.path)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        with self._lock:
+            self._mapped = mapped
+            self.writes += 1
+        return mapped
+
+    def stats(self):
+        mapped = self._mapped
+        return {
+            "enabled": self.enabled,
+            "version": mapped.meta.get("version") if mapped is not None else None,
+            "loads": self.loads,
+            "writes": self.writes,
+            "checks": self.checks,
+        }
+
+
+graph_snapshot = GraphSnapshot()
+
+
+@click.command('build-graph-snapshot')
+@with_appcontext
+def build_graph_snapshot_command():
+    """Load the campus graph from the database and publish it as the shared snapshot."""
+    from app import routing_engine
+    if not graph_snapshot.enabled:
+        raise click.ClickException("GRAPH_SNAPSHOT_ENABLED is off")
+    version = routing_engine.campus_version()
+    graph = routing_engine.load_graph()
+    graph.version = version
+    if graph_snapshot.write(*graph.arrays()) is None:
+        raise click.ClickException("Another process is writing the snapshot; try again")
+    click.echo(f"{graph.node_count} node(s), {graph.edge_count} edge(s) -> {graph_snapshot.path}")
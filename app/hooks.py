@@ -0,0 +1,149 @@
+"""
+Change hooks.
+
+Called after a successful commit by anything that writes campus data (the
+API handlers, bulk import) so the in-memory routing graph, caches and
+spatial index follow the database.
+"""
+from app import routing_engine, obstacle_filter, schedule
+from app.indoor import floor_plans
+from app.obstacle_feed import obstacle_feed, obstacle_json
+from app.response_cache import collection_cache
+from app.route_cache import route_cache
+from app.spatial_index import spatial_index, ENTRANCE, OBSTACLE
+from app.tiles import tile_cache
+
+
+def _path_edge(path):
+    """((lat, lng), (lat, lng), length) for a path, or None if a building has no coordinates."""
+    start, end = path.start_location, path.end_location
+    if start is None or end is None or None in (start.latitude, start.longitude, end.latitude, end.longitude):
+        return None
+    u = (float(start.latitude), float(start.longitude))
+    v = (float(end.latitude), float(end.longitude))
+    length = float(path.distance) if path.distance is not None else routing_engine.haversine_m(*u, *v)
+    return u, v, length
+
+
+def building_changed(building, deleted=False, previous=None):
+    """previous: (latitude, longitude) before an update."""
+    routing_engine.invalidate_graph()
+    collection_cache.invalidate('buildings')
+    # Buildings move snapping targets for every route, so start over
+    route_cache.clear()
+    # Floor plans carry the building's position as their viewpoint
+    floor_plans.invalidate(building.building_id)
+    if deleted:
+        # Entrances, paths and obstacles cascade with the building
+        spatial_index.clear()
+        obstacle_filter.invalidate()
+        collection_cache.invalidate('entrances', 'paths', 'obstacles')
+        tile_cache.clear()
+        # Cascaded obstacles are gone without a trace: tell stream clients to refetch
+        obstacle_feed.publish('reset', {})
+    else:
+        spatial_index.upsert_building(building)
+        tile_cache.invalidate_building(building, previous)
+
+
+def entrance_changed(entrance, deleted=False, previous=None):
+    """previous: (latitude, longitude) before an update."""
+    routing_engine.invalidate_graph()
+    collection_cache.invalidate('entrances')
+    route_cache.clear()
+    tile_cache.invalidate_point('entrance', entrance.latitude, entrance.longitude)
+    if previous is not None:
+        tile_cache.invalidate_point('entrance', *previous)
+    if deleted:
+        spatial_index.remove(ENTRANCE, entrance.entrance_id)
+        spatial_index.remove_where(OBSTACLE, entrance_id=entrance.entrance_id)
+        obstacle_filter.invalidate()
+        collection_cache.invalidate('obstacles')
+        # Cascaded obstacles could be anywhere
+        tile_cache.clear('obstacle')
+        obstacle_feed.publish('reset', {})
+    else:
+        spatial_index.upsert_entrance(entrance)
+
+
+def path_changed(path, deleted=False, previous=None):
+    """previous: (start_location_id, end_location_id) before an update."""
+    routing_engine.invalidate_graph()
+    collection_cache.invalidate('paths')
+    tile_cache.invalidate_path(path.start_location_id, path.end_location_id)
+    if previous is not None and previous != (path.start_location_id, path.end_location_id):
+        tile_cache.invalidate_path(*previous)
+    if deleted:
+        route_cache.invalidate_path(path.path_id)
+        spatial_index.remove_where(OBSTACLE, path_id=path.path_id)
+        obstacle_filter.invalidate()
+        collection_cache.invalidate('obstacles')
+        tile_cache.clear('obstacle')
+        obstacle_feed.publish('reset', {})
+    else:
+        route_cache.invalidate_path(path.path_id, _path_edge(path))
+
+
+def obstacle_changed(obstacle, previous=None, deleted=False):
+    """previous: (latitude, longitude, path_id) before an update."""
+    obstacle_filter.invalidate()
+    if obstacle.starts_at is not None or obstacle.ends_at is not None or previous is not None:
+        # Obstacle windows split the route cache's time segments
+        schedule.invalidate()
+    collection_cache.invalidate('obstacles')
+    if previous is not None:
+        route_cache.invalidate_obstacle(*previous, obstacle_id=obstacle.obstacle_id)
+    route_cache.invalidate_obstacle(obstacle.latitude, obstacle.longitude, obstacle.path_id,
+                                    obstacle_id=obstacle.obstacle_id)
+    tile_cache.invalidate_point('obstacle', obstacle.latitude, obstacle.longitude)
+    if previous is not None:
+        tile_cache.invalidate_point('obstacle', previous[0], previous[1])
+    if deleted:
+        spatial_index.remove(OBSTACLE, obstacle.obstacle_id)
+        obstacle_feed.publish('deleted', {'obstacle_id': obstacle.obstacle_id})
+    else:
+        obstacle_feed.publish('created' if previous is None else 'updated', obstacle_json(obstacle))
+        spatial_index.upsert_obstacle(obstacle)
+
+
+def closure_changed(closure, deleted=False):
+    schedule.invalidate()
+    # Closures are rare and can cut any route in two: start over
+    route_cache.clear()
+
+
+def graph_replaced():
+    """
+    Called by routing_engine.get_graph when it swaps in a graph built after a
+    change made by another worker or the CLI: the graph-keyed caches
+    (schedule, route table, contraction) follow by themselves, the rest of
+    this process's copies are dropped here.
+    """
+    route_cache.clear()
+    spatial_index.clear()
+    floor_plans.invalidate()
+    collection_cache.invalidate('buildings', 'entrances', 'paths')
+
+
+def obstacles_replaced():
+    """
+    Called by obstacle_filter.get_active_obstacles when it finds obstacles
+    changed by another worker: drop what this process derived from the old ones.
+    """
+    schedule.invalidate()
+    route_cache.clear()
+    spatial_index.clear()
+    collection_cache.invalidate('obstacles')
+
+
+def campus_reloaded():
+    """Forget every derived structure after a bulk change to the campus tables."""
+    routing_engine.invalidate_graph()
+    obstacle_filter.invalidate()
+    schedule.invalidate()
+    route_cache.clear()
+    spatial_index.clear()
+    floor_plans.invalidate()
+    tile_cache.clear()
+    obstacle_feed.publish('reset', {})
+    collection_cache.invalidate('buildings', 'entrances', 'paths', 'obstacles')
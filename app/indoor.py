@@ -0,0 +1,120 @@
+"""
+Pre-compressed indoor floor plans.
+
+A building's IndoorFeature rows are read in one query the first time any
+of its floors is requested, turned into one GeoJSON FeatureCollection per
+floor and gzip-compressed, and kept keyed by (building_id, level) until a
+change hook invalidates the building. Serving a floor is then a dict
+lookup: gzip-capable clients get the stored bytes as they are, anyone
+else gets them decompressed.
+"""
+import gzip
+import hashlib
+import json
+import threading
+
+from flask import Response, request
+
+from app import db
+from app.metrics import metrics
+from app.models import IndoorFeature
+
+FLOOR_PLAN_ZOOM = 19
+
+
+def _feature(row):
+    properties = {'category': row.category}
+    if row.name:
+        properties['name'] = row.name
+    if row.ref:
+        properties['ref'] = row.ref
+    if row.wheelchair_accessible is not None:
+        properties['wheelchair'] = "yes" if row.wheelchair_accessible else "no"
+    return {"type": "Feature", "id": row.feature_id, "properties": properties, "geometry": row.geometry}
+
+
+class FloorPlanCache:
+    """{building_id: {level: (gzip body, etag)}}, rebuilt per building after invalidate()."""
+
+    def __init__(self):
+        self._plans = {}
+        self._versions = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _build(self, building):
+        rows = db.session.query(IndoorFeature).filter(
+            IndoorFeature.building_id == building.building_id
+        ).order_by(IndoorFeature.level, IndoorFeature.feature_id)
+        by_level = {}
+        for row in rows:
+            by_level.setdefault(row.level, []).append(_feature(row))
+
+        center = None
+        if building.latitude is not None and building.longitude is not None:
+            center = {"lat": float(building.latitude), "lng": float(building.longitude)}
+        plans = {}
+        for level, features in by_level.items():
+            data = {
+                "type": "FeatureCollection",
+                "properties": {
+                    "building_id": building.building_id,
+                    "level": level,
+                    "viewpoint": {"center": center, "zoom": FLOOR_PLAN_ZOOM},
+                },
+                "features": features,
+            }
+            with metrics.span("serialize"):
+                body = json.dumps(data, separators=(",", ":")).encode("utf-8")
+                # mtime=0 keeps the bytes, and so the ETag, identical across workers
+                compressed = gzip.compress(body, compresslevel=9, mtime=0)
+            plans[level] = (compressed, hashlib.sha1(body).hexdigest()[:27])
+        return plans
+
+    def plans(self, building):
+        """{level: (gzip body, etag)} for a building, built on first use."""
+        building_id = building.building_id
+        plans = self._plans.get(building_id)
+        if plans is not None:
+            return plans
+        with self._lock:
+            version = (self._generation, self._versions.get(building_id, 0))
+        plans = self._build(building)
+        with self._lock:
+            # Only keep it if no write happened while we were building
+            if (self._generation, self._versions.get(building_id, 0)) == version:
+                self._plans[building_id] = plans
+        return plans
+
+    def levels(self, building):
+        return sorted(self.plans(building))
+
+    def invalidate(self, building_id=None):
+        """Forget one building's plans, or every building's when building_id is None."""
+        with self._lock:
+            if building_id is None:
+                self._generation += 1
+                self._plans.clear()
+            else:
+                self._versions[building_id] = self._versions.get(building_id, 0) + 1
+                self._plans.pop(building_id, None)
+
+    def response(self, building, level):
+        """GeoJSON response for one floor, or None if the building has no plan for it."""
+        entry = self.plans(building).get(level)
+        if entry is None:
+            return None
+        body, etag = entry
+        if request.accept_encodings["gzip"]:
+            response = Response(body, mimetype="application/geo+json")
+            response.headers["Content-Encoding"] = "gzip"
+            etag += "-gzip"
+        else:
+            response = Response(gzip.decompress(body), mimetype="application/geo+json")
+        response.vary.add("Accept-Encoding")
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+
+floor_plans = FloorPlanCache()
@@ -0,0 +1,95 @@
+"""
+Logging setup for the app package.
+
+Every module logs through logging.getLogger(__name__) under the "app"
+logger, which gets one handler here: records are written as one JSON
+object per line (or plain text with LOG_FORMAT=text), any `extra=` fields
+become structured keys, and identical messages are rate limited so a
+failing OSRM host cannot flood the log at request rate.
+"""
+import json
+import logging
+import threading
+import time
+
+# Attributes every LogRecord has; anything else came in through extra=
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        text = super().format(record)
+        extra = {k: v for k, v in vars(record).items() if k not in _RECORD_FIELDS}
+        if extra:
+            text += " " + " ".join(f"{k}={v}" for k, v in extra.items())
+        return text
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most `burst` records per `period` seconds for each
+    (logger, level, message template); the next record that gets through
+    carries the number that were dropped as `suppressed`.
+    """
+
+    def __init__(self, burst=10, period=60.0):
+        super().__init__()
+        self.burst = burst
+        self.period = period
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.burst <= 0:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.period:
+                suppressed = window[2] if window is not None else 0
+                window = self._windows[key] = [now, 0, 0]
+            else:
+                suppressed = 0
+            if window[1] >= self.burst:
+                window[2] += 1
+                return False
+            window[1] += 1
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+def configure_logging(app):
+    config = app.config
+    logger = logging.getLogger("app")
+    logger.setLevel(config["LOG_LEVEL"].upper())
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(JSONFormatter() if config["LOG_FORMAT"] == "json" else TextFormatter())
+    handler.addFilter(RateLimitFilter(config["LOG_RATE_LIMIT"], config["LOG_RATE_PERIOD_S"]))
+    # Replace rather than stack handlers when create_app() runs more than once
+    for old in [h for h in logger.handlers if getattr(h, "_mobinav", False)]:
+        logger.removeHandler(old)
+    handler._mobinav = True
+    logger.addHandler(handler)
+    logger.propagate = False
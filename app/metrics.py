@@ -0,0 +1,236 @@
+"""
+In-process request metrics.
+
+Timing spans (total request time, each SQL statement, outbound routing
+calls, serialization, ...) are aggregated into Prometheus-style
+histograms served by /metrics, and each response carries a Server-Timing
+header with that request's own breakdown so a slow /api/get_route can be
+attributed to Flask, the database, OSRM or our own code from the browser's
+network tab.
+
+With PROFILER_ENABLED set, adding ?profile=1 to a request samples its
+thread's stack every PROFILER_INTERVAL_MS and returns the folded stacks
+(flamegraph.pl / speedscope format) instead of the normal body.
+"""
+import bisect
+import collections
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Seconds; tuned for a campus API where most requests take 1-100 ms
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values."""
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # One slot per bucket plus +Inf, then sum
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def _label_text(self, label_values, extra=None):
+        pairs = list(zip(self.labels, label_values))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+        return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for label_values, counts in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else repr(float(bound))
+                lines.append(f"{self.name}_bucket{self._label_text(label_values, ('le', le))} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(label_values)} {counts[-1]!r}")
+            lines.append(f"{self.name}_count{self._label_text(label_values)} {cumulative}")
+        return lines
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack on a timer until stop()."""
+
+    def __init__(self, thread_id, interval_s=0.001):
+        self.thread_id = thread_id
+        self.interval_s = interval_s
+        self.samples = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+class Metrics:
+    """Histogram registry plus the Flask and SQLAlchemy hooks that feed it."""
+
+    def __init__(self):
+        self.requests = Histogram(
+            "mobinav_http_request_duration_seconds", "Time spent handling HTTP requests.",
+            ("method", "endpoint", "status"))
+        self.queries = Histogram(
+            "mobinav_db_query_duration_seconds", "Time spent executing SQL statements.",
+            ("statement",))
+        self.spans = Histogram(
+            "mobinav_span_duration_seconds",
+            "Time spent in named sections: outbound routing calls, serialization, route checks.",
+            ("span",))
+        self.histograms = [self.requests, self.queries, self.spans]
+        self.enabled = True
+        self.profiler_enabled = False
+        self.profiler_interval_s = 0.001
+        self._engine_hooked = False
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config["METRICS_ENABLED"]
+        self.profiler_enabled = config["PROFILER_ENABLED"]
+        self.profiler_interval_s = config["PROFILER_INTERVAL_MS"] / 1000.0
+        if not self.enabled:
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        if not self._engine_hooked:
+            # Class-level listeners cover every engine, including ones created later
+            event.listen(Engine, "before_cursor_execute", self._before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", self._after_cursor_execute)
+            self._engine_hooked = True
+
+    # --- Spans ---
+
+    def _add_to_request(self, name, elapsed):
+        if has_request_context() and "timings" in g:
+            entry = g.timings.get(name)
+            if entry is None:
+                g.timings[name] = [elapsed, 1]
+            else:
+                entry[0] += elapsed
+                entry[1] += 1
+
+    def record(self, name, elapsed):
+        """Record an already-measured span of `elapsed` seconds."""
+        if not self.enabled:
+            return
+        self.spans.observe(elapsed, name)
+        self._add_to_request(name, elapsed)
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    # --- SQLAlchemy hooks ---
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("query_start")
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        self.queries.observe(elapsed, verb)
+        self._add_to_request("db", elapsed)
+
+    # --- Flask hooks ---
+
+    def _before_request(self):
+        g.timings = {}
+        g.request_start = time.perf_counter()
+        if self.profiler_enabled and request.args.get("profile") == "1":
+            g.profiler = SamplingProfiler(threading.get_ident(), self.profiler_interval_s).start()
+
+    def _after_request(self, response):
+        start = g.pop("request_start", None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        self.requests.observe(elapsed, request.method, endpoint, str(response.status_code))
+
+        # Streaming bodies are still being produced, so their total is only the setup time
+        parts = [f"app;dur={elapsed * 1000:.2f}"]
+        for name, (total, count) in g.pop("timings", {}).items():
+            parts.append(f'{name};dur={total * 1000:.2f};desc="{count}x"')
+        response.headers["Server-Timing"] = ", ".join(parts)
+
+        profiler = g.pop("profiler", None)
+        if profiler is not None:
+            profiler.stop()
+            profiled = Response(profiler.folded(), mimetype="text/plain")
+            profiled.headers["Server-Timing"] = response.headers["Server-Timing"]
+            profiled.headers["X-Profiled-Status"] = str(response.status_code)
+            return profiled
+        return response
+
+    # --- Exposition ---
+
+    def render(self, extra=()):
+        """
+        Prometheus text exposition. extra: (name, type, help, value) tuples
+        for values owned by other modules, e.g. route cache counters.
+        """
+        lines = []
+        for histogram in self.histograms:
+            lines.extend(histogram.render())
+        for name, kind, help_text, value in extra:
+            lines.extend((f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value!r}"))
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        for histogram in self.histograms:
+            histogram.clear()
+
+
+metrics = Metrics()
@@ -0,0 +1,98 @@
+"""
+Named NumPy arrays in one memory-mappable file.
+
+Layout: MAGIC, a little-endian uint64 header length, a JSON header
+(caller metadata plus dtype/shape/offset of every array), then the raw
+arrays, each aligned to 64 bytes. Files are written to a temporary name
+and renamed into place, so readers in other worker processes either see
+the old file or the complete new one; an already mapped old file stays
+valid after the rename.
+"""
+import json
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b"MNARRS1\n"
+ALIGN = 64
+
+
+def _aligned(n):
+    return -(-n // ALIGN) * ALIGN
+
+
+class MappedArrays:
+    """
+    Read-only view of a file written by write_arrays. The arrays are
+    attributes backed by a shared, copy-on-nothing memory map; `meta` is the
+    caller's metadata and `identity` changes whenever the file is replaced.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            prefix = f.read(len(MAGIC) + 8)
+            if len(prefix) < len(MAGIC) + 8 or prefix[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} is not an array file")
+            (header_len,) = struct.unpack("<Q", prefix[len(MAGIC):])
+            header = json.loads(f.read(header_len))
+            # Map the file already open, not the path: a writer may have
+            # replaced it since, and header, data and identity must agree
+            mapped = np.memmap(f, dtype=np.uint8, mode="r")
+        self.path = path
+        self.identity = (stat.st_ino, stat.st_mtime_ns)
+        self.meta = header["meta"]
+        self.names = tuple(header["arrays"])
+        for name, (dtype, shape, offset) in header["arrays"].items():
+            count = int(np.prod(shape))
+            setattr(self, name, np.frombuffer(mapped, dtype=dtype, count=count, offset=offset).reshape(shape))
+
+
+def write_arrays(path, meta, arrays):
+    """Write {name: ndarray} plus JSON-serializable meta to path atomically."""
+    layout = {}
+    offset = 0
+    for name, value in arrays.items():
+        layout[name] = (value.dtype.str, list(value.shape), offset)
+        offset += _aligned(value.nbytes)
+
+    def encode(base):
+        return json.dumps({
+            "meta": meta,
+            "arrays": {name: [d, s, o + base] for name, (d, s, o) in layout.items()},
+        }).encode()
+
+    # The header length depends on the offsets it contains, so settle it first
+    base = 0
+    while True:
+        header = encode(base)
+        start = _aligned(len(MAGIC) + 8 + len(header))
+        if start == base:
+            break
+        base = start
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + struct.pack("<Q", len(header)) + header)
+        for name, value in arrays.items():
+            f.write(b"\0" * (base + layout[name][2] - f.tell()))
+            f.write(np.ascontiguousarray(value).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def open_if_changed(path, current):
+    """
+    `current` if it is still the file at path, else a fresh MappedArrays for
+    path (None when the file is missing or unreadable).
+    """
+    try:
+        stat = os.stat(path)
+        if current is not None and current.identity == (stat.st_ino, stat.st_mtime_ns):
+            return current
+        return MappedArrays(path)
+    except (OSError, ValueError):
+        return None
@@ -1,7 +1,12 @@
 from app import db
-from datetime import datetime
+from datetime import datetime, timezone
 from flask_login import UserMixin
 
+
+def utcnow():
+    """Naive UTC now for updated_at/deleted_at stamps (delta sync compares them)."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
 class User(db.Model, UserMixin):
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
@@ -12,6 +17,10 @@ class User(db.Model, UserMixin):
 
 class Building(db.Model):
     __tablename__ = 'building'
+    __table_args__ = (
+        db.Index('ix_building_lat_lng', 'latitude', 'longitude'),
+        db.Index('ix_building_updated_at', 'updated_at'),
+    )
     building_id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100))
     address = db.Column(db.String(10))
@@ -21,15 +30,21 @@ class Building(db.Model):
     zip_code = db.Column(db.String(10))
     latitude = db.Column(db.Numeric(9, 6))
     longitude = db.Column(db.Numeric(9, 6))
-    updated_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=utcnow, onupdate=utcnow)
     
     # Relationships
     entrances = db.relationship('Entrance', backref='building', cascade='all, delete-orphan')
+    floors = db.relationship('Floor', backref='building', cascade='all, delete-orphan', order_by='Floor.level')
+    indoor_features = db.relationship('IndoorFeature', backref='building', cascade='all, delete-orphan')
     start_paths = db.relationship('Path', foreign_keys='Path.start_location_id', backref='start_location', cascade='all, delete-orphan')
     end_paths = db.relationship('Path', foreign_keys='Path.end_location_id', backref='end_location', cascade='all, delete-orphan')
 
 class Entrance(db.Model):
     __tablename__ = 'entrance'
+    __table_args__ = (
+        db.Index('ix_entrance_lat_lng', 'latitude', 'longitude'),
+        db.Index('ix_entrance_updated_at', 'updated_at'),
+    )
     entrance_id = db.Column(db.Integer, primary_key=True)
     building_id = db.Column(db.Integer, db.ForeignKey('building.building_id', ondelete='CASCADE'))
     entrance_name = db.Column(db.Text)
@@ -37,10 +52,44 @@ class Entrance(db.Model):
     longitude = db.Column(db.Numeric(9, 6))
     floor_level = db.Column(db.Integer)
     wheelchair_accessible = db.Column(db.Boolean)
-    updated_at = db.Column(db.DateTime)
+    # {"mon": [["07:00", "22:00"]], ...} in campus local time; NULL: always open (see app/schedule.py)
+    opening_hours = db.Column(db.JSON)
+    updated_at = db.Column(db.DateTime, default=utcnow, onupdate=utcnow)
+
+class Floor(db.Model):
+    __tablename__ = 'floor'
+    __table_args__ = (
+        db.UniqueConstraint('building_id', 'level', name='uq_floor_building_level'),
+    )
+    floor_id = db.Column(db.Integer, primary_key=True)
+    building_id = db.Column(db.Integer, db.ForeignKey('building.building_id', ondelete='CASCADE'), nullable=False)
+    level = db.Column(db.Integer, nullable=False)  # matches Entrance.floor_level; basement is -1
+    name = db.Column(db.String(50))
+    is_default = db.Column(db.Boolean, default=False)
+    updated_at = db.Column(db.DateTime, default=utcnow, onupdate=utcnow)
+
+class IndoorFeature(db.Model):
+    __tablename__ = 'indoor_feature'
+    __table_args__ = (
+        db.Index('ix_indoor_feature_building_level', 'building_id', 'level'),
+    )
+    feature_id = db.Column(db.Integer, primary_key=True)
+    building_id = db.Column(db.Integer, db.ForeignKey('building.building_id', ondelete='CASCADE'), nullable=False)
+    level = db.Column(db.Integer, nullable=False)  # matches Floor.level and Entrance.floor_level
+    category = db.Column(db.String(50), nullable=False)  # room, corridor, elevator, stairs, ramp, wall, ...
+    name = db.Column(db.String(100))
+    ref = db.Column(db.String(50))  # room number; elevators/stairs/ramps with the same ref connect their floors
+    geometry = db.Column(db.JSON, nullable=False)  # GeoJSON geometry in [lng, lat] order
+    wheelchair_accessible = db.Column(db.Boolean)
+    updated_at = db.Column(db.DateTime, default=utcnow, onupdate=utcnow)
 
 class Path(db.Model):
     __tablename__ = 'path'
+    __table_args__ = (
+        db.Index('ix_path_start_location_id', 'start_location_id'),
+        db.Index('ix_path_end_location_id', 'end_location_id'),
+        db.Index('ix_path_updated_at', 'updated_at'),
+    )
     path_id = db.Column(db.Integer, primary_key=True)
     start_location_id = db.Column(db.Integer, db.ForeignKey('building.building_id', ondelete='CASCADE'))
     end_location_id = db.Column(db.Integer, db.ForeignKey('building.building_id', ondelete='CASCADE'))
@@ -48,12 +97,45 @@ class Path(db.Model):
     has_stairs = db.Column(db.Boolean)
     is_wheelchair_accessible = db.Column(db.Boolean)
     is_paved = db.Column(db.Boolean)
-    path_type = db.Column(db.ARRAY(db.String))
+    path_type = db.Column(db.ARRAY(db.String).with_variant(db.JSON, 'sqlite'))  # JSON list on SQLite (benchmarks, local dev)
     distance = db.Column(db.Numeric(5, 2))
-    updated_at = db.Column(db.DateTime)
+    # Sampled from a DEM by `flask import-dem`: steepest |grade| in percent, and
+    # [[length_m, grade_pct], ...] from start to end building (uphill positive)
+    max_grade = db.Column(db.Float)
+    grade_profile = db.Column(db.JSON)
+    updated_at = db.Column(db.DateTime, default=utcnow, onupdate=utcnow)
+
+class Tombstone(db.Model):
+    """A deleted building/entrance/path, kept so /api/sync can report the delete."""
+    __tablename__ = 'tombstone'
+    __table_args__ = (
+        db.Index('ix_tombstone_deleted_at', 'deleted_at'),
+    )
+    tombstone_id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(50), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+class Closure(db.Model):
+    """A scheduled closure of a path or an entrance; routes avoid it while it lasts."""
+    __tablename__ = 'closure'
+    __table_args__ = (
+        db.Index('ix_closure_ends_at', 'ends_at'),
+    )
+    closure_id = db.Column(db.Integer, primary_key=True)
+    path_id = db.Column(db.Integer, db.ForeignKey('path.path_id', ondelete='CASCADE'))
+    entrance_id = db.Column(db.Integer, db.ForeignKey('entrance.entrance_id', ondelete='CASCADE'))
+    starts_at = db.Column(db.DateTime)  # campus local time; NULL: closed now
+    ends_at = db.Column(db.DateTime)  # NULL: until further notice
+    reason = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, default=utcnow, onupdate=utcnow)
 
 class Obstacle(db.Model):
     __tablename__ = 'obstacle'
+    __table_args__ = (
+        db.Index('ix_obstacle_lat_lng', 'latitude', 'longitude'),
+        db.Index('ix_obstacle_updated_at', 'updated_at'),
+    )
     obstacle_id = db.Column(db.Integer, primary_key=True)
     latitude = db.Column(db.Float, nullable=False)
     longitude = db.Column(db.Float, nullable=False)
@@ -66,6 +148,12 @@ class Obstacle(db.Model):
     severity_level = db.Column(db.Integer)
     reported_at = db.Column(db.DateTime)
     status = db.Column(db.String(50))
+    report_count = db.Column(db.Integer, default=1)  # duplicate reports merged into this one
+    last_reported_at = db.Column(db.DateTime)
+    # Scheduled window (e.g. planned construction) in campus local time; NULL ends are open
+    starts_at = db.Column(db.DateTime)
+    ends_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=utcnow, onupdate=utcnow)
 
 class AccessibilityFeature(db.Model):
     id = db.Column(db.Integer, primary_key=True)
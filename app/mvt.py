@@ -0,0 +1,229 @@
+"""
+Mapbox Vector Tile (v2.1) encoding.
+
+Just enough protobuf to write the tile format by hand: varints, packed
+repeated uint32 fields and length-delimited messages. Geometry comes in
+as tile coordinates (0..extent, y pointing down); lines and polygons are
+simplified with Douglas-Peucker before encoding, so the same tolerance
+in tile units removes more detail on low zooms than on high ones.
+"""
+import struct
+
+EXTENT = 4096
+
+POINT = 1
+LINESTRING = 2
+POLYGON = 3
+
+_MOVE_TO = 1
+_LINE_TO = 2
+_CLOSE_PATH = 7
+
+
+# --- Protobuf primitives ---
+
+def _varint(value):
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _key(field, wire_type):
+    return _varint((field << 3) | wire_type)
+
+
+def _bytes_field(field, data):
+    return _key(field, 2) + _varint(len(data)) + data
+
+
+def _uint_field(field, value):
+    return _key(field, 0) + _varint(value)
+
+
+def _packed_field(field, values):
+    return _bytes_field(field, b"".join(_varint(v) for v in values))
+
+
+def _zigzag(n):
+    return (n << 1) ^ (n >> 31)
+
+
+def _value(value):
+    """Tile Value message for a property value."""
+    if isinstance(value, bool):
+        return _uint_field(7, int(value))
+    if isinstance(value, int):
+        return _key(6, 0) + _varint((value << 1) ^ (value >> 63))
+    if isinstance(value, float):
+        return _key(3, 1) + struct.pack("<d", value)
+    return _bytes_field(1, str(value).encode("utf-8"))
+
+
+# --- Geometry ---
+
+def simplify(points, tolerance):
+    """Douglas-Peucker over a list of (x, y); the endpoints are always kept."""
+    return [p for p, kept in zip(points, simplify_mask(points, tolerance)) if kept]
+
+
+def simplify_mask(points, tolerance):
+    """Which of points Douglas-Peucker keeps, as a list of booleans."""
+    if tolerance <= 0 or len(points) < 3:
+        return [True] * len(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    tolerance2 = tolerance * tolerance
+    while stack:
+        first, last = stack.pop()
+        ax, ay = points[first]
+        bx, by = points[last]
+        dx, dy = bx - ax, by - ay
+        length2 = dx * dx + dy * dy
+        worst, worst_d2 = -1, tolerance2
+        for i in range(first + 1, last):
+            px, py = points[i]
+            if length2 == 0:
+                d2 = (px - ax) ** 2 + (py - ay) ** 2
+            else:
+                t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / length2))
+                d2 = (px - ax - t * dx) ** 2 + (py - ay - t * dy) ** 2
+            if d2 > worst_d2:
+                worst, worst_d2 = i, d2
+        if worst >= 0:
+            keep[worst] = True
+            stack.append((first, worst))
+            stack.append((worst, last))
+    return keep
+
+
+def _rounded(points):
+    """Integer tile coordinates with consecutive duplicates dropped."""
+    out = []
+    for x, y in points:
+        p = (int(round(x)), int(round(y)))
+        if not out or out[-1] != p:
+            out.append(p)
+    return out
+
+
+def _signed_area(ring):
+    # Positive for clockwise rings in tile space (y down), which MVT wants for exteriors
+    return sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1])) / 2.0
+
+
+class _Cursor:
+    """Encodes command sequences with coordinates relative to the previous point."""
+
+    def __init__(self):
+        self.x = 0
+        self.y = 0
+        self.out = []
+
+    def command(self, command, points):
+        self.out.append((command & 0x7) | (len(points) << 3))
+        for x, y in points:
+            self.out.append(_zigzag(x - self.x))
+            self.out.append(_zigzag(y - self.y))
+            self.x, self.y = x, y
+
+    def close(self):
+        self.out.append(_CLOSE_PATH | (1 << 3))
+
+
+def encode_geometry(geom_type, parts, tolerance=0.0):
+    """
+    Command integers for a geometry, or None when simplification leaves
+    nothing drawable.
+    parts: POINT -> [(x, y), ...]; LINESTRING -> [[(x, y), ...], ...];
+    POLYGON -> [[exterior ring, hole, ...], ...] with rings as (x, y) lists.
+    """
+    cursor = _Cursor()
+    if geom_type == POINT:
+        points = _rounded(parts)
+        if not points:
+            return None
+        cursor.command(_MOVE_TO, points)
+        return cursor.out
+
+    if geom_type == LINESTRING:
+        for line in parts:
+            line = _rounded(simplify(line, tolerance))
+            if len(line) < 2:
+                continue
+            cursor.command(_MOVE_TO, line[:1])
+            cursor.command(_LINE_TO, line[1:])
+        return cursor.out or None
+
+    for polygon in parts:
+        for i, ring in enumerate(polygon):
+            if len(ring) > 1 and ring[0] == ring[-1]:
+                ring = ring[:-1]
+            # Simplify the ring as a closed line so its start point can go too
+            ring = _rounded(simplify(list(ring) + [ring[0]], tolerance))[:-1] if ring else []
+            if len(ring) < 3:
+                if i == 0:
+                    break  # exterior collapsed: drop the polygon with its holes
+                continue
+            area = _signed_area(ring)
+            if area == 0:
+                if i == 0:
+                    break
+                continue
+            # Exterior rings clockwise, holes counter-clockwise
+            if (area > 0) != (i == 0):
+                ring.reverse()
+            cursor.command(_MOVE_TO, ring[:1])
+            cursor.command(_LINE_TO, ring[1:])
+            cursor.close()
+    return cursor.out or None
+
+
+# --- Layers ---
+
+class LayerBuilder:
+    """Collects features for one tile layer, interning property keys and values."""
+
+    def __init__(self, name, extent=EXTENT):
+        self.name = name
+        self.extent = extent
+        self.keys = {}
+        self.values = {}
+        self.features = []
+
+    def _index(self, table, item):
+        index = table.get(item)
+        if index is None:
+            index = table[item] = len(table)
+        return index
+
+    def add(self, feature_id, geom_type, geometry, properties):
+        """geometry: command integers from encode_geometry."""
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags.append(self._index(self.keys, key))
+            # type() keeps 1, 1.0 and True apart
+            tags.append(self._index(self.values, (type(value), value)))
+        message = b""
+        if feature_id is not None:
+            message += _uint_field(1, feature_id)
+        if tags:
+            message += _packed_field(2, tags)
+        message += _uint_field(3, geom_type) + _packed_field(4, geometry)
+        self.features.append(message)
+
+    def encode(self):
+        if not self.features:
+            return b""
+        parts = [_uint_field(15, 2), _bytes_field(1, self.name.encode("utf-8"))]
+        parts.extend(_bytes_field(2, feature) for feature in self.features)
+        parts.extend(_bytes_field(3, key.encode("utf-8")) for key in self.keys)
+        parts.extend(_bytes_field(4, _value(value)) for _, value in self.values)
+        parts.append(_uint_field(5, self.extent))
+        # A tile is a sequence of Layer messages (field 3)
+        return _bytes_field(3, b"".join(parts))
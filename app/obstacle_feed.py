@@ -0,0 +1,147 @@
+"""
+Server-Sent Events feed of obstacle changes.
+
+The write handlers publish every obstacle create/update/delete through the
+change hooks; each event is encoded into its SSE frame once and appended
+to a bounded replay buffer, and every open /api/obstacles/stream response
+is a generator that sleeps on a condition until the sequence number moves
+past the last frame it sent. An idle subscriber therefore costs one
+parked greenlet/thread and no work per event beyond a slice of the
+buffer.
+
+Event ids are "<epoch>-<seq>", where the epoch is fixed per process. A
+client reconnecting with a Last-Event-ID from this process that is still
+in the buffer gets the frames it missed; any other id (buffer overrun,
+restarted or different worker) gets a "reset" event, meaning "refetch
+/api/obstacles and carry on from here". Publishing is in-process, so run
+the API in a single gevent worker (see README) for every subscriber to see
+every write.
+"""
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from flask import Response
+
+RETRY_MS = 3000
+
+
+def obstacle_json(obstacle):
+    return {
+        'obstacle_id': obstacle.obstacle_id,
+        'latitude': obstacle.latitude,
+        'longitude': obstacle.longitude,
+        'obstacle_type': obstacle.obstacle_type,
+        'user_id': obstacle.user_id,
+        'building_id': obstacle.building_id,
+        'path_id': obstacle.path_id,
+        'entrance_id': obstacle.entrance_id,
+        'description': obstacle.description,
+        'severity_level': obstacle.severity_level,
+        'reported_at': obstacle.reported_at.isoformat() if obstacle.reported_at else None,
+        'status': obstacle.status,
+        'report_count': obstacle.report_count,
+        'starts_at': obstacle.starts_at.isoformat() if obstacle.starts_at else None,
+        'ends_at': obstacle.ends_at.isoformat() if obstacle.ends_at else None
+    }
+
+
+class ObstacleFeed:
+    """In-process pub/sub with a replay buffer of encoded SSE frames."""
+
+    def __init__(self, replay=1000, keepalive_s=15.0):
+        self.keepalive_s = keepalive_s
+        self._epoch = f"{int(time.time()):x}{os.getpid():x}"
+        self._seq = 0
+        self._events = deque(maxlen=replay)  # (seq, frame bytes)
+        self._cond = threading.Condition()
+        self._subscribers = 0
+        self._published = 0
+
+    def init_app(self, app):
+        with self._cond:
+            self._events = deque(self._events, maxlen=app.config["OBSTACLE_FEED_REPLAY"])
+        self.keepalive_s = app.config["OBSTACLE_FEED_KEEPALIVE_S"]
+
+    def _frame(self, event, seq, data):
+        body = json.dumps(data, separators=(",", ":"))
+        return f"id: {self._epoch}-{seq}\nevent: {event}\ndata: {body}\n\n".encode("utf-8")
+
+    def publish(self, event, data):
+        """Send one event ("created", "updated", "deleted" or "reset") to every subscriber."""
+        with self._cond:
+            self._seq += 1
+            self._events.append((self._seq, self._frame(event, self._seq, data)))
+            self._published += 1
+            self._cond.notify_all()
+
+    def _parse(self, last_event_id):
+        """Sequence number of a Last-Event-ID from this process, else None."""
+        epoch, _, seq = (last_event_id or "").rpartition("-")
+        if epoch != self._epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def _after(self, seq):
+        """Frames published after seq, or None if some already fell out of the buffer. Caller holds the lock."""
+        if seq >= self._seq:
+            return []
+        first = self._events[0][0] if self._events else self._seq + 1
+        if seq < first - 1:
+            return None
+        return [frame for _, frame in itertools.islice(self._events, seq - first + 1, None)]
+
+    def _stream(self, seq, reset):
+        # Counted from the first read, so a response that is never iterated cannot leak
+        with self._cond:
+            self._subscribers += 1
+        try:
+            yield f"retry: {RETRY_MS}\n\n".encode("utf-8")
+            if reset:
+                yield self._frame("reset", seq, {})
+            while True:
+                with self._cond:
+                    if self._seq == seq:
+                        self._cond.wait(self.keepalive_s)
+                    frames = self._after(seq)
+                    current = self._seq
+                if frames is None:
+                    yield self._frame("reset", current, {})
+                elif frames:
+                    yield b"".join(frames)
+                else:
+                    # Comment line: keeps proxies from timing the connection out
+                    # and surfaces disconnected clients as a failed write
+                    yield b": keepalive\n\n"
+                seq = current
+        finally:
+            with self._cond:
+                self._subscribers -= 1
+
+    def response(self, last_event_id=None):
+        """
+        Streaming text/event-stream response. Without a Last-Event-ID the
+        client starts from "now" (it has just fetched the list).
+        """
+        with self._cond:
+            current = self._seq
+            seq = self._parse(last_event_id) if last_event_id else current
+            reset = seq is None or seq > current or (seq < current and self._after(seq) is None)
+            if reset:
+                seq = current
+        response = Response(self._stream(seq, reset), mimetype="text/event-stream")
+        response.cache_control.no_cache = True
+        # Ask nginx and similar proxies not to buffer the stream
+        response.headers["X-Accel-Buffering"] = "no"
+        return response
+
+    def stats(self):
+        with self._cond:
+            return {"subscribers": self._subscribers, "published": self._published,
+                    "buffered": len(self._events)}
+
+
+obstacle_feed = ObstacleFeed()
@@ -0,0 +1,334 @@
+"""
+Obstacle checks for computed routes.
+
+Route geometry is tested against every active Obstacle with a buffered
+corridor test: the distance from each obstacle to each route segment is
+computed for all pairs at once with NumPy broadcasting, so a few hundred
+open construction reports cost one array operation rather than a Python
+double loop. Obstacles with a starts_at/ends_at window only count for
+routes that are walked while it is open (ActiveObstacles.during).
+
+The active set is loaded once per process and dropped by the write hooks;
+every OBSTACLE_VERSION_CHECK_S it is also compared against the table so
+that changes made through other workers are picked up.
+"""
+import logging
+import threading
+import time
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import func, or_
+
+from app import db, routing_engine
+from app.models import Obstacle
+from app.schedule import timestamp
+
+METERS_PER_DEG_LAT = 111320.0
+
+logger = logging.getLogger(__name__)
+
+
+def _number(value, default):
+    """value as a float, or default when the column holds something else (SQLite stores anything)."""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return default
+    return number if np.isfinite(number) else default
+
+
+class ActiveObstacles:
+    """Column arrays for the obstacles that currently affect routing."""
+
+    def __init__(self, rows, version=None):
+        # Rows without usable coordinates can't be placed; a bad severity or id counts as none
+        skipped = [r.obstacle_id for r in rows if _number(r.latitude, None) is None or _number(r.longitude, None) is None]
+        if skipped:
+            logger.warning("Skipping obstacles without valid coordinates", extra={"obstacle_ids": skipped})
+            rows = [r for r in rows if r.obstacle_id not in skipped]
+        self.version = version
+        self.count = len(rows)
+        self.ids = np.array([r.obstacle_id for r in rows], dtype=np.int64)
+        self.lat = np.array([float(r.latitude) for r in rows], dtype=np.float64)
+        self.lng = np.array([float(r.longitude) for r in rows], dtype=np.float64)
+        self.severity = np.array([_number(r.severity_level, 0.0) for r in rows], dtype=np.float64)
+        self.path_ids = np.array([int(_number(r.path_id, -1)) for r in rows], dtype=np.int64)
+        self.entrance_ids = np.array([int(_number(r.entrance_id, -1)) for r in rows], dtype=np.int64)
+        self.types = [r.obstacle_type for r in rows]
+        self.descriptions = [r.description for r in rows]
+        # Window in epoch seconds of campus local time; open ends are infinite
+        self.starts = np.array([timestamp(r.starts_at, -np.inf) for r in rows], dtype=np.float64)
+        self.ends = np.array([timestamp(r.ends_at, np.inf) for r in rows], dtype=np.float64)
+
+    def during(self, t0, t1):
+        """The obstacles whose window overlaps [t0, t1] (self when that is all of them)."""
+        keep = (self.starts <= t1) & (self.ends > t0)
+        if keep.all():
+            return self
+        subset = object.__new__(ActiveObstacles)
+        subset.version = self.version
+        subset.count = int(keep.sum())
+        for name in ("ids", "lat", "lng", "severity", "path_ids", "entrance_ids", "starts", "ends"):
+            setattr(subset, name, getattr(self, name)[keep])
+        indices = np.flatnonzero(keep)
+        subset.types = [self.types[i] for i in indices]
+        subset.descriptions = [self.descriptions[i] for i in indices]
+        return subset
+
+
+def _project(lat, lng, lat0):
+    """Local equirectangular projection to meters around latitude lat0."""
+    kx = np.cos(np.radians(lat0)) * METERS_PER_DEG_LAT
+    return np.stack([lng * kx, lat * METERS_PER_DEG_LAT], axis=-1)
+
+
+def segment_distances(points, seg_start, seg_end):
+    """
+    Distance from every point to every segment, in the projection's units.
+    points: (K, 2); seg_start, seg_end: (M, 2). Returns a (K, M) array.
+    """
+    ab = seg_end - seg_start                                 # (M, 2)
+    ap = points[:, None, :] - seg_start[None, :, :]          # (K, M, 2)
+    denom = np.einsum("ij,ij->i", ab, ab)                    # (M,)
+    safe = np.where(denom > 0, denom, 1.0)
+    t = np.clip(np.einsum("kmj,mj->km", ap, ab) / safe, 0.0, 1.0)
+    t = np.where(denom > 0, t, 0.0)
+    offset = ap - t[..., None] * ab
+    return np.sqrt(np.einsum("kmj,kmj->km", offset, offset))
+
+
+#-------------------------------------------------------------------------
+# Active obstacle snapshot
+#-------------------------------------------------------------------------
+
+_active = None
+_active_version = 0
+_active_checked = 0.0  # time.monotonic() of the last look for changes made elsewhere
+_active_lock = threading.Lock()
+
+
+def obstacles_version():
+    """Fingerprint of the obstacle table: row count and latest updated_at, in one query."""
+    return tuple(db.session.query(func.count(Obstacle.obstacle_id), func.max(Obstacle.updated_at)).one())
+
+
+def load_active_obstacles(inactive_statuses, version=None):
+    rows = db.session.query(
+        Obstacle.obstacle_id, Obstacle.latitude, Obstacle.longitude, Obstacle.severity_level,
+        Obstacle.path_id, Obstacle.entrance_id, Obstacle.obstacle_type, Obstacle.description,
+        Obstacle.starts_at, Obstacle.ends_at
+    ).filter(
+        or_(Obstacle.status.is_(None), func.lower(Obstacle.status).notin_(inactive_statuses))
+    ).all()
+    return ActiveObstacles(rows, version)
+
+
+def _check_due():
+    check_s = current_app.config["OBSTACLE_VERSION_CHECK_S"]
+    return check_s > 0 and time.monotonic() - _active_checked >= check_s
+
+
+def get_active_obstacles(inactive_statuses):
+    """
+    Shared snapshot of active obstacles, reloaded after invalidate() or when
+    the table changed through another worker.
+    """
+    global _active, _active_checked
+    active = _active
+    if active is not None and not _check_due():
+        return active
+    with _active_lock:
+        active = _active
+        if active is not None and not _check_due():
+            return active
+        version = _active_version
+        _active_checked = time.monotonic()
+        table_version = obstacles_version()
+        if active is not None and table_version == active.version:
+            return active
+        replaced = active is not None
+        active = load_active_obstacles(inactive_statuses, table_version)
+        # Don't publish a snapshot that was invalidated while it was loading
+        if version == _active_version:
+            _active = active
+    if replaced:
+        # Route cache entries and the spatial index in this process saw the old obstacles too
+        from app import hooks
+        hooks.obstacles_replaced()
+    return active
+
+
+def invalidate():
+    global _active, _active_version
+    _active_version += 1
+    _active = None
+
+
+#-------------------------------------------------------------------------
+# Route checks
+#-------------------------------------------------------------------------
+
+def find_hits(route, obstacles, buffer_m):
+    """
+    Obstacles inside the buffered corridor around a route's geometry, or
+    attached to one of the Path rows it uses.
+    Returns a list of (obstacle index, distance in meters), nearest first.
+    """
+    geometry = route.get("geometry") or []
+    if obstacles.count == 0 or not geometry:
+        return []
+
+    lat = np.fromiter((p["lat"] for p in geometry), dtype=np.float64, count=len(geometry))
+    lng = np.fromiter((p["lng"] for p in geometry), dtype=np.float64, count=len(geometry))
+    lat0 = float(lat.mean())
+
+    # Cheap bounding-box prefilter before the all-pairs distance test
+    margin_lat = buffer_m / METERS_PER_DEG_LAT
+    margin_lng = margin_lat / max(0.01, np.cos(np.radians(lat0)))
+    near = ((obstacles.lat >= lat.min() - margin_lat) & (obstacles.lat <= lat.max() + margin_lat)
+            & (obstacles.lng >= lng.min() - margin_lng) & (obstacles.lng <= lng.max() + margin_lng))
+    on_path = np.isin(obstacles.path_ids, np.asarray(route.get("path_ids", []), dtype=np.int64))
+    candidates = np.flatnonzero(near | on_path)
+    if candidates.size == 0:
+        return []
+
+    pts = _project(lat, lng, lat0)
+    if len(pts) == 1:
+        seg_start = seg_end = pts
+    else:
+        seg_start, seg_end = pts[:-1], pts[1:]
+    obs = _project(obstacles.lat[candidates], obstacles.lng[candidates], lat0)
+    distances = segment_distances(obs, seg_start, seg_end).min(axis=1)
+    distances = np.where(on_path[candidates], 0.0, distances)
+
+    hit = distances <= buffer_m
+    order = np.argsort(distances[hit], kind="stable")
+    return [(int(i), float(d)) for i, d in zip(candidates[hit][order], distances[hit][order])]
+
+
+def _blocking(graph, obstacles, idx, buffer_m):
+    """(len(idx), edge_count) bool array: which edges each of the obstacles idx blocks."""
+    node_lat = np.frombuffer(graph.node_lat, dtype=np.float64)
+    node_lng = np.frombuffer(graph.node_lng, dtype=np.float64)
+    offsets = np.frombuffer(graph.offsets, dtype=np.int32)
+    targets = np.frombuffer(graph.targets, dtype=np.int32)
+    sources = np.repeat(np.arange(graph.node_count), np.diff(offsets))
+
+    lat0 = float(node_lat.mean())
+    nodes = _project(node_lat, node_lng, lat0)
+    obs = _project(obstacles.lat[idx], obstacles.lng[idx], lat0)
+    near = segment_distances(obs, nodes[sources], nodes[targets]) <= buffer_m
+
+    path_ids = np.frombuffer(graph.path_ids, dtype=np.int64)
+    on_path = obstacles.path_ids[idx][:, None]
+    near |= (path_ids[None, :] == on_path) & (on_path >= 0)
+
+    for k, entrance_id in enumerate(obstacles.entrance_ids[idx]):
+        if entrance_id < 0:
+            continue
+        node = graph.node_index.get((routing_engine.NODE_ENTRANCE, int(entrance_id)))
+        if node is not None:
+            near[k, (sources == node) | (targets == node)] = True
+    return near
+
+
+def blocked_edges(graph, obstacles, indices, buffer_m):
+    """
+    Edge indices of the routing graph that pass within buffer_m of the given
+    obstacles, run along their path, or lead to their entrance.
+    """
+    if not indices or graph.edge_count == 0:
+        return set()
+    near = _blocking(graph, obstacles, np.asarray(indices, dtype=np.int64), buffer_m)
+    return set(np.flatnonzero(near.any(axis=0)).tolist())
+
+
+def blocked_edges_by_obstacle(graph, obstacles, indices, buffer_m):
+    """blocked_edges for each of the given obstacles on its own, in the order of indices."""
+    if not len(indices) or graph.edge_count == 0:
+        return [set() for _ in indices]
+    near = _blocking(graph, obstacles, np.asarray(indices, dtype=np.int64), buffer_m)
+    return [set(np.flatnonzero(row).tolist()) for row in near]
+
+
+def build_warnings(obstacles, hits, buffer_m):
+    """Severity-weighted warnings, most serious first."""
+    warnings = []
+    for i, distance in hits:
+        severity = float(obstacles.severity[i])
+        # Closer obstacles weigh more: full severity on the route, half at the buffer edge
+        weight = severity * (1.0 - 0.5 * min(distance, buffer_m) / buffer_m) if buffer_m > 0 else severity
+        obstacle_type = obstacles.types[i] or "obstacle"
+        warnings.append({
+            "obstacle_id": int(obstacles.ids[i]),
+            "obstacle_type": obstacle_type,
+            "severity_level": int(severity),
+            "description": obstacles.descriptions[i],
+            "latitude": float(obstacles.lat[i]),
+            "longitude": float(obstacles.lng[i]),
+            "distance": distance,
+            "weight": weight,
+            "message": f"{obstacle_type.capitalize()} reported {distance:.0f} m from the route",
+        })
+    warnings.sort(key=lambda w: -w["weight"])
+    return warnings
+
+
+def apply(route, obstacles, buffer_m, reroute_severity, reroute):
+    """
+    Attach obstacle warnings to a route. When an obstacle above
+    reroute_severity sits on the route, reroute(blocked_edge_fn) is asked
+    for an alternative that avoids those obstacles; it returns a new route
+    or None. blocked_edge_fn(graph) gives the edges to exclude.
+    """
+    hits = find_hits(route, obstacles, buffer_m)
+    severe = [i for i, _ in hits if obstacles.severity[i] > reroute_severity]
+    avoided = []
+    if severe:
+        alternative = reroute(lambda graph: blocked_edges(graph, obstacles, severe, buffer_m))
+        if alternative is not None:
+            route = alternative
+            avoided = [int(obstacles.ids[i]) for i in severe]
+            hits = find_hits(route, obstacles, buffer_m)
+
+    route = dict(route)
+    route["warnings"] = build_warnings(obstacles, hits, buffer_m)
+    if avoided:
+        route["avoided_obstacles"] = avoided
+    return route
+
+
+def rank(routes, obstacles, buffer_m, reroute_severity, reroute, obstacle_score_m):
+    """
+    Attach obstacle warnings and a score to each of several routes between
+    the same points and return them best (lowest score) first. The score is
+    the distance plus routing_engine.FEATURE_SCORES per meter of stairs,
+    incline and unpaved surface, plus obstacle_score_m per unit of warning
+    weight. When every route passes an obstacle above reroute_severity,
+    reroute(blocked_edge_fn) is asked for one more that avoids them, as in
+    apply().
+    """
+    checked = [(route, find_hits(route, obstacles, buffer_m)) for route in routes]
+    severe = [[i for i, _ in hits if obstacles.severity[i] > reroute_severity] for _, hits in checked]
+    detour = None
+    if checked and all(severe):
+        indices = sorted(set().union(*severe))
+        detour = reroute(lambda graph: blocked_edges(graph, obstacles, indices, buffer_m))
+        if detour is not None:
+            detour = dict(detour)
+            detour["avoided_obstacles"] = [int(obstacles.ids[i]) for i in indices]
+            checked.append((detour, find_hits(detour, obstacles, buffer_m)))
+
+    ranked = []
+    for route, hits in checked:
+        route = dict(route)
+        route["warnings"] = build_warnings(obstacles, hits, buffer_m)
+        features = route.get("features") or {}
+        score = (route["summary"]["distance"] or 0.0) + obstacle_score_m * sum(w["weight"] for w in route["warnings"])
+        for name, factor in routing_engine.FEATURE_SCORES.items():
+            score += factor * features.get(name, 0.0)
+        route["score"] = score
+        ranked.append(route)
+    ranked.sort(key=lambda route: route["score"])
+    return ranked
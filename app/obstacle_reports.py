@@ -0,0 +1,203 @@
+"""
+Group-committed, deduplicated obstacle reports.
+
+When a walkway is blocked many people report it within minutes, from
+roughly the same spot. POST /api/obstacles hands each report to the
+ingester instead of committing it on its own:
+
+- Reports queue up. A request that finds no flush in progress becomes
+  the leader and writes everything queued (up to OBSTACLE_BATCH_MAX) in
+  one transaction; the others wait for the flush that carries theirs. At
+  low load a report is flushed alone and immediately, under a burst the
+  batches grow by themselves, with no timer or background thread.
+- Within a flush, a report of the same obstacle_type within
+  OBSTACLE_DEDUP_RADIUS_M of an active obstacle last reported less than
+  OBSTACLE_DEDUP_WINDOW_S ago (in the database or earlier in the batch)
+  is merged into it: report_count goes up, last_reported_at moves on and
+  the severity becomes the higher of the two. Counts are incremented in
+  SQL, so merges from several workers add up.
+- Every caller gets its answer only after the commit that made its
+  report durable (201 with the new obstacle, or 200 with the one it was
+  merged into). If the database rejects a batch, its reports are
+  retried one by one so only the offending report fails.
+"""
+import logging
+import math
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, or_
+
+from app import db
+from app.hooks import obstacle_changed
+from app.metrics import metrics
+from app.models import Obstacle
+from app.obstacle_feed import obstacle_json
+
+logger = logging.getLogger(__name__)
+
+METERS_PER_DEG_LAT = 111320.0
+
+
+def _distance_m(lat1, lng1, lat2, lng2):
+    """Equirectangular distance; exact enough at dedup radii."""
+    kx = math.cos(math.radians((lat1 + lat2) / 2.0))
+    return math.hypot((lat2 - lat1) * METERS_PER_DEG_LAT, (lng2 - lng1) * METERS_PER_DEG_LAT * kx)
+
+
+class _Pending:
+    __slots__ = ("report", "result", "error", "done")
+
+    def __init__(self, report):
+        self.report = report
+        self.result = None  # (obstacle dict, status code)
+        self.error = None
+        self.done = False
+
+
+class ObstacleIngest:
+    """Leader/follower group commit for obstacle reports."""
+
+    def __init__(self):
+        self._queue = []
+        self._flushing = False
+        self._cond = threading.Condition()
+        self.reports = 0
+        self.merged = 0
+        self.flushes = 0
+
+    def submit(self, report):
+        """
+        Store one report (the POST /api/obstacles body) and return
+        (obstacle dict, 201 if created / 200 if merged) once it is committed.
+        """
+        item = _Pending(report)
+        with self._cond:
+            self._queue.append(item)
+        batch_max = current_app.config["OBSTACLE_BATCH_MAX"]
+        while True:
+            with self._cond:
+                while not item.done and self._flushing:
+                    self._cond.wait()
+                if item.done:
+                    break
+                self._flushing = True
+                batch, self._queue = self._queue[:batch_max], self._queue[batch_max:]
+            try:
+                self._flush(batch)
+            finally:
+                with self._cond:
+                    self._flushing = False
+                    self._cond.notify_all()
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def _candidates(self, reports, now, config):
+        """Active obstacles near any report that can still absorb duplicates."""
+        radius_deg = config["OBSTACLE_DEDUP_RADIUS_M"] / METERS_PER_DEG_LAT
+        lats = [r['latitude'] for r in reports]
+        lngs = [r['longitude'] for r in reports]
+        kx = max(0.1, math.cos(math.radians(max(abs(v) for v in lats))))
+        since = now - timedelta(seconds=config["OBSTACLE_DEDUP_WINDOW_S"])
+        return Obstacle.query.filter(
+            Obstacle.latitude.between(min(lats) - radius_deg, max(lats) + radius_deg),
+            Obstacle.longitude.between(min(lngs) - radius_deg / kx, max(lngs) + radius_deg / kx),
+            Obstacle.obstacle_type.in_({r['obstacle_type'] for r in reports}),
+            func.coalesce(Obstacle.last_reported_at, Obstacle.reported_at) >= since,
+            or_(Obstacle.status.is_(None),
+                func.lower(Obstacle.status).notin_(config["OBSTACLE_INACTIVE_STATUSES"])),
+        ).all()
+
+    def _flush(self, batch):
+        """Write batch and hand every report in it its result or error; never leaves one waiting."""
+        if not batch:
+            return
+        try:
+            try:
+                created, previous = self._write(batch)
+            except Exception:
+                db.session.rollback()
+                if len(batch) == 1:
+                    raise
+                # Don't fail every report in the batch for one the database rejects
+                for item in batch:
+                    self._flush([item])
+                return
+
+            # The reports are durable now: a failing hook must not turn them into errors
+            try:
+                for obstacle in created:
+                    obstacle_changed(obstacle)
+                for obstacle, old in previous.items():
+                    obstacle_changed(obstacle, previous=old)
+            except Exception:
+                logger.exception("Obstacle change hooks failed after a group commit")
+            results = {}
+            for item in batch:
+                obstacle, status = item.result
+                if obstacle not in results:
+                    results[obstacle] = obstacle_json(obstacle)
+                item.result = (results[obstacle], status)
+            self.reports += len(batch)
+            self.merged += sum(1 for item in batch if item.result[1] == 200)
+            self.flushes += 1
+        except Exception as exc:
+            for item in batch:
+                item.error = exc
+        finally:
+            for item in batch:
+                item.done = True
+
+    def _write(self, batch):
+        """
+        Merge and commit batch; each item.result becomes (obstacle, status).
+        Returns (new obstacles, {merged obstacle: its previous (lat, lng, path_id)}).
+        """
+        config = current_app.config
+        radius = config["OBSTACLE_DEDUP_RADIUS_M"]
+        now = datetime.now()
+        with metrics.span("obstacles.flush"):
+            known = self._candidates([item.report for item in batch], now, config)
+            created = []
+            increments = {}  # obstacle_id -> extra reports for rows already in the database
+            previous = {}
+            for item in batch:
+                r = item.report
+                match, best = None, radius
+                for obstacle in known:
+                    if obstacle.obstacle_type != r['obstacle_type']:
+                        continue
+                    d = _distance_m(r['latitude'], r['longitude'], obstacle.latitude, obstacle.longitude)
+                    if d <= best:
+                        match, best = obstacle, d
+                if match is None:
+                    match = Obstacle(reported_at=now, last_reported_at=now, report_count=1, **r)
+                    db.session.add(match)
+                    known.append(match)
+                    created.append(match)
+                    item.result = (match, 201)
+                    continue
+                if match in created:
+                    match.report_count += 1
+                else:
+                    previous.setdefault(match, (match.latitude, match.longitude, match.path_id))
+                    increments[match] = increments.get(match, 0) + 1
+                match.last_reported_at = now
+                match.severity_level = max(match.severity_level or 0, r.get('severity_level') or 0) or None
+                for key in ('path_id', 'entrance_id', 'building_id'):
+                    if getattr(match, key) is None and r.get(key) is not None:
+                        setattr(match, key, r[key])
+                item.result = (match, 200)
+            for obstacle, n in increments.items():
+                # In SQL, so concurrent merges in other workers are not lost
+                obstacle.report_count = func.coalesce(Obstacle.report_count, 1) + n
+            db.session.commit()
+        return created, previous
+
+    def stats(self):
+        return {"reports": self.reports, "merged": self.merged, "flushes": self.flushes}
+
+
+obstacle_ingest = ObstacleIngest()
@@ -0,0 +1,328 @@
+"""
+Client for the OSRM HTTP API.
+
+A single keep-alive requests.Session with a bounded connection pool is
+shared by every request, concurrent calls are capped, transient failures
+are retried with jittered backoff inside an overall deadline, and a
+circuit breaker fails fast while OSRM is unhealthy so callers can fall
+back to the local routing engine immediately.
+
+AsyncOSRMClient offers the same calls for asyncio code; it uses httpx
+when it is installed and otherwise runs the pooled sync client in worker
+threads.
+"""
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.metrics import metrics
+
+try:
+    import httpx
+except ImportError:  # optional dependency
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+
+class OSRMError(Exception):
+    """OSRM could not be reached or did not answer in time."""
+
+
+class CircuitOpenError(OSRMError):
+    """Raised without contacting OSRM while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Classic three-state breaker.
+    closed: calls go through; failure_threshold consecutive failures open it.
+    open: calls fail fast until reset_timeout has passed.
+    half-open: one trial call is let through; success closes, failure re-opens.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """The half-open trial ended without an answer (cancelled): let another call try."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning("OSRM circuit breaker opened after %d failures", self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+
+def _coordinates(points):
+    """OSRM wants lng,lat pairs separated by ';'."""
+    return ";".join(f"{lng},{lat}" for lat, lng in points)
+
+
+def _answer(status_code, content):
+    """
+    The decoded body of an OSRM answer: a 2xx, or one of OSRM's own JSON
+    4xx (NoRoute, ...). None for anything else, such as a proxy's HTML error
+    page or a 500, which count against the circuit breaker.
+    """
+    if status_code >= 500:
+        return None
+    try:
+        body = json.loads(content)
+    except ValueError:
+        return None
+    return body if isinstance(body, dict) else None
+
+
+def _table_params(sources, destinations):
+    return {
+        "sources": ";".join(str(i) for i in range(sources)),
+        "destinations": ";".join(str(sources + i) for i in range(destinations)),
+        "annotations": "distance,duration",
+    }
+
+
+class OSRMClient:
+    """Thread-safe, pooled OSRM client."""
+
+    # Status codes worth retrying; OSRM's own 400s (NoRoute, ...) are answers
+    RETRY_STATUSES = {502, 503, 504}
+
+    def __init__(self, base_url="http://localhost:5000", timeout=10.0, max_retries=2,
+                 backoff=0.1, max_concurrency=16, pool_size=16,
+                 breaker_failures=5, breaker_reset=30.0):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.breaker = CircuitBreaker(breaker_failures, breaker_reset)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    def init_app(self, app):
+        config = app.config
+        self.base_url = config["OSRM_URL"].rstrip("/")
+        self.timeout = config["OSRM_TIMEOUT_S"]
+        self.max_retries = config["OSRM_MAX_RETRIES"]
+        self.backoff = config["OSRM_RETRY_BACKOFF_S"]
+        self.pool_size = config["OSRM_POOL_SIZE"]
+        self.max_concurrency = config["OSRM_MAX_CONCURRENCY"]
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self.breaker = CircuitBreaker(config["OSRM_BREAKER_FAILURES"], config["OSRM_BREAKER_RESET_S"])
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._session = session
+        return self._session
+
+    def _backoff_delay(self, attempt):
+        # "Full jitter": uniform in [0, backoff * 2^attempt]
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    def get(self, path, params=None, timeout=None):
+        """
+        GET {base_url}{path} and return the decoded JSON body.
+        timeout is the overall deadline in seconds across all retries.
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        if not self.breaker.allow():
+            raise CircuitOpenError("Routing service is unavailable (circuit open)")
+
+        url = f"{self.base_url}{path}"
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not self._slots.acquire(timeout=remaining):
+                last_error = OSRMError("Too many concurrent routing requests")
+                break
+            try:
+                response = self.session.get(url, params=params, timeout=remaining)
+            except requests.exceptions.RequestException as e:
+                last_error = e
+            else:
+                if response.status_code not in self.RETRY_STATUSES:
+                    body = _answer(response.status_code, response.content)
+                    if body is not None:
+                        self.breaker.record_success()
+                        return body
+                    last_error = OSRMError(f"Invalid response from routing service ({response.status_code})")
+                    break
+                last_error = OSRMError(f"Routing service returned {response.status_code}")
+            finally:
+                self._slots.release()
+
+            delay = self._backoff_delay(attempt)
+            if attempt == self.max_retries or time.monotonic() + delay >= deadline:
+                break
+            logger.info("Retrying OSRM request", extra={"delay_s": round(delay, 3), "error": str(last_error)})
+            time.sleep(delay)
+
+        self.breaker.record_failure()
+        if last_error is None:
+            last_error = OSRMError("Routing service deadline exceeded")
+        raise OSRMError(f"Could not connect to routing service: {last_error}")
+
+    def route(self, profile, points, **params):
+        """Raw /route response for a list of (lat, lng) points."""
+        with metrics.span("osrm.route"):
+            return self.get(f"/route/v1/{profile}/{_coordinates(points)}", params)
+
+    def table(self, profile, sources, destinations):
+        """Raw /table response with distance and duration annotations."""
+        points = list(sources) + list(destinations)
+        with metrics.span("osrm.table"):
+            return self.get(f"/table/v1/{profile}/{_coordinates(points)}",
+                            _table_params(len(sources), len(destinations)))
+
+
+class AsyncOSRMClient:
+    """
+    asyncio counterpart of OSRMClient sharing its settings and circuit breaker,
+    for fanning out several OSRM sub-requests in parallel.
+    """
+
+    def __init__(self, sync_client):
+        self.sync = sync_client
+        self._client = None
+        self._slots = None
+        self._loop = None
+
+    async def _http(self):
+        # httpx clients and semaphores belong to the event loop they were made on
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            limits = httpx.Limits(max_connections=self.sync.pool_size,
+                                  max_keepalive_connections=self.sync.pool_size)
+            self._client = httpx.AsyncClient(limits=limits)
+            self._slots = asyncio.Semaphore(self.sync.max_concurrency)
+            self._loop = loop
+        return self._client
+
+    async def get(self, path, params=None, timeout=None):
+        if httpx is None:
+            return await asyncio.to_thread(self.sync.get, path, params, timeout)
+
+        sync = self.sync
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or sync.timeout)
+        if not sync.breaker.allow():
+            raise CircuitOpenError("Routing service is unavailable (circuit open)")
+        trial = sync.breaker.state == CircuitBreaker.HALF_OPEN
+
+        last_error = None
+        try:
+            client = await self._http()
+            for attempt in range(sync.max_retries + 1):
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    async with self._slots:
+                        response = await client.get(f"{sync.base_url}{path}", params=params, timeout=remaining)
+                except httpx.HTTPError as e:
+                    last_error = e
+                else:
+                    if response.status_code not in sync.RETRY_STATUSES:
+                        body = _answer(response.status_code, response.content)
+                        if body is not None:
+                            sync.breaker.record_success()
+                            return body
+                        last_error = OSRMError(f"Invalid response from routing service ({response.status_code})")
+                        break
+                    last_error = OSRMError(f"Routing service returned {response.status_code}")
+
+                delay = sync._backoff_delay(attempt)
+                if attempt == sync.max_retries or loop.time() + delay >= deadline:
+                    break
+                await asyncio.sleep(delay)
+        except BaseException:
+            # Cancelled (client gone, route deadline) or failed before OSRM
+            # answered: without this the breaker would stay half-open with
+            # its trial in flight and fail every later call fast
+            if trial:
+                sync.breaker.release_trial()
+            raise
+
+        sync.breaker.record_failure()
+        if last_error is None:
+            last_error = OSRMError("Routing service deadline exceeded")
+        raise OSRMError(f"Could not connect to routing service: {last_error}")
+
+    async def route(self, profile, points, **params):
+        with metrics.span("osrm.route"):
+            return await self.get(f"/route/v1/{profile}/{_coordinates(points)}", params)
+
+    async def table(self, profile, sources, destinations):
+        points = list(sources) + list(destinations)
+        with metrics.span("osrm.table"):
+            return await self.get(f"/table/v1/{profile}/{_coordinates(points)}",
+                                  _table_params(len(sources), len(destinations)))
+
+    async def route_many(self, profile, point_lists, **params):
+        """Run several /route requests concurrently; failures are returned as exceptions."""
+        return await asyncio.gather(
+            *(self.route(profile, points, **params) for points in point_lists),
+            return_exceptions=True,
+        )
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+osrm_client = OSRMClient()
+async_osrm_client = AsyncOSRMClient(osrm_client)
@@ -0,0 +1,84 @@
+"""
+Pre-encoded response bodies for the collection endpoints.
+
+Campus reference data (buildings, entrances, paths, obstacles) changes a
+few times a week but is fetched on every map load, so each collection is
+serialized once into JSON bytes and reused while its table is unchanged:
+every request reads the table's row count and latest updated_at (one
+indexed query) and rebuilds the body when they moved, so writes made
+through another worker show up at once. Local write handlers also drop
+the entry right away. The ETag is a hash of the encoded body, so every
+worker process hands out the same tag for the same data and clients can
+revalidate with If-None-Match.
+"""
+import hashlib
+import threading
+
+from flask import Response, current_app, request
+
+from app import db
+from app.metrics import metrics
+from app.models import Building, Entrance, Obstacle, Path
+
+# Table behind each collection, as (model, primary key column)
+TABLES = {
+    'buildings': (Building, Building.building_id),
+    'entrances': (Entrance, Entrance.entrance_id),
+    'paths': (Path, Path.path_id),
+    'obstacles': (Obstacle, Obstacle.obstacle_id),
+}
+
+
+def table_version(name):
+    """Fingerprint of a collection's table: row count and latest updated_at."""
+    model, key = TABLES[name]
+    return tuple(db.session.query(db.func.count(key), db.func.max(model.updated_at)).one())
+
+
+class CollectionCache:
+    """Per-collection (body bytes, ETag), rebuilt lazily after invalidate() or a table change."""
+
+    def __init__(self):
+        self._entries = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def _encode(self, data):
+        with metrics.span("serialize"):
+            body = current_app.json.dumps(data).encode("utf-8")
+        etag = hashlib.sha1(body).hexdigest()[:27]
+        return body, etag
+
+    def get(self, name, build):
+        """(body, etag) for a collection; build() returns the data to encode on a miss."""
+        table = table_version(name) if name in TABLES else None
+        entry = self._entries.get(name)
+        if entry is not None and entry[2] == table:
+            return entry[:2]
+        with self._lock:
+            version = self._versions.get(name, 0)
+        body, etag = self._encode(build())
+        with self._lock:
+            # Only keep it if no write happened while we were building; a
+            # write to the table after table_version() just means one more rebuild
+            if self._versions.get(name, 0) == version:
+                self._entries[name] = (body, etag, table)
+        return body, etag
+
+    def invalidate(self, *names):
+        with self._lock:
+            for name in names:
+                self._versions[name] = self._versions.get(name, 0) + 1
+                self._entries.pop(name, None)
+
+    def response(self, name, build):
+        """JSON response for a collection, answering If-None-Match with 304."""
+        body, etag = self.get(name, build)
+        response = Response(body, mimetype="application/json")
+        response.set_etag(etag)
+        # Let clients keep their copy but check the ETag on every use
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+
+collection_cache = CollectionCache()
@@ -0,0 +1,252 @@
+"""
+LRU/TTL cache for computed routes.
+
+Keys are built from the start/end points snapped to the nearest entrance
+(or to a coordinate grid) plus the parsed accessibility params, so
+class-change traffic between the same halls is answered from memory.
+Each entry remembers which Path rows it uses and its bounding box so that
+Path and Obstacle writes only drop the routes they can actually affect.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from app import routing_engine
+from app.spatial_index import spatial_index, ENTRANCE
+
+
+def _routes(route):
+    """A cached route and its alternatives, if any."""
+    return [route, *route.get("alternatives", ())]
+
+
+def _reanchor(route, start_coords, end_coords):
+    route = dict(route)
+    geometry = list(route["geometry"])
+    if geometry:
+        geometry[0] = {"lat": start_coords[0], "lng": start_coords[1]}
+        geometry[-1] = {"lat": end_coords[0], "lng": end_coords[1]}
+    route["geometry"] = geometry
+    return route
+
+
+class _Entry:
+    __slots__ = ("route", "expires_at", "path_ids", "obstacle_ids", "bbox", "start", "end", "max_cost")
+
+    def __init__(self, route, expires_at, start, end, max_cost):
+        self.route = route
+        self.expires_at = expires_at
+        routes = _routes(route)
+        self.path_ids = frozenset(p for r in routes for p in r.get("path_ids", ()))
+        # Obstacles the routes warn about or were rerouted around
+        self.obstacle_ids = frozenset(
+            [w["obstacle_id"] for r in routes for w in r.get("warnings", ()) if "obstacle_id" in w]
+            + [o for r in routes for o in r.get("avoided_obstacles", [])])
+        lats = [p["lat"] for r in routes for p in r["geometry"]] or [start[0], end[0]]
+        lngs = [p["lng"] for r in routes for p in r["geometry"]] or [start[1], end[1]]
+        self.bbox = (min(lats), min(lngs), max(lats), max(lngs))
+        self.start = start
+        self.end = end
+        # Upper bound on the weighted cost the engine saw for this route
+        self.max_cost = max_cost
+
+    @property
+    def is_local(self):
+        return "path_ids" in self.route
+
+
+class RouteCache:
+    """Thread-safe LRU cache with per-entry TTL and targeted invalidation."""
+
+    def __init__(self, max_entries=2048, ttl=600, grid=0.0001, entrance_snap_m=15.0,
+                 obstacle_buffer_m=25.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.grid = grid
+        self.entrance_snap_m = entrance_snap_m
+        self.obstacle_buffer_m = obstacle_buffer_m
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # No more than the heuristic_scale of any graph the cached routes were
+        # computed on, lowered for every path written since
+        self._heuristic_scale = 1.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def init_app(self, app):
+        config = app.config
+        self.max_entries = config["ROUTE_CACHE_MAX_ENTRIES"]
+        self.ttl = config["ROUTE_CACHE_TTL_S"]
+        self.grid = config["ROUTE_CACHE_GRID_DEG"]
+        self.entrance_snap_m = config["ROUTE_CACHE_ENTRANCE_SNAP_M"]
+        self.obstacle_buffer_m = config["ROUTE_CACHE_OBSTACLE_BUFFER_M"]
+
+    # --- Keys ---
+
+    def _snap(self, coords):
+        if self.entrance_snap_m > 0:
+            nearest = spatial_index.nearest(coords[0], coords[1], k=1, kinds=(ENTRANCE,),
+                                            max_distance_m=self.entrance_snap_m)
+            if nearest:
+                return ("entrance", nearest[0][2])
+        return ("grid", round(coords[0] / self.grid), round(coords[1] / self.grid))
+
+    def make_key(self, start_coords, end_coords, accessibility_params, start_room=None, end_room=None,
+                 alternatives=1, window=()):
+        """
+        start_room / end_room: indoor room ids, which key the endpoint instead of the point.
+        alternatives: number of routes asked for (1 keeps the single-route key)
+        window: EdgeSchedule.cache_key of the departure (() when nothing is scheduled)
+        """
+        key = (
+            ("room", start_room) if start_room is not None else self._snap(start_coords),
+            ("room", end_room) if end_room is not None else self._snap(end_coords),
+            tuple(sorted(accessibility_params.items())),
+        )
+        if alternatives != 1:
+            key += (alternatives,)
+        return key + (("window", window),) if window else key
+
+    # --- Lookup / store ---
+
+    def get(self, key, start_coords, end_coords):
+        """Cached route for key with its endpoints moved to the requested points."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at <= now:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            route = entry.route
+
+        # Snapped keys match nearby points, so re-anchor the geometry on this caller
+        route = _reanchor(route, start_coords, end_coords)
+        if "alternatives" in route:
+            route["alternatives"] = [_reanchor(r, start_coords, end_coords) for r in route["alternatives"]]
+        return route
+
+    def put(self, key, route, start_coords, end_coords, accessibility_params):
+        profile = routing_engine.profile_for(accessibility_params)
+        graph = routing_engine.loaded_graph()
+        # The worst alternative is the one a new path can still replace
+        max_cost = max(r["summary"]["distance"] for r in _routes(route)) * routing_engine.max_penalty(profile)
+        entry = _Entry(route, time.monotonic() + self.ttl, start_coords, end_coords, max_cost)
+        with self._lock:
+            if graph is not None:
+                self._heuristic_scale = min(self._heuristic_scale, graph.heuristic_scale)
+            elif entry.is_local:
+                # The graph changed under this route; assume the worst
+                self._heuristic_scale = 0.0
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    # --- Invalidation ---
+
+    def _drop(self, predicate):
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if predicate(entry)]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+        return len(stale)
+
+    def invalidate_path(self, path_id, new_edge=None):
+        """
+        Drop routes affected by a Path write.
+        path_id: id of the created/updated/deleted path
+        new_edge: for creates and updates, ((lat, lng), (lat, lng), length) of
+                  the path as it is now, so routes it could shorten are dropped
+        """
+        with self._lock:
+            if not self._entries:
+                return 0
+            # Without rebuilding the graph path_changed just dropped: the old
+            # scale still holds for every other edge, the new edge's own
+            # length/straight-line ratio may lower it
+            if new_edge is not None:
+                (u, v, length) = new_edge
+                straight = routing_engine.haversine_m(u[0], u[1], v[0], v[1])
+                if straight > 0:
+                    self._heuristic_scale = min(self._heuristic_scale, length / straight)
+            scale = self._heuristic_scale
+
+        def affected(entry):
+            if path_id in entry.path_ids:
+                return True
+            if new_edge is None:
+                return False
+            # OSRM answers were only used when the graph could not route,
+            # so any new or changed path may replace them.
+            if not entry.is_local:
+                return True
+            (u, v, length) = new_edge
+            via_uv = (routing_engine.haversine_m(entry.start[0], entry.start[1], u[0], u[1])
+                      + length
+                      + routing_engine.haversine_m(v[0], v[1], entry.end[0], entry.end[1]))
+            via_vu = (routing_engine.haversine_m(entry.start[0], entry.start[1], v[0], v[1])
+                      + length
+                      + routing_engine.haversine_m(u[0], u[1], entry.end[0], entry.end[1]))
+            # A lower bound on any route through the new edge; if that already
+            # costs more than the cached route, the cached route still wins.
+            return scale * min(via_uv, via_vu) < entry.max_cost
+
+        return self._drop(affected)
+
+    def invalidate_obstacle(self, latitude=None, longitude=None, path_id=None, obstacle_id=None):
+        """
+        Drop routes on the obstacle's path, passing within the buffer of it,
+        or already warning about / routed around it.
+        """
+        margin_lat = self.obstacle_buffer_m / 111320.0
+
+        def affected(entry):
+            if path_id is not None and path_id in entry.path_ids:
+                return True
+            if obstacle_id is not None and obstacle_id in entry.obstacle_ids:
+                return True
+            if latitude is None or longitude is None:
+                return False
+            margin_lng = margin_lat / max(0.01, math.cos(math.radians(latitude)))
+            min_lat, min_lng, max_lat, max_lng = entry.bbox
+            return (min_lat - margin_lat <= latitude <= max_lat + margin_lat
+                    and min_lng - margin_lng <= longitude <= max_lng + margin_lng)
+
+        return self._drop(affected)
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._heuristic_scale = 1.0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+route_cache = RouteCache()
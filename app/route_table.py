@@ -0,0 +1,469 @@
+"""
+Precomputed building-to-building route table.
+
+For every ordered pair of buildings and each routing profile the table
+holds the best cost, the walked distance and the next hop (building and
+path_id), so a route between two buildings is read off by following next
+hops instead of running A*. Entrances only ever connect to their own
+building, so routes that start or end at an entrance reduce to a building
+pair plus the connector.
+
+Edges near a severe active obstacle (the ones compute_route_avoiding_obstacles
+would reroute around) are left out of the table. Obstacles with a
+starts_at/ends_at window only count while it is open, so the table
+follows those windows as they open and close. A lookup for a walk whose
+severe obstacles over the next ROUTE_SCHEDULE_HORIZON_S differ from the
+table's (a later departure, a window about to open or close) is left to
+A*, and a route read from the table names the obstacles it may have gone
+around, so resolving one of them drops the cached route.
+
+The table lives in one binary file that every worker memory-maps. It is
+identified by a fingerprint of the buildings and weighted edges it was
+built from; when the current graph or obstacles no longer match, a
+background thread repairs it, recomputing only the target columns whose
+shortest-path tree used an edge that got worse or that an improved edge
+could shorten, and atomically replaces the file. Until then queries fall
+back to A*.
+"""
+import hashlib
+import heapq
+import logging
+import os
+import threading
+
+import click
+import numpy as np
+from flask.cli import with_appcontext
+
+from app import routing_engine, obstacle_filter, schedule
+from app.mmap_store import MappedArrays, open_if_changed, write_arrays
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; repairs are then only serialized per process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+INF = float("inf")
+
+
+def _haversine_m(lat1, lng1, lat2, lng2):
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    a = (np.sin((phi2 - phi1) / 2) ** 2
+         + np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(lng2 - lng1) / 2) ** 2)
+    return 2 * routing_engine.EARTH_RADIUS_M * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+class TableState:
+    """
+    The inputs a table is built from, derived from a CampusGraph and the
+    active obstacles: building rows sorted by building_id and the
+    building-to-building path edges (both directions) with per-profile
+    weights, INF where forbidden or blocked. obstacle_edges: {severe
+    obstacle id: the edges it blocks}, where blocked comes from.
+    """
+
+    def __init__(self, graph, blocked, obstacle_edges=None):
+        self.graph = graph
+        self.blocked = blocked
+        self.obstacle_edges = obstacle_edges or {}
+        self.obstacle_ids = np.asarray(sorted(self.obstacle_edges), dtype=np.int64)
+        self.profiles = tuple(routing_engine.PROFILES)
+
+        nodes = [i for i in range(graph.node_count) if graph.node_kind[i] == routing_engine.NODE_BUILDING]
+        nodes.sort(key=lambda i: graph.node_ref[i])
+        self.row_nodes = nodes
+        self.row_of = {node: row for row, node in enumerate(nodes)}
+        self.building_ids = np.array([graph.node_ref[i] for i in nodes], dtype=np.int64)
+
+        edges = []
+        for u in nodes:
+            for e in range(graph.offsets[u], graph.offsets[u + 1]):
+                v = graph.targets[e]
+                if graph.path_ids[e] and v in self.row_of:
+                    edges.append((self.row_of[u], self.row_of[v], graph.path_ids[e], e))
+        edges.sort()
+        self.graph_edges = [e for *_, e in edges]
+        self.edge_of = {(u, v, pid): e for u, v, pid, e in edges}
+        self.edges = np.array([key[:3] for key in edges], dtype=np.int64).reshape(-1, 3)
+        self.lengths = np.array([graph.lengths[e] for e in self.graph_edges], dtype=np.float64)
+        self.weights = np.empty((len(self.profiles), len(edges)), dtype=np.float64)
+        for p, profile in enumerate(self.profiles):
+            weights = graph.weights(profile)
+            self.weights[p] = [INF if e in blocked else weights[e] for e in self.graph_edges]
+
+        digest = hashlib.sha1()
+        for part in (self.building_ids, self.edges, self.weights, self.obstacle_ids):
+            digest.update(part.tobytes())
+        digest.update(",".join(self.profiles).encode())
+        self.fingerprint = digest.hexdigest()
+
+        # Every (severe obstacle, edge it blocks) pair with the edge's end points
+        pairs = [(obstacle_id, e) for obstacle_id, edges in self.obstacle_edges.items() for e in edges]
+        blocked_edges = np.array([e for _, e in pairs], dtype=np.int64)
+        node_lat = np.frombuffer(graph.node_lat, dtype=np.float64)
+        node_lng = np.frombuffer(graph.node_lng, dtype=np.float64)
+        a = np.searchsorted(np.frombuffer(graph.offsets, dtype=np.int32), blocked_edges, side="right") - 1
+        b = np.frombuffer(graph.targets, dtype=np.int32)[blocked_edges]
+        self.blocking_ids = np.array([obstacle_id for obstacle_id, _ in pairs], dtype=np.int64)
+        self.blocking_a = (node_lat[a], node_lng[a])
+        self.blocking_b = (node_lat[b], node_lng[b])
+        self.blocking_lengths = _haversine_m(*self.blocking_a, *self.blocking_b)
+
+    def adjacency(self, p):
+        adj = [[] for _ in self.row_nodes]
+        for (u, v, pid), w, length in zip(self.edges.tolist(), self.weights[p].tolist(), self.lengths.tolist()):
+            if w != INF:
+                adj[u].append((v, w, length, pid))
+        return adj
+
+
+def _column(adj, target, cost, dist, next_bld, next_path):
+    """
+    Dijkstra from one target over the (symmetric) table graph, filling its
+    column: cost/dist from every building to target and the first hop.
+    """
+    cost[:, target] = INF
+    dist[:, target] = INF
+    next_bld[:, target] = -1
+    next_path[:, target] = 0
+    best = {target: 0.0}
+    walked = {target: 0.0}
+    heap = [(0.0, target)]
+    done = set()
+    while heap:
+        g, x = heapq.heappop(heap)
+        if x in done:
+            continue
+        done.add(x)
+        cost[x, target] = g
+        dist[x, target] = walked[x]
+        for v, w, length, pid in adj[x]:
+            ng = g + w
+            if ng < best.get(v, INF):
+                best[v] = ng
+                walked[v] = walked[x] + length
+                # Walking from v towards target starts with the same path back to x
+                next_bld[v, target] = x
+                next_path[v, target] = pid
+                heapq.heappush(heap, (ng, v))
+
+
+def _affected_columns(old, state, p):
+    """Target columns of profile p that an edge change between old and state can alter."""
+    n = len(state.building_ids)
+    affected = np.zeros(n, dtype=bool)
+    old_weights = {tuple(k): w for k, w in zip(old.edges.tolist(), old.weights[p].tolist())}
+    new_weights = {tuple(k): w for k, w in zip(state.edges.tolist(), state.weights[p].tolist())}
+    cost, next_bld, next_path = old.cost[p], old.next_bld[p], old.next_path[p]
+
+    for key in old_weights.keys() | new_weights.keys():
+        before = old_weights.get(key, INF)
+        after = new_weights.get(key, INF)
+        if after == before:
+            continue
+        u, v, pid = key
+        if after > before:
+            # Worse: only targets whose tree takes this hop from u
+            affected |= (next_bld[u] == v) & (next_path[u] == pid)
+        else:
+            # Better: targets where going u -> v would now beat u's current cost
+            affected |= cost[u] > after + cost[v] + 1e-9
+    return np.flatnonzero(affected)
+
+
+class RouteTable:
+    """Shared all-pairs building table with background incremental repair."""
+
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.max_buildings = 2000
+        self.inactive_statuses = ()
+        self.buffer_m = 15.0
+        self.reroute_severity = 3
+        self._table = None
+        self._state = None
+        self._state_key = None
+        self._lock = threading.Lock()
+        self._repairing = False
+        self.lookups = 0
+        self.hits = 0
+        self.repairs = 0
+        self.columns_recomputed = 0
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config["ROUTE_TABLE_ENABLED"]
+        self.path = config["ROUTE_TABLE_PATH"] or os.path.join(app.instance_path, "route_table.bin")
+        self.max_buildings = config["ROUTE_TABLE_MAX_BUILDINGS"]
+        self.inactive_statuses = config["OBSTACLE_INACTIVE_STATUSES"]
+        self.buffer_m = config["OBSTACLE_BUFFER_M"]
+        self.reroute_severity = config["OBSTACLE_REROUTE_SEVERITY"]
+        self._table = None
+        self._state = None
+        self._state_key = None
+
+    # --- Current inputs ---
+
+    def current_state(self):
+        """
+        TableState for the current graph and the obstacles in effect now
+        (cached until either changes, or a window opens or closes).
+        """
+        graph = routing_engine.get_graph()
+        t = schedule.timestamp(schedule.now())
+        # As for a walk starting now: no window, or one that is open
+        active = obstacle_filter.get_active_obstacles(self.inactive_statuses)
+        obstacles = active.during(t, t)
+        severe = np.flatnonzero(obstacles.severity > self.reroute_severity)
+        severe_ids = obstacles.ids[severe].tobytes()
+        with self._lock:
+            key = self._state_key
+            if key is not None and key[0] is graph and key[1] is active and key[2] == severe_ids:
+                return self._state
+        per_obstacle = obstacle_filter.blocked_edges_by_obstacle(graph, obstacles, severe.tolist(), self.buffer_m)
+        obstacle_edges = dict(zip(obstacles.ids[severe].tolist(), per_obstacle))
+        state = TableState(graph, set().union(*per_obstacle), obstacle_edges)
+        with self._lock:
+            self._state = state
+            self._state_key = (graph, active, severe_ids)
+        return state
+
+    def _matching_table(self, state):
+        """The mapped table if it was built from state, reloading the file if another worker replaced it."""
+        table = self._table
+        if table is not None and table.meta["fingerprint"] == state.fingerprint:
+            return table
+        table = self._table = open_if_changed(self.path, table)
+        if table is not None and table.meta["fingerprint"] == state.fingerprint:
+            return table
+        return None
+
+    # --- Lookups ---
+
+    def _reduce(self, state, node):
+        """(table row, connector edge to the building or None) for a snapped node."""
+        graph = state.graph
+        if node in state.row_of:
+            return state.row_of[node], None
+        if graph.node_kind[node] != routing_engine.NODE_ENTRANCE:
+            return None, None
+        # An entrance: one connector to its building, any other edges lead indoors
+        for e in range(graph.offsets[node], graph.offsets[node + 1]):
+            if graph.targets[e] in state.row_of:
+                return state.row_of[graph.targets[e]], e
+        return None, None
+
+    def _connector_back(self, graph, building, entrance):
+        for e in range(graph.offsets[building], graph.offsets[building + 1]):
+            if graph.targets[e] == entrance and graph.path_ids[e] == 0:
+                return e
+        return None
+
+    def _same_obstacles(self, state, during):
+        """Whether the severe obstacles in effect over during (t0, t1) are the ones state was built around."""
+        obstacles = obstacle_filter.get_active_obstacles(self.inactive_statuses).during(*during)
+        ids = np.sort(obstacles.ids[obstacles.severity > self.reroute_severity])
+        return np.array_equal(ids, state.obstacle_ids)
+
+    def _avoided(self, state, profile, nodes, edges):
+        """
+        Ids of the table's obstacles that blocked an edge a route between
+        nodes[0] and nodes[-1] could have used and still cost less than
+        edges: the obstacles this route may have been diverted around.
+        """
+        if not len(state.blocking_ids):
+            return []
+        graph = state.graph
+        weights = graph.weights(profile)
+        cost = sum(weights[e] for e in edges)
+        s, t = nodes[0], nodes[-1]
+        # A lower bound on any route through the edge, as for A*'s heuristic
+        bound = graph.heuristic_scale * (
+            _haversine_m(graph.node_lat[s], graph.node_lng[s], *state.blocking_a)
+            + state.blocking_lengths
+            + _haversine_m(*state.blocking_b, graph.node_lat[t], graph.node_lng[t]))
+        return np.unique(state.blocking_ids[bound < cost]).tolist()
+
+    def lookup(self, source, target, profile, during=None):
+        """
+        (nodes, edges, avoided obstacle ids) of the best route between two
+        graph nodes, or None when the table is disabled, stale, too large or
+        has no route for the pair. during: (t0, t1) of the walk; None again
+        when the severe obstacles in effect then are not the table's.
+        """
+        if not self.enabled:
+            return None
+        state = self.current_state()
+        if len(state.row_nodes) > self.max_buildings:
+            return None
+        self.lookups += 1
+        table = self._matching_table(state)
+        if table is None:
+            self.schedule_repair(state)
+            return None
+        if during is not None and not self._same_obstacles(state, during):
+            return None
+        if source == target:
+            self.hits += 1
+            return [source], [], []
+
+        graph = state.graph
+        source_row, first = self._reduce(state, source)
+        target_row, last = self._reduce(state, target)
+        if source_row is None or target_row is None:
+            return None
+        if source_row == target_row and first is not None and last is not None:
+            # Two entrances of one building may be closer through its floors
+            return None
+        if last is not None:
+            last = self._connector_back(graph, state.row_nodes[target_row], target)
+            if last is None:
+                return None
+        # Connectors are not part of the table; let A* handle unusable ones
+        weights = graph.weights(profile)
+        for e in (first, last):
+            if e is not None and (weights[e] == INF or e in state.blocked):
+                return None
+        p = table.meta["profiles"].index(profile)
+        if table.cost[p, source_row, target_row] == INF:
+            return None
+
+        nodes = [source]
+        edges = []
+        if first is not None:
+            edges.append(first)
+            nodes.append(state.row_nodes[source_row])
+        row = source_row
+        for _ in range(len(state.row_nodes)):
+            if row == target_row:
+                break
+            nxt = int(table.next_bld[p, row, target_row])
+            e = state.edge_of.get((row, nxt, int(table.next_path[p, row, target_row])))
+            if e is None:
+                return None
+            edges.append(e)
+            nodes.append(state.row_nodes[nxt])
+            row = nxt
+        else:
+            return None
+        if last is not None:
+            edges.append(last)
+            nodes.append(target)
+        self.hits += 1
+        return nodes, edges, self._avoided(state, profile, nodes, edges)
+
+    # --- Building and repair ---
+
+    def build(self, state, old=None):
+        """
+        Compute the table for state, reusing every column of old (a
+        MappedArrays) that the changes cannot affect. Returns the number of
+        columns recomputed.
+        """
+        n = len(state.building_ids)
+        shape = (len(state.profiles), n, n)
+        reuse = (old is not None and tuple(old.meta["profiles"]) == state.profiles
+                 and np.array_equal(old.building_ids, state.building_ids))
+        if reuse:
+            cost = np.array(old.cost)
+            dist = np.array(old.dist)
+            next_bld = np.array(old.next_bld)
+            next_path = np.array(old.next_path)
+        else:
+            cost = np.full(shape, INF)
+            dist = np.full(shape, INF, dtype=np.float32)
+            next_bld = np.full(shape, -1, dtype=np.int32)
+            next_path = np.zeros(shape, dtype=np.int64)
+
+        recomputed = 0
+        for p in range(len(state.profiles)):
+            columns = _affected_columns(old, state, p) if reuse else range(n)
+            if len(columns):
+                adj = state.adjacency(p)
+                for target in columns:
+                    _column(adj, int(target), cost[p], dist[p], next_bld[p], next_path[p])
+            recomputed += len(columns)
+
+        meta = {"kind": "route_table", "fingerprint": state.fingerprint, "profiles": list(state.profiles)}
+        write_arrays(self.path, meta, {
+            "building_ids": state.building_ids,
+            "edges": state.edges,
+            "weights": state.weights,
+            "cost": cost,
+            "dist": dist,
+            "next_bld": next_bld,
+            "next_path": next_path,
+        })
+        return recomputed
+
+    def repair(self, state):
+        """Bring the table file up to date with state, unless another process is already doing it."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".lock", "a") as lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return
+            try:
+                old = open_if_changed(self.path, self._table) or self._table
+                if old is not None and old.meta["fingerprint"] == state.fingerprint:
+                    self._table = old
+                    return
+                recomputed = self.build(state, old)
+                self._table = MappedArrays(self.path)
+                self.repairs += 1
+                self.columns_recomputed += recomputed
+                logger.info("Route table updated", extra={
+                    "buildings": len(state.building_ids), "columns_recomputed": recomputed,
+                    "profiles": len(state.profiles)})
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def schedule_repair(self, state):
+        with self._lock:
+            if self._repairing:
+                return
+            self._repairing = True
+
+        def run():
+            try:
+                self.repair(state)
+            except Exception:
+                logger.exception("Route table repair failed")
+            finally:
+                with self._lock:
+                    self._repairing = False
+
+        threading.Thread(target=run, name="route-table-repair", daemon=True).start()
+
+    def stats(self):
+        table = self._table
+        return {
+            "enabled": self.enabled,
+            "buildings": len(table.building_ids) if table is not None else 0,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "repairs": self.repairs,
+            "columns_recomputed": self.columns_recomputed,
+        }
+
+
+route_table = RouteTable()
+
+
+@click.command('build-route-table')
+@with_appcontext
+def build_route_table_command():
+    """Build or repair the all-pairs building route table now."""
+    if not route_table.enabled:
+        raise click.ClickException("ROUTE_TABLE_ENABLED is off")
+    state = route_table.current_state()
+    before = route_table.columns_recomputed
+    route_table.repair(state)
+    click.echo(f"{len(state.building_ids)} building(s), "
+               f"{route_table.columns_recomputed - before} column(s) recomputed -> {route_table.path}")
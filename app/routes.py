@@ -1,47 +1,53 @@
-from flask import Blueprint, jsonify, request
-from app.models import Building, Entrance, Path, Obstacle
+from flask import Blueprint, Response, abort, jsonify, request, current_app, stream_with_context
+from sqlalchemy import func, or_
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.orm import selectinload
+from app.models import Building, Entrance, Path, Obstacle, Closure, AccessibilityFeature, User
 from app import db
-from datetime import datetime
-import requests
-import os
+from app import routing_engine, obstacle_filter, bulk, sync, geometry, schedule
+from app.hooks import building_changed, entrance_changed, path_changed, obstacle_changed, closure_changed
+from app.osrm_client import osrm_client, async_osrm_client, OSRMError
+from app.response_cache import collection_cache
+from app import collection_query
+from app.route_cache import route_cache
+from app.route_table import route_table
+from app.contraction import contraction
+from app.graph_snapshot import graph_snapshot
+from app.indoor import floor_plans
+from app.spatial_index import spatial_index, KINDS as SPATIAL_KINDS
+from app.obstacle_feed import obstacle_feed, obstacle_json
+from app.obstacle_reports import obstacle_ingest
+from app.tiles import tile_cache, LAYERS as TILE_LAYERS
+from app.metrics import metrics
+import asyncio
+import logging
+import math
+from datetime import timedelta
+
+logger = logging.getLogger(__name__)
 
 # Create Blueprint
 main = Blueprint('main', __name__)
 
-# --- Get OSRM URL from environment variable ---
-# Example: OSRM_URL=http://localhost:5000 in your .env file
-OSRM_URL = os.getenv("OSRM_URL", "http://10.96.33.120:5002") # Default to public server if not set
-
 
 #-------------------------------------------------------------------------
-# Building Methods
+# Collection Helpers
 #-------------------------------------------------------------------------
 
-# GET all buildings
-@main.route('/api/buildings', methods=['GET'])
-def get_buildings():
-    buildings = Building.query.all()
-    result = []
-    for building in buildings:
-        result.append({
-            'building_id': building.building_id,
-            'name': building.name,
-            'address': building.address,
-            'street': building.street,
-            'city': building.city,
-            'state': building.state,
-            'zip_code': building.zip_code,
-            'latitude': float(building.latitude) if building.latitude else None,
-            'longitude': float(building.longitude) if building.longitude else None,
-            'updated_at': building.updated_at.isoformat() if building.updated_at else None
-        })
-    return jsonify(result)
+# --- Helper function for list endpoints that accept bbox/fields/after_id/limit ---
+def _collection_response(name, build):
+    """Unfiltered requests get the cached full list; anything else is queried in SQL."""
+    if not collection_query.wants_query(request.args):
+        return collection_cache.response(name, build)
+    try:
+        return collection_query.response(name, request.args)
+    except ValueError as ve:
+        return jsonify({"error": f"Invalid query parameter: {ve}"}), 400
 
-# GET a specific building
-@main.route('/api/buildings/<int:building_id>', methods=['GET'])
-def get_building(building_id):
-    building = Building.query.get_or_404(building_id)
-    result = {
+
+# --- Helper functions for the row JSON shared by list, detail and composite endpoints ---
+def _building_json(building):
+    return {
         'building_id': building.building_id,
         'name': building.name,
         'address': building.address,
@@ -53,7 +59,139 @@ def get_building(building_id):
         'longitude': float(building.longitude) if building.longitude else None,
         'updated_at': building.updated_at.isoformat() if building.updated_at else None
     }
-    return jsonify(result)
+
+def _entrance_json(entrance):
+    return {
+        'entrance_id': entrance.entrance_id,
+        'building_id': entrance.building_id,
+        'entrance_name': entrance.entrance_name,
+        'latitude': float(entrance.latitude) if entrance.latitude else None,
+        'longitude': float(entrance.longitude) if entrance.longitude else None,
+        'floor_level': entrance.floor_level,
+        'wheelchair_accessible': entrance.wheelchair_accessible,
+        'opening_hours': entrance.opening_hours,
+        'updated_at': entrance.updated_at.isoformat() if entrance.updated_at else None
+    }
+
+def _path_json(path):
+    return {
+        'path_id': path.path_id,
+        'start_location_id': path.start_location_id,
+        'end_location_id': path.end_location_id,
+        'had_incline': path.had_incline,  # Note: field name in schema is 'had_incline'
+        'has_stairs': path.has_stairs,
+        'is_wheelchair_accessible': path.is_wheelchair_accessible,
+        'is_paved': path.is_paved,
+        'path_type': path.path_type,
+        'distance': float(path.distance) if path.distance else None,
+        'max_grade': path.max_grade,
+        'updated_at': path.updated_at.isoformat() if path.updated_at else None
+    }
+
+
+#-------------------------------------------------------------------------
+# Building Methods
+#-------------------------------------------------------------------------
+
+# GET all buildings
+@main.route('/api/buildings', methods=['GET'])
+def get_buildings():
+    return collection_cache.response('buildings', _list_buildings)
+
+def _list_buildings():
+    return [_building_json(building) for building in Building.query.all()]
+
+# GET a specific building
+@main.route('/api/buildings/<int:building_id>', methods=['GET'])
+def get_building(building_id):
+    building = Building.query.get_or_404(building_id)
+    return jsonify(_building_json(building))
+
+# --- Helper function for the composite building endpoints ---
+def _full_buildings(building_ids):
+    """
+    Buildings (in building_ids order, unknown ids left out) with their
+    entrances, adjacent paths, active obstacles and accessibility features.
+    Always at most six queries: selectinload fetches each relationship for
+    every building with one IN query, and obstacles and features are one
+    query each.
+    """
+    found = Building.query.options(
+        selectinload(Building.entrances),
+        selectinload(Building.start_paths),
+        selectinload(Building.end_paths),
+    ).filter(Building.building_id.in_(building_ids)).all()
+    if not found:
+        return []
+    by_id = {building.building_id: building for building in found}
+    ids = list(by_id)
+
+    # An obstacle shows up on every building it is on, at or next to
+    owners = {}
+    for building in found:
+        for entrance in building.entrances:
+            owners.setdefault(('entrance', entrance.entrance_id), set()).add(building.building_id)
+        for path in building.start_paths + building.end_paths:
+            owners.setdefault(('path', path.path_id), set()).add(building.building_id)
+    entrance_ids = [ref for kind, ref in owners if kind == 'entrance']
+    path_ids = [ref for kind, ref in owners if kind == 'path']
+    inactive = current_app.config['OBSTACLE_INACTIVE_STATUSES']
+    obstacles = Obstacle.query.filter(
+        or_(Obstacle.building_id.in_(ids), Obstacle.entrance_id.in_(entrance_ids), Obstacle.path_id.in_(path_ids)),
+        or_(Obstacle.status.is_(None), func.lower(Obstacle.status).notin_(inactive)),
+    ).order_by(Obstacle.obstacle_id).all()
+    obstacles_of = {building_id: [] for building_id in ids}
+    for obstacle in obstacles:
+        at = set()
+        if obstacle.building_id in obstacles_of:
+            at.add(obstacle.building_id)
+        at |= owners.get(('entrance', obstacle.entrance_id), set())
+        at |= owners.get(('path', obstacle.path_id), set())
+        for building_id in at:
+            obstacles_of[building_id].append(obstacle_json(obstacle))
+
+    # AccessibilityFeature.building_id is a free-form string
+    features_of = {str(building_id): [] for building_id in ids}
+    for feature in AccessibilityFeature.query.filter(AccessibilityFeature.building_id.in_(list(features_of))).all():
+        features_of[feature.building_id].append(feature.to_dict())
+
+    result = []
+    for building_id in building_ids:
+        building = by_id.get(building_id)
+        if building is None:
+            continue
+        paths = {path.path_id: path for path in building.start_paths + building.end_paths}
+        entry = _building_json(building)
+        entry['entrances'] = [_entrance_json(entrance)
+                              for entrance in sorted(building.entrances, key=lambda e: e.entrance_id)]
+        entry['paths'] = [_path_json(paths[path_id]) for path_id in sorted(paths)]
+        entry['obstacles'] = obstacles_of[building_id]
+        entry['accessibility_features'] = features_of[str(building_id)]
+        result.append(entry)
+    return result
+
+# GET a building with its entrances, adjacent paths, active obstacles and accessibility features
+@main.route('/api/buildings/<int:building_id>/full', methods=['GET'])
+def get_building_full(building_id):
+    buildings = _full_buildings([building_id])
+    if not buildings:
+        abort(404)
+    return jsonify(buildings[0])
+
+# GET several buildings as in /api/buildings/<id>/full (?ids=1,2,3)
+@main.route('/api/buildings/full', methods=['GET'])
+def get_buildings_full():
+    try:
+        building_ids = [int(part) for part in request.args.get('ids', '').split(',') if part.strip()]
+    except ValueError:
+        return jsonify({"error": "ids must be comma-separated building ids"}), 400
+    if not building_ids:
+        return jsonify({"error": "Missing ids"}), 400
+    max_ids = current_app.config['BUILDING_FULL_MAX_IDS']
+    if len(building_ids) > max_ids:
+        return jsonify({"error": f"At most {max_ids} ids per request"}), 400
+    # Repeated ids are returned once
+    return jsonify(_full_buildings(list(dict.fromkeys(building_ids))))
 
 # POST a new building
 @main.route('/api/buildings', methods=['POST'])
@@ -71,6 +209,7 @@ def create_building():
     )
     db.session.add(new_building)
     db.session.commit()
+    building_changed(new_building)
     
     return jsonify({
         'building_id': new_building.building_id,
@@ -90,6 +229,7 @@ def create_building():
 def update_building(building_id):
     building = Building.query.get_or_404(building_id)
     data = request.json
+    previous = (building.latitude, building.longitude)
     
     building.name = data.get('name', building.name)
     building.address = data.get('address', building.address)
@@ -101,6 +241,7 @@ def update_building(building_id):
     building.longitude = data.get('longitude', building.longitude)
     
     db.session.commit()
+    building_changed(building, previous=previous)
     
     return jsonify({
         'building_id': building.building_id,
@@ -121,6 +262,7 @@ def delete_building(building_id):
     building = Building.query.get_or_404(building_id)
     db.session.delete(building)
     db.session.commit()
+    building_changed(building, deleted=True)
     return jsonify({'message': f'Building {building_id} deleted'}), 200
 
 
@@ -133,6 +275,19 @@ def delete_building(building_id):
 def get_building_indoor_data(building_id):
     building = Building.query.get_or_404(building_id)
 
+    # --- Stored floors (e.g. imported from data/buildings.json) win over the mock data ---
+    stored_floors = []
+    for floor in building.floors:
+        entry = {'level': floor.level, 'name': floor.name}
+        if floor.is_default:
+            entry['isDefault'] = True
+        stored_floors.append(entry)
+    if not stored_floors:
+        # Floor plans imported without Floor rows still list their levels
+        stored_floors = [{'level': level, 'name': f'Level {level}'} for level in floor_plans.levels(building)]
+        if stored_floors:
+            stored_floors[0]['isDefault'] = True
+
     # --- Mock Floor Data (Replace with actual data retrieval later) ---
     # This data should ideally come from your database or a configuration file
     mock_floors = []
@@ -161,7 +316,7 @@ def get_building_indoor_data(building_id):
     result = {
         'building_id': building.building_id,
         'name': building.name,
-        'floors': mock_floors
+        'floors': stored_floors or mock_floors
         # You could add other indoor-specific details here if needed
         # 'defaultViewpoint': { 'lat': ..., 'lng': ..., 'zoom': ... }
     }
@@ -173,9 +328,19 @@ def get_floor_plan(building_id, floor_level):
     # Check if the building exists
     building = Building.query.get_or_404(building_id)
 
-    # --- Mock GeoJSON Data (Replace with actual data retrieval later) ---
-    # In a real application, you would load this from a file, database,
-    # or generate it based on stored geometry.
+    # --- Stored floor plans, served pre-compressed from the floor plan cache ---
+    try:
+        level = int(floor_level)
+    except ValueError:
+        level = None
+    if level is not None:
+        response = floor_plans.response(building, level)
+        if response is not None:
+            return response
+    if floor_plans.levels(building):
+        return jsonify({"error": f"Floor level {floor_level} not found for building {building_id}"}), 404
+
+    # --- Mock GeoJSON Data for buildings without an imported floor plan ---
     # The structure should be a valid GeoJSON FeatureCollection or Feature.
     mock_geojson = {
         "type": "FeatureCollection",
@@ -220,11 +385,6 @@ def get_floor_plan(building_id, floor_level):
     }
     # --- End Mock GeoJSON Data ---
 
-    # Basic check if the requested floor level exists in mock data (optional)
-    # You might want more robust checking against the result from the /indoor endpoint
-    # if not any(f['level'] == int(floor_level) for f in get_building_indoor_data(building_id).get_json().get('floors', [])):
-    #     return jsonify({"error": f"Floor level {floor_level} not found for building {building_id}"}), 404
-
     # Return the mock GeoJSON
     return jsonify(mock_geojson)
 
@@ -233,23 +393,13 @@ def get_floor_plan(building_id, floor_level):
 # Entrance Methods
 #-------------------------------------------------------------------------
 
-# GET all entrances
+# GET all entrances (optionally ?bbox=minLng,minLat,maxLng,maxLat&fields=...&after_id=...&limit=...)
 @main.route('/api/entrances', methods=['GET'])
 def get_entrances():
-    entrances = Entrance.query.all()
-    result = []
-    for entrance in entrances:
-        result.append({
-            'entrance_id': entrance.entrance_id,
-            'building_id': entrance.building_id,
-            'entrance_name': entrance.entrance_name,
-            'latitude': float(entrance.latitude) if entrance.latitude else None,
-            'longitude': float(entrance.longitude) if entrance.longitude else None,
-            'floor_level': entrance.floor_level,
-            'wheelchair_accessible': entrance.wheelchair_accessible,
-            'updated_at': entrance.updated_at.isoformat() if entrance.updated_at else None
-        })
-    return jsonify(result)
+    return _collection_response('entrances', _list_entrances)
+
+def _list_entrances():
+    return [_entrance_json(entrance) for entrance in Entrance.query.all()]
 
 # GET all entrances for a specific building
 @main.route('/api/buildings/<int:building_id>/entrances', methods=['GET'])
@@ -257,50 +407,34 @@ def get_building_entrances(building_id):
     # First check if the building exists
     building = Building.query.get_or_404(building_id)
     entrances = Entrance.query.filter_by(building_id=building_id).all()
-    result = []
-    for entrance in entrances:
-        result.append({
-            'entrance_id': entrance.entrance_id,
-            'building_id': entrance.building_id,
-            'entrance_name': entrance.entrance_name,
-            'latitude': float(entrance.latitude) if entrance.latitude else None,
-            'longitude': float(entrance.longitude) if entrance.longitude else None,
-            'floor_level': entrance.floor_level,
-            'wheelchair_accessible': entrance.wheelchair_accessible,
-            'updated_at': entrance.updated_at.isoformat() if entrance.updated_at else None
-        })
-    return jsonify(result)
+    return jsonify([_entrance_json(entrance) for entrance in entrances])
 
 # GET a specific entrance
 @main.route('/api/entrances/<int:entrance_id>', methods=['GET'])
 def get_entrance(entrance_id):
     entrance = Entrance.query.get_or_404(entrance_id)
-    result = {
-        'entrance_id': entrance.entrance_id,
-        'building_id': entrance.building_id,
-        'entrance_name': entrance.entrance_name,
-        'latitude': float(entrance.latitude) if entrance.latitude else None,
-        'longitude': float(entrance.longitude) if entrance.longitude else None,
-        'floor_level': entrance.floor_level,
-        'wheelchair_accessible': entrance.wheelchair_accessible,
-        'updated_at': entrance.updated_at.isoformat() if entrance.updated_at else None
-    }
-    return jsonify(result)
+    return jsonify(_entrance_json(entrance))
 
 # POST a new entrance
 @main.route('/api/entrances', methods=['POST'])
 def create_entrance():
     data = request.json
+    try:
+        opening_hours = schedule.parse_opening_hours(data.get('opening_hours'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     new_entrance = Entrance(
         building_id=data.get('building_id'),
         entrance_name=data.get('entrance_name', ''),
         latitude=data.get('latitude'),
         longitude=data.get('longitude'),
         floor_level=data.get('floor_level', 1),
-        wheelchair_accessible=data.get('wheelchair_accessible', False)
+        wheelchair_accessible=data.get('wheelchair_accessible', False),
+        opening_hours=opening_hours
     )
     db.session.add(new_entrance)
     db.session.commit()
+    entrance_changed(new_entrance)
     
     return jsonify({
         'entrance_id': new_entrance.entrance_id,
@@ -310,6 +444,7 @@ def create_entrance():
         'longitude': float(new_entrance.longitude) if new_entrance.longitude else None,
         'floor_level': new_entrance.floor_level,
         'wheelchair_accessible': new_entrance.wheelchair_accessible,
+        'opening_hours': new_entrance.opening_hours,
         'updated_at': new_entrance.updated_at.isoformat() if new_entrance.updated_at else None
     }), 201
 
@@ -318,6 +453,11 @@ def create_entrance():
 def update_entrance(entrance_id):
     entrance = Entrance.query.get_or_404(entrance_id)
     data = request.json
+    previous = (entrance.latitude, entrance.longitude)
+    try:
+        opening_hours = schedule.parse_opening_hours(data.get('opening_hours', entrance.opening_hours))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     entrance.building_id = data.get('building_id', entrance.building_id)
     entrance.entrance_name = data.get('entrance_name', entrance.entrance_name)
@@ -325,8 +465,10 @@ def update_entrance(entrance_id):
     entrance.longitude = data.get('longitude', entrance.longitude)
     entrance.floor_level = data.get('floor_level', entrance.floor_level)
     entrance.wheelchair_accessible = data.get('wheelchair_accessible', entrance.wheelchair_accessible)
+    entrance.opening_hours = opening_hours
     
     db.session.commit()
+    entrance_changed(entrance, previous=previous)
     
     return jsonify({
         'entrance_id': entrance.entrance_id,
@@ -336,6 +478,7 @@ def update_entrance(entrance_id):
         'longitude': float(entrance.longitude) if entrance.longitude else None,
         'floor_level': entrance.floor_level,
         'wheelchair_accessible': entrance.wheelchair_accessible,
+        'opening_hours': entrance.opening_hours,
         'updated_at': entrance.updated_at.isoformat() if entrance.updated_at else None
     })
 
@@ -345,48 +488,27 @@ def delete_entrance(entrance_id):
     entrance = Entrance.query.get_or_404(entrance_id)
     db.session.delete(entrance)
     db.session.commit()
+    entrance_changed(entrance, deleted=True)
     return jsonify({'message': f'Entrance {entrance_id} deleted'}), 200
 
 #-------------------------------------------------------------------------
 # Path Methods
 #-------------------------------------------------------------------------
 
-# GET all paths
+# GET all paths (optionally ?bbox=minLng,minLat,maxLng,maxLat&fields=...&after_id=...&limit=...)
 @main.route('/api/paths', methods=['GET'])
 def get_paths():
-    paths = Path.query.all()
-    result = []
-    for path in paths:
-        result.append({
-            'path_id': path.path_id,
-            'start_location_id': path.start_location_id,
-            'end_location_id': path.end_location_id,
-            'had_incline': path.had_incline,  # Note: field name in schema is 'had_incline'
-            'has_stairs': path.has_stairs,
-            'is_wheelchair_accessible': path.is_wheelchair_accessible,
-            'is_paved': path.is_paved,
-            'path_type': path.path_type,
-            'distance': float(path.distance) if path.distance else None,
-            'updated_at': path.updated_at.isoformat() if path.updated_at else None
-        })
-    return jsonify(result)
+    return _collection_response('paths', _list_paths)
+
+def _list_paths():
+    return [_path_json(path) for path in Path.query.all()]
 
 # GET a specific path
 @main.route('/api/paths/<int:path_id>', methods=['GET'])
 def get_path(path_id):
     path = Path.query.get_or_404(path_id)
-    result = {
-        'path_id': path.path_id,
-        'start_location_id': path.start_location_id,
-        'end_location_id': path.end_location_id,
-        'had_incline': path.had_incline,
-        'has_stairs': path.has_stairs,
-        'is_wheelchair_accessible': path.is_wheelchair_accessible,
-        'is_paved': path.is_paved,
-        'path_type': path.path_type,
-        'distance': float(path.distance) if path.distance else None,
-        'updated_at': path.updated_at.isoformat() if path.updated_at else None
-    }
+    result = _path_json(path)
+    result['grade_profile'] = path.grade_profile
     return jsonify(result)
 
 # POST a new path
@@ -405,6 +527,7 @@ def create_path():
     )
     db.session.add(new_path)
     db.session.commit()
+    path_changed(new_path)
     
     return jsonify({
         'path_id': new_path.path_id,
@@ -416,6 +539,7 @@ def create_path():
         'is_paved': new_path.is_paved,
         'path_type': new_path.path_type,
         'distance': float(new_path.distance) if new_path.distance else None,
+        'max_grade': new_path.max_grade,
         'updated_at': new_path.updated_at.isoformat() if new_path.updated_at else None
     }), 201
 
@@ -424,6 +548,7 @@ def create_path():
 def update_path(path_id):
     path = Path.query.get_or_404(path_id)
     data = request.json
+    previous = (path.start_location_id, path.end_location_id)
     
     path.start_location_id = data.get('start_location_id', path.start_location_id)
     path.end_location_id = data.get('end_location_id', path.end_location_id)
@@ -435,6 +560,7 @@ def update_path(path_id):
     path.distance = data.get('distance', path.distance)
     
     db.session.commit()
+    path_changed(path, previous=previous)
     
     return jsonify({
         'path_id': path.path_id,
@@ -446,6 +572,7 @@ def update_path(path_id):
         'is_paved': path.is_paved,
         'path_type': path.path_type,
         'distance': float(path.distance) if path.distance else None,
+        'max_grade': path.max_grade,
         'updated_at': path.updated_at.isoformat() if path.updated_at else None
     })
 
@@ -455,105 +582,173 @@ def delete_path(path_id):
     path = Path.query.get_or_404(path_id)
     db.session.delete(path)
     db.session.commit()
+    path_changed(path, deleted=True)
     return jsonify({'message': f'Path {path_id} deleted'}), 200
 
 #-------------------------------------------------------------------------
 # Obstacle Methods
 #-------------------------------------------------------------------------
 
-# GET all obstacles
+# --- Helper function to parse a starts_at/ends_at window ---
+def _parse_window(data, starts_at=None, ends_at=None):
+    """
+    (starts_at, ends_at) from ISO 8601 strings in data, keeping the given
+    values for missing keys; null clears an end. Raises ValueError.
+    """
+    window = {'starts_at': starts_at, 'ends_at': ends_at}
+    for key in window:
+        if key in data:
+            value = data[key]
+            if value is not None and not isinstance(value, str):
+                raise ValueError(f"'{key}' must be an ISO 8601 date-time")
+            window[key] = schedule.parse_time(value) if value is not None else None
+    if window['starts_at'] and window['ends_at'] and window['ends_at'] <= window['starts_at']:
+        raise ValueError("'ends_at' must be after 'starts_at'")
+    return window['starts_at'], window['ends_at']
+
+# --- Helper function to validate obstacle fields before they reach the database ---
+OBSTACLE_REFERENCES = {'building_id': Building, 'path_id': Path, 'entrance_id': Entrance}
+
+def _parse_obstacle_fields(data):
+    """
+    The obstacle fields present in data, checked and coerced: severity_level
+    an integer from 1 to OBSTACLE_MAX_SEVERITY (numeric strings accepted),
+    text fields strings that fit their columns, ids of rows that exist.
+    Raises ValueError.
+    """
+    fields = {}
+    if 'severity_level' in data:
+        value = data['severity_level']
+        max_severity = current_app.config["OBSTACLE_MAX_SEVERITY"]
+        try:
+            if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+                raise ValueError
+            severity = int(value)
+        except (TypeError, ValueError):
+            severity = None
+        if severity is None or not 1 <= severity <= max_severity:
+            raise ValueError(f"'severity_level' must be an integer from 1 to {max_severity}")
+        fields['severity_level'] = severity
+    for key, nullable in (('obstacle_type', False), ('status', True), ('user_id', True)):
+        if key in data:
+            value = data[key]
+            if value is None and nullable:
+                fields[key] = None
+            elif not isinstance(value, str) or not value or len(value) > 50:
+                raise ValueError(f"'{key}' must be a string of 1 to 50 characters")
+            else:
+                fields[key] = value
+    if 'description' in data:
+        if data['description'] is not None and not isinstance(data['description'], str):
+            raise ValueError("'description' must be a string")
+        fields['description'] = data['description']
+    for key, model in OBSTACLE_REFERENCES.items():
+        if key in data:
+            value = data[key]
+            if value is not None and (isinstance(value, bool) or not isinstance(value, int)):
+                raise ValueError(f"'{key}' must be an integer")
+            if value is not None and db.session.get(model, value) is None:
+                raise ValueError(f"Unknown {key} {value}")
+            fields[key] = value
+    if fields.get('user_id') is not None and User.query.filter_by(username=fields['user_id']).first() is None:
+        raise ValueError(f"Unknown user_id '{fields['user_id']}'")
+    return fields
+
+# GET all obstacles (optionally ?bbox=minLng,minLat,maxLng,maxLat&fields=...&after_id=...&limit=...)
 @main.route('/api/obstacles', methods=['GET'])
 def get_obstacles():
-    obstacles = Obstacle.query.all()
-    result = []
-    for obstacle in obstacles:
-        result.append({
-            'obstacle_id': obstacle.obstacle_id,
-            'user_id': obstacle.user_id,
-            'building_id': obstacle.building_id,
-            'path_id': obstacle.path_id,
-            'entrance_id': obstacle.entrance_id,
-            'description': obstacle.description,
-            'severity_level': obstacle.severity_level,
-            'reported_at': obstacle.reported_at.isoformat() if obstacle.reported_at else None,
-            'status': obstacle.status
-        })
-    return jsonify(result)
+    return _collection_response('obstacles', _list_obstacles)
+
+def _list_obstacles():
+    return [obstacle_json(obstacle) for obstacle in Obstacle.query.all()]
+
+# GET a live stream of obstacle changes (Server-Sent Events)
+@main.route('/api/obstacles/stream', methods=['GET'])
+def stream_obstacles():
+    """
+    Events: created/updated (the obstacle as in GET /api/obstacles/<id>),
+    deleted ({"obstacle_id": ...}) and reset (refetch /api/obstacles).
+    Browsers resume with the Last-Event-ID header on their own; other
+    clients can pass ?lastEventId=.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+    return obstacle_feed.response(last_event_id)
 
 # GET a specific obstacle
 @main.route('/api/obstacles/<int:obstacle_id>', methods=['GET'])
 def get_obstacle(obstacle_id):
     obstacle = Obstacle.query.get_or_404(obstacle_id)
-    result = {
-        'obstacle_id': obstacle.obstacle_id,
-        'user_id': obstacle.user_id,
-        'building_id': obstacle.building_id,
-        'path_id': obstacle.path_id,
-        'entrance_id': obstacle.entrance_id,
-        'description': obstacle.description,
-        'severity_level': obstacle.severity_level,
-        'reported_at': obstacle.reported_at.isoformat() if obstacle.reported_at else None,
-        'status': obstacle.status
-    }
-    return jsonify(result)
+    return jsonify(obstacle_json(obstacle))
 
-# POST a new obstacle
+# POST a new obstacle report
 @main.route('/api/obstacles', methods=['POST'])
 def create_obstacle():
+    """
+    Reports are group-committed and deduplicated: a report of the same type
+    close to a recent active obstacle bumps its report_count (200) instead
+    of creating a new one (201). Either way the response follows the commit.
+    """
     data = request.json
-    
-    new_obstacle = Obstacle(
-        user_id=data.get('user_id'),
-        building_id=data.get('building_id'),
-        path_id=data.get('path_id'),
-        entrance_id=data.get('entrance_id'),
-        description=data.get('description', ''),
-        severity_level=data.get('severity_level', 1),  # Integer in schema
-        reported_at=datetime.now(),
-        status=data.get('status', 'Pending')
-    )
-    db.session.add(new_obstacle)
-    db.session.commit()
-    
-    return jsonify({
-        'obstacle_id': new_obstacle.obstacle_id,
-        'user_id': new_obstacle.user_id,
-        'building_id': new_obstacle.building_id,
-        'path_id': new_obstacle.path_id,
-        'entrance_id': new_obstacle.entrance_id,
-        'description': new_obstacle.description,
-        'severity_level': new_obstacle.severity_level,
-        'reported_at': new_obstacle.reported_at.isoformat() if new_obstacle.reported_at else None,
-        'status': new_obstacle.status
-    }), 201
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+    try:
+        latitude = float(data['latitude'])
+        longitude = float(data['longitude'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "latitude and longitude are required numbers"}), 400
+    try:
+        starts_at, ends_at = _parse_window(data)
+        fields = _parse_obstacle_fields(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    report = {
+        'latitude': latitude,
+        'longitude': longitude,
+        'obstacle_type': 'other',
+        'user_id': None,
+        'building_id': None,
+        'path_id': None,
+        'entrance_id': None,
+        'description': '',
+        'severity_level': 1,
+        'status': 'Pending',
+        'starts_at': starts_at,
+        'ends_at': ends_at,
+    }
+    report.update(fields)
+    result, status = obstacle_ingest.submit(report)
+    return jsonify(result), status
 
 # PUT (update) an obstacle
 @main.route('/api/obstacles/<int:obstacle_id>', methods=['PUT'])
 def update_obstacle(obstacle_id):
     obstacle = Obstacle.query.get_or_404(obstacle_id)
     data = request.json
-    
-    obstacle.user_id = data.get('user_id', obstacle.user_id)
-    obstacle.building_id = data.get('building_id', obstacle.building_id)
-    obstacle.path_id = data.get('path_id', obstacle.path_id)
-    obstacle.entrance_id = data.get('entrance_id', obstacle.entrance_id)
-    obstacle.description = data.get('description', obstacle.description)
-    obstacle.severity_level = data.get('severity_level', obstacle.severity_level)
-    obstacle.status = data.get('status', obstacle.status)
+    previous = (obstacle.latitude, obstacle.longitude, obstacle.path_id)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+    try:
+        starts_at, ends_at = _parse_window(data, obstacle.starts_at, obstacle.ends_at)
+        fields = _parse_obstacle_fields(data)
+        for key in ('latitude', 'longitude'):
+            if key in data:
+                try:
+                    fields[key] = float(data[key])
+                except (TypeError, ValueError):
+                    raise ValueError(f"'{key}' must be a number")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    for key, value in fields.items():
+        setattr(obstacle, key, value)
+    obstacle.starts_at = starts_at
+    obstacle.ends_at = ends_at
     
     db.session.commit()
+    obstacle_changed(obstacle, previous=previous)
     
-    return jsonify({
-        'obstacle_id': obstacle.obstacle_id,
-        'user_id': obstacle.user_id,
-        'building_id': obstacle.building_id,
-        'path_id': obstacle.path_id,
-        'entrance_id': obstacle.entrance_id,
-        'description': obstacle.description,
-        'severity_level': obstacle.severity_level,
-        'reported_at': obstacle.reported_at.isoformat() if obstacle.reported_at else None,
-        'status': obstacle.status
-    })
+    return jsonify(obstacle_json(obstacle))
 
 # DELETE an obstacle
 @main.route('/api/obstacles/<int:obstacle_id>', methods=['DELETE'])
@@ -561,8 +756,255 @@ def delete_obstacle(obstacle_id):
     obstacle = Obstacle.query.get_or_404(obstacle_id)
     db.session.delete(obstacle)
     db.session.commit()
+    obstacle_changed(obstacle, deleted=True)
     return jsonify({'message': f'Obstacle {obstacle_id} deleted'}), 200
 
+#-------------------------------------------------------------------------
+# Closure Methods
+#-------------------------------------------------------------------------
+
+# --- Helper function to serialize a closure ---
+def _closure_json(closure):
+    return {
+        'closure_id': closure.closure_id,
+        'path_id': closure.path_id,
+        'entrance_id': closure.entrance_id,
+        'starts_at': closure.starts_at.isoformat() if closure.starts_at else None,
+        'ends_at': closure.ends_at.isoformat() if closure.ends_at else None,
+        'reason': closure.reason,
+        'updated_at': closure.updated_at.isoformat() if closure.updated_at else None
+    }
+
+# --- Helper function to apply a closure request body ---
+def _apply_closure(closure, data):
+    """Set the fields in data on closure; ValueError if the result is not a valid closure."""
+    closure.starts_at, closure.ends_at = _parse_window(data, closure.starts_at, closure.ends_at)
+    closure.path_id = data.get('path_id', closure.path_id)
+    closure.entrance_id = data.get('entrance_id', closure.entrance_id)
+    closure.reason = data.get('reason', closure.reason)
+    if (closure.path_id is None) == (closure.entrance_id is None):
+        raise ValueError("A closure needs exactly one of 'path_id' or 'entrance_id'")
+    if closure.path_id is not None and db.session.get(Path, closure.path_id) is None:
+        raise ValueError(f"Path {closure.path_id} not found")
+    if closure.entrance_id is not None and db.session.get(Entrance, closure.entrance_id) is None:
+        raise ValueError(f"Entrance {closure.entrance_id} not found")
+
+# GET all closures that have not ended yet (?all=true includes past ones)
+@main.route('/api/closures', methods=['GET'])
+def get_closures():
+    query = Closure.query
+    if request.args.get('all', 'false').lower() != 'true':
+        query = query.filter(db.or_(Closure.ends_at.is_(None), Closure.ends_at > schedule.now()))
+    closures = query.order_by(Closure.starts_at, Closure.closure_id).all()
+    return jsonify([_closure_json(closure) for closure in closures])
+
+# GET a specific closure
+@main.route('/api/closures/<int:closure_id>', methods=['GET'])
+def get_closure(closure_id):
+    return jsonify(_closure_json(Closure.query.get_or_404(closure_id)))
+
+# POST a new closure of a path or an entrance
+@main.route('/api/closures', methods=['POST'])
+def create_closure():
+    """
+    Body: path_id or entrance_id, starts_at/ends_at (ISO 8601, campus local
+    time unless an offset is given; either may be null) and a reason.
+    """
+    closure = Closure()
+    try:
+        _apply_closure(closure, request.json)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    db.session.add(closure)
+    db.session.commit()
+    closure_changed(closure)
+    return jsonify(_closure_json(closure)), 201
+
+# PUT (update) a closure
+@main.route('/api/closures/<int:closure_id>', methods=['PUT'])
+def update_closure(closure_id):
+    closure = Closure.query.get_or_404(closure_id)
+    try:
+        _apply_closure(closure, request.json)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    db.session.commit()
+    closure_changed(closure)
+    return jsonify(_closure_json(closure))
+
+# DELETE a closure
+@main.route('/api/closures/<int:closure_id>', methods=['DELETE'])
+def delete_closure(closure_id):
+    closure = Closure.query.get_or_404(closure_id)
+    db.session.delete(closure)
+    db.session.commit()
+    closure_changed(closure, deleted=True)
+    return jsonify({'message': f'Closure {closure_id} deleted'}), 200
+
+
+
+#-------------------------------------------------------------------------
+# Bulk Data Methods
+#-------------------------------------------------------------------------
+
+# GET a streaming export of buildings, entrances, floors and paths
+@main.route('/api/bulk', methods=['GET'])
+def export_bulk():
+    """
+    Streams campus data as NDJSON (default) or a GeoJSON FeatureCollection.
+    Optional: format=ndjson|geojson, layers=building,entrance,floor,path
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in bulk.FORMATS:
+        return jsonify({"error": f"Unknown format '{fmt}'"}), 400
+    try:
+        layers = bulk.parse_layers(request.args.get('layers'))
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+
+    encode, mimetype = bulk.FORMATS[fmt]
+    return Response(stream_with_context(encode(bulk.export_rows(layers))), mimetype=mimetype)
+
+# POST a streaming import of campus data
+@main.route('/api/bulk', methods=['POST'])
+def import_bulk():
+    """
+    Upserts campus data streamed in the request body.
+    Content-Type application/x-ndjson (or application/geo+json-seq) is read
+    line by line; anything else is read as a JSON array or FeatureCollection.
+    Returns the number of rows written per layer.
+    """
+    mimetype = request.mimetype
+    if mimetype in ('application/x-ndjson', 'application/geo+json-seq', 'application/jsonl'):
+        items = bulk.iter_ndjson(request.stream)
+    else:
+        items = bulk.iter_json(request.stream)
+
+    try:
+        counts = bulk.import_rows(bulk.iter_rows(items), batch_size=current_app.config["BULK_BATCH_SIZE"])
+    except ValueError as ve:
+        return jsonify({"error": f"Invalid bulk data: {ve}"}), 400
+    except (IntegrityError, DataError) as e:
+        # import_rows has rolled the failed batch back; earlier batches stay committed
+        return jsonify({"error": f"Invalid bulk data: {e.orig}"}), 400
+    return jsonify({'imported': counts}), 200
+
+
+#-------------------------------------------------------------------------
+# Sync Methods
+#-------------------------------------------------------------------------
+
+# GET buildings, entrances and paths changed since a cursor (offline clients)
+@main.route('/api/sync', methods=['GET'])
+def get_sync():
+    """
+    Without since=, returns everything ("full": true). Keep the returned
+    "cursor" and pass it as since= next time to get only the rows changed
+    and the ids deleted in between.
+    Optional: format=json|msgpack (or Accept: application/msgpack)
+    """
+    fmt = request.args.get('format')
+    if fmt is None:
+        best = request.accept_mimetypes.best_match(
+            ['application/json', 'application/msgpack', 'application/x-msgpack'])
+        fmt = 'msgpack' if best in ('application/msgpack', 'application/x-msgpack') and sync.msgpack else 'json'
+    if fmt not in sync.FORMATS:
+        return jsonify({"error": f"Unknown format '{fmt}'"}), 400
+    if fmt == 'msgpack' and sync.msgpack is None:
+        return jsonify({"error": "MessagePack is not available on this server"}), 406
+
+    since = request.args.get('since')
+    try:
+        since = sync.decode_cursor(since) if since else None
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    return sync.response(since, fmt)
+
+
+#-------------------------------------------------------------------------
+# Spatial Query Methods
+#-------------------------------------------------------------------------
+
+# GET the nearest buildings/entrances/obstacles/accessibility features to a point
+@main.route('/api/nearest', methods=['GET'])
+def get_nearest():
+    """
+    Nearest-neighbour and radius lookup over the in-memory spatial index.
+    Requires 'lat' and 'lng'. Optional:
+      type=entrance[,building,obstacle,accessibility_feature]
+      k=<max results, default 5>
+      radius=<meters>; when given, every match within the radius is
+        returned, nearest first (at most k if k is given)
+    Any other parameter filters on an attribute, compared as the
+    attribute's type (true/false, numbers, text), e.g.
+    /api/nearest?lat=33.94&lng=-84.52&type=entrance&wheelchair_accessible=true
+    /api/nearest?lat=33.94&lng=-84.52&type=accessibility_feature&feature_type=elevator&radius=200
+    """
+    args = request.args.to_dict()
+    try:
+        lat = float(args.pop("lat"))
+        lng = float(args.pop("lng"))
+        k = args.pop("k", None)
+        k = int(k) if k is not None else None
+        radius = args.pop("radius", None)
+        radius = float(radius) if radius is not None else None
+    except KeyError:
+        return jsonify({"error": "Missing 'lat' or 'lng' parameters"}), 400
+    except ValueError as ve:
+        return jsonify({"error": f"Invalid parameter: {ve}"}), 400
+    if k is not None and k < 1:
+        return jsonify({"error": "'k' must be at least 1"}), 400
+
+    kinds = args.pop("type", None)
+    if kinds:
+        kinds = tuple(kinds.split(","))
+        unknown = [kind for kind in kinds if kind not in SPATIAL_KINDS]
+        if unknown:
+            return jsonify({"error": f"Unknown type(s): {', '.join(unknown)}"}), 400
+    # Whatever is left filters on attributes
+    if radius is not None:
+        matches = spatial_index.within(lat, lng, radius, kinds=kinds, **args)[:k]
+    else:
+        matches = spatial_index.nearest(lat, lng, k=k or 5, kinds=kinds, **args)
+
+    result = []
+    for distance, kind, item_id, item_lat, item_lng, attrs in matches:
+        item = {
+            'type': kind,
+            'id': item_id,
+            'latitude': item_lat,
+            'longitude': item_lng,
+            'distance': distance,
+        }
+        item.update(attrs)
+        result.append(item)
+    return jsonify(result)
+
+
+#-------------------------------------------------------------------------
+# Vector Tile Methods
+#-------------------------------------------------------------------------
+
+# GET one layer of one map tile as a Mapbox Vector Tile
+@main.route('/api/tiles/<layer>/<int:z>/<int:x>/<int:y>.mvt', methods=['GET'])
+def get_tile(layer, z, x, y):
+    """
+    Layers: building, entrance, path, obstacle, accessibility_feature, indoor.
+    Tiles below a layer's minimum zoom are empty; zooms above TILE_MAX_ZOOM
+    are not served (clients overzoom the last level).
+    Example: /api/tiles/path/17/34781/52366.mvt
+    """
+    if layer not in TILE_LAYERS:
+        return jsonify({"error": f"Unknown layer '{layer}'"}), 404
+    if z > tile_cache.max_zoom or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({"error": f"No tile {z}/{x}/{y}"}), 404
+
+    body, etag = tile_cache.get(layer, z, x, y)
+    response = Response(body, mimetype="application/vnd.mapbox-vector-tile")
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 
 #-------------------------------------------------------------------------
@@ -577,69 +1019,419 @@ def get_osrm_route(start_coords, end_coords, accessibility_params):
     end_coords: tuple (lat, lng)
     accessibility_params: dict containing preferences like 'avoidStairs'
     """
+    return get_osrm_routes(start_coords, end_coords, accessibility_params)[0]
+
+# --- Helper function to call OSRM for a route and its alternatives ---
+def get_osrm_routes(start_coords, end_coords, accessibility_params, alternatives=1):
+    """
+    Fetches up to `alternatives` routes from OSRM in one request (OSRM's
+    own alternatives search), best first.
+    """
+    profile, params = _osrm_route_request(accessibility_params, alternatives)
+    try:
+        data = osrm_client.route(profile, [start_coords, end_coords], **params)
+        return _osrm_routes(data, alternatives)
+    except OSRMError as e:
+        logger.warning("Error connecting to OSRM", extra={"error": str(e)})
+        raise
+    except Exception as e:
+        logger.error("Error processing OSRM response", extra={"error": str(e)})
+        raise Exception(f"Error getting route from service: {e}")
+
+async def get_osrm_routes_async(start_coords, end_coords, accessibility_params, alternatives=1):
+    """get_osrm_routes without blocking a thread while OSRM answers (see app/asgi.py)."""
+    profile, params = _osrm_route_request(accessibility_params, alternatives)
+    try:
+        data = await async_osrm_client.route(profile, [start_coords, end_coords], **params)
+        return _osrm_routes(data, alternatives)
+    except OSRMError as e:
+        logger.warning("Error connecting to OSRM", extra={"error": str(e)})
+        raise
+    except Exception as e:
+        logger.error("Error processing OSRM response", extra={"error": str(e)})
+        raise Exception(f"Error getting route from service: {e}")
+
+def _osrm_route_request(accessibility_params, alternatives):
+    """(profile, query params) of an OSRM /route request."""
     # Determine which OSRM profile to use based on accessibility
     # Example: Use 'foot-accessible' profile if avoidStairs is true
     profile = "foot-accessible" if accessibility_params.get("avoidStairs", False) else "foot"
-    # Construct OSRM API request URL
     # Format: {osrm_url}/route/v1/{profile}/{lon1},{lat1};{lon2},{lat2}?overview=full&geometries=geojson&steps=true
-    url = (
-        f"{OSRM_URL}/route/v1/{profile}/"
-        f"{start_coords[1]},{start_coords[0]};{end_coords[1]},{end_coords[0]}"
-        f"?overview=full&geometries=geojson&steps=true" # Request full geometry as GeoJSON and steps
-    )
+    params = {"overview": "full", "geometries": "geojson", "steps": "true"} # Request full geometry as GeoJSON and steps
+    if alternatives > 1:
+        params["alternatives"] = str(alternatives - 1)
+    return profile, params
+
+def _osrm_routes(data, alternatives):
+    if data.get("code") == "Ok" and data.get("routes"):
+        return [_format_osrm_route(route) for route in data["routes"][:alternatives]]
+    else:
+        raise Exception(f"OSRM API Error: {data.get('code')} - {data.get('message', 'No route found')}")
+
+def _format_osrm_route(route):
+    """One OSRM route in the response format of get_osrm_route."""
+    with metrics.span("osrm.format"):
+        # Extract relevant information
+        geometry = route["geometry"]["coordinates"] # GeoJSON format [lng, lat]
+        # Convert GeoJSON [lng, lat] to {lat, lng} for frontend
+        formatted_geometry = [{"lat": coord[1], "lng": coord[0]} for coord in geometry]
+
+        # Extract steps/instructions if needed
+        instructions = []
+        if route.get("legs"):
+            for leg in route["legs"]:
+                if leg.get("steps"):
+                    for step in leg["steps"]:
+                        # --- Use .get() for potentially missing keys ---
+                        maneuver_data = step.get("maneuver", {}) # Get maneuver safely
+                        instructions.append({
+                            "maneuver": maneuver_data.get("type", "unknown"), # Get type safely
+                            "instruction": maneuver_data.get("instruction", ""), # Get instruction safely, default to ""
+                            "distance": step.get("distance", 0), # Get distance safely
+                            "duration": step.get("duration", 0), # Get duration safely
+                            "name": step.get("name", "")
+                        })
+
+    # Extract summary
+    summary = {
+        "distance": route.get("distance"), # meters
+        "duration": route.get("duration") # seconds
+    }
+
+    return {
+        "geometry": formatted_geometry,
+        "instructions": instructions,
+        "summary": summary,
+        "warnings": [] # Filled in by obstacle_filter.apply
+    }
+
+
 
+# --- Helper function to call OSRM's table service ---
+def get_osrm_table(sources, destinations, accessibility_params):
+    """
+    Fetches a distance/duration matrix from OSRM's /table service in one request.
+    sources, destinations: lists of (lat, lng) tuples
+    """
+    profile = "foot-accessible" if accessibility_params.get("avoidStairs", False) else "foot"
     try:
-        print(f"Requesting OSRM URL: {url}") # Log the request URL
-        response = requests.get(url, timeout=10) # Add timeout
-        response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-        data = response.json()
-        print(f"OSRM Response: {data}") # Log the response
-
-        if data.get("code") == "Ok" and data.get("routes"):
-            route = data["routes"][0]
-            # Extract relevant information
-            geometry = route["geometry"]["coordinates"] # GeoJSON format [lng, lat]
-            # Convert GeoJSON [lng, lat] to {lat, lng} for frontend
-            formatted_geometry = [{"lat": coord[1], "lng": coord[0]} for coord in geometry]
-
-            # Extract steps/instructions if needed
-            instructions = []
-            if route.get("legs"):
-                for leg in route["legs"]:
-                    if leg.get("steps"):
-                        for step in leg["steps"]:
-                            # --- Use .get() for potentially missing keys ---
-                            maneuver_data = step.get("maneuver", {}) # Get maneuver safely
-                            instructions.append({
-                                "maneuver": maneuver_data.get("type", "unknown"), # Get type safely
-                                "instruction": maneuver_data.get("instruction", ""), # Get instruction safely, default to ""
-                                "distance": step.get("distance", 0), # Get distance safely
-                                "duration": step.get("duration", 0), # Get duration safely
-                                "name": step.get("name", "")
-                            })
-
-            # Extract summary
-            summary = {
-                "distance": route.get("distance"), # meters
-                "duration": route.get("duration") # seconds
-            }
+        data = osrm_client.table(profile, sources, destinations)
+    except OSRMError as e:
+        logger.warning("Error connecting to OSRM", extra={"error": str(e)})
+        raise
 
-            return {
-                "geometry": formatted_geometry,
-                "instructions": instructions,
-                "summary": summary,
-                "warnings": [] # TODO: Add logic for warnings based on route properties/obstacles
-            }
-        else:
-            raise Exception(f"OSRM API Error: {data.get('code')} - {data.get('message', 'No route found')}")
+    if data.get("code") != "Ok":
+        raise Exception(f"OSRM API Error: {data.get('code')} - {data.get('message', 'No table returned')}")
+    return {
+        "distances": data.get("distances"),
+        "durations": data.get("durations"),
+    }
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error connecting to OSRM: {e}")
-        raise Exception(f"Could not connect to routing service: {e}")
-    except Exception as e:
-        print(f"Error processing OSRM response: {e}")
-        raise Exception(f"Error getting route from service: {e}")
+# --- Helper function for routes answered without a graph search ---
+def _precomputed_route(depart_at):
+    """
+    lookup for routing_engine.find_route: building pairs come from the route
+    table, anything else from the contraction hierarchy. The table was built
+    around the severe obstacles in effect now, so it only answers walks that
+    meet the same ones within ROUTE_SCHEDULE_HORIZON_S of depart_at.
+    """
+    t = schedule.timestamp(depart_at)
+    during = (t, t + current_app.config["ROUTE_SCHEDULE_HORIZON_S"])
+
+    def lookup(source, target, profile):
+        found = route_table.lookup(source, target, profile, during)
+        if found is not None:
+            return found
+        found = contraction.lookup(source, target, profile)
+        return found and (*found, ())
+
+    return lookup
 
+# --- Helper functions for the schedule a route is walked under ---
+def _departure(depart_at):
+    """departure callable for routing_engine.find_route(s): a walk starting at depart_at."""
+    walking_speed = current_app.config["WALKING_SPEED_MPS"]
+    return lambda graph: schedule.departure(graph, depart_at, walking_speed)
+
+def _schedule_in_effect(depart_at):
+    """Whether any closure or opening hours close something during a walk starting at depart_at."""
+    t = schedule.timestamp(depart_at)
+    return schedule.get_schedule().closed_between(t, t + current_app.config["ROUTE_SCHEDULE_HORIZON_S"])
+
+# --- Helper functions to pick a routing engine ---
+def _engine_order(start_room, end_room, accessibility_params, depart_at):
+    """
+    Engines to try for a route, in order: ("local",) for rooms and
+    maxIncline, which OSRM knows nothing about; ("osrm", "local") when
+    ROUTING_ENGINE is 'osrm' and no closure or opening hours are in effect
+    at depart_at (OSRM knows nothing about those either); else ("local", "osrm").
+    """
+    if start_room is not None or end_room is not None or routing_engine.max_grade_for(accessibility_params):
+        return ("local",)
+    if current_app.config["ROUTING_ENGINE"] == "osrm" and not _schedule_in_effect(depart_at):
+        return ("osrm", "local")
+    return ("local", "osrm")
+
+def _route_with(order, local, osrm):
+    """
+    Call local() and osrm() in the given order: OSRM failing for any reason
+    falls back to the local graph, the local graph only falls back to OSRM
+    when it has no route.
+    """
+    if order[0] == "osrm":
+        try:
+            return osrm()
+        except Exception as osrm_error:
+            try:
+                return local()
+            except routing_engine.NoRouteError:
+                raise osrm_error
+
+    try:
+        return local()
+    except routing_engine.RouteClosedError:
+        # OSRM would happily lead through the closure
+        raise
+    except routing_engine.NoRouteError as e:
+        if len(order) == 1:
+            raise
+        logger.info("Local routing unavailable, falling back to OSRM", extra={"reason": str(e)})
+        return osrm()
+
+async def _route_with_async(order, local, osrm):
+    """_route_with with local() run in a worker thread and osrm() awaited."""
+    if order[0] == "osrm":
+        try:
+            return await osrm()
+        except Exception as osrm_error:
+            try:
+                return await _to_thread(local)
+            except routing_engine.NoRouteError:
+                raise osrm_error
+
+    try:
+        return await _to_thread(local)
+    except routing_engine.RouteClosedError:
+        raise
+    except routing_engine.NoRouteError as e:
+        if len(order) == 1:
+            raise
+        logger.info("Local routing unavailable, falling back to OSRM", extra={"reason": str(e)})
+        return await osrm()
+
+async def _to_thread(fn, *args):
+    """
+    Run blocking fn (database, graph search) in a worker thread with the
+    current app and request context. If the request is cancelled meanwhile,
+    fn still finishes before the cancellation goes on, so the request's
+    database session is never torn down under it.
+    """
+    future = asyncio.ensure_future(asyncio.to_thread(fn, *args))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.wait([future])
+        raise
+
+def _local_route(start_coords, end_coords, accessibility_params, start_room, end_room, depart_at):
+    config = current_app.config
+    with metrics.span("routing.local"):
+        return routing_engine.find_route(
+            start_coords, end_coords, accessibility_params,
+            walking_speed=config["WALKING_SPEED_MPS"],
+            max_snap_m=config["ROUTING_MAX_SNAP_M"],
+            lookup=_precomputed_route(depart_at),
+            start_room=start_room,
+            end_room=end_room,
+            departure=_departure(depart_at),
+        )
+
+def _local_routes(start_coords, end_coords, accessibility_params, k, start_room, end_room, depart_at,
+                  blocked_edges=None):
+    config = current_app.config
+    with metrics.span("routing.local"):
+        return routing_engine.find_routes(
+            start_coords, end_coords, accessibility_params, k,
+            walking_speed=config["WALKING_SPEED_MPS"],
+            max_snap_m=config["ROUTING_MAX_SNAP_M"],
+            blocked_edges=blocked_edges,
+            start_room=start_room,
+            end_room=end_room,
+            penalty=config["ROUTE_ALTERNATIVE_PENALTY"],
+            max_overlap=config["ROUTE_ALTERNATIVE_MAX_OVERLAP"],
+            max_stretch=config["ROUTE_ALTERNATIVE_MAX_STRETCH"],
+            departure=_departure(depart_at),
+        )
+
+def compute_route(start_coords, end_coords, accessibility_params, start_room=None, end_room=None, depart_at=None):
+    """
+    Routes with the engine selected by ROUTING_ENGINE.
+    'local' uses the in-process Path graph and falls back to OSRM when the
+    graph cannot answer; 'osrm' falls back to the local graph when OSRM fails.
+    Routes starting or ending in an indoor room or limited by maxIncline
+    only use the local graph, and so do walks starting at depart_at (default now) while closures or opening
+    hours are in effect: OSRM knows nothing about either.
+    """
+    depart_at = depart_at or schedule.now()
+    return _route_with(
+        _engine_order(start_room, end_room, accessibility_params, depart_at),
+        lambda: _local_route(start_coords, end_coords, accessibility_params, start_room, end_room, depart_at),
+        lambda: get_osrm_route(start_coords, end_coords, accessibility_params),
+    )
+
+async def compute_route_async(start_coords, end_coords, accessibility_params, start_room=None, end_room=None,
+                              depart_at=None):
+    """compute_route that awaits OSRM instead of holding a thread for it."""
+    depart_at = depart_at or schedule.now()
+    order = await _to_thread(_engine_order, start_room, end_room, accessibility_params, depart_at)
+
+    async def osrm():
+        return (await get_osrm_routes_async(start_coords, end_coords, accessibility_params))[0]
+
+    return await _route_with_async(
+        order,
+        lambda: _local_route(start_coords, end_coords, accessibility_params, start_room, end_room, depart_at),
+        osrm,
+    )
+
+
+# --- Helper function to check a route against reported obstacles ---
+def compute_route_avoiding_obstacles(start_coords, end_coords, accessibility_params, start_room=None, end_room=None,
+                                     depart_at=None):
+    """
+    compute_route plus obstacle warnings. When an active obstacle above
+    OBSTACLE_REROUTE_SEVERITY lies on the route, the local graph is asked for
+    a route that avoids it; the original route is kept if none exists.
+    Obstacles with a window only count if it is open during the walk.
+    """
+    depart_at = depart_at or schedule.now()
+    route_data = compute_route(start_coords, end_coords, accessibility_params, start_room, end_room, depart_at)
+    return _avoid_obstacles(route_data, start_coords, end_coords, accessibility_params, start_room, end_room,
+                            depart_at)
+
+async def compute_route_avoiding_obstacles_async(start_coords, end_coords, accessibility_params, start_room=None,
+                                                 end_room=None, depart_at=None):
+    depart_at = depart_at or schedule.now()
+    route_data = await compute_route_async(start_coords, end_coords, accessibility_params, start_room, end_room,
+                                           depart_at)
+    return await _to_thread(_avoid_obstacles, route_data, start_coords, end_coords, accessibility_params,
+                            start_room, end_room, depart_at)
+
+def _avoid_obstacles(route_data, start_coords, end_coords, accessibility_params, start_room, end_room, depart_at):
+    config = current_app.config
+    t = schedule.timestamp(depart_at)
+    obstacles = obstacle_filter.get_active_obstacles(config["OBSTACLE_INACTIVE_STATUSES"]).during(
+        t, t + route_data["summary"]["duration"])
+
+    def reroute(blocked_edges):
+        try:
+            return routing_engine.find_route(
+                start_coords, end_coords, accessibility_params,
+                walking_speed=config["WALKING_SPEED_MPS"],
+                max_snap_m=config["ROUTING_MAX_SNAP_M"],
+                blocked_edges=blocked_edges,
+                start_room=start_room,
+                end_room=end_room,
+                departure=_departure(depart_at),
+            )
+        except routing_engine.NoRouteError:
+            return None
+
+    with metrics.span("obstacles.check"):
+        return obstacle_filter.apply(
+            route_data, obstacles,
+            buffer_m=config["OBSTACLE_BUFFER_M"],
+            reroute_severity=config["OBSTACLE_REROUTE_SEVERITY"],
+            reroute=reroute,
+        )
+
+# --- Helper function for several diverse routes between the same points ---
+def compute_alternatives(start_coords, end_coords, accessibility_params, k, start_room=None, end_room=None,
+                         depart_at=None):
+    """
+    Up to k diverse routes ranked by stairs, incline, surface and nearby
+    obstacles. The best route's fields come first, the others follow in
+    "alternatives". Engines and fallbacks are chosen as in compute_route;
+    both answer all k routes from a single search or OSRM request.
+    """
+    depart_at = depart_at or schedule.now()
+    routes = _route_with(
+        _engine_order(start_room, end_room, accessibility_params, depart_at),
+        lambda: _local_routes(start_coords, end_coords, accessibility_params, k, start_room, end_room, depart_at),
+        lambda: get_osrm_routes(start_coords, end_coords, accessibility_params, alternatives=k),
+    )
+    return _rank_alternatives(routes, start_coords, end_coords, accessibility_params, k, start_room, end_room,
+                              depart_at)
+
+async def compute_alternatives_async(start_coords, end_coords, accessibility_params, k, start_room=None,
+                                     end_room=None, depart_at=None):
+    depart_at = depart_at or schedule.now()
+    order = await _to_thread(_engine_order, start_room, end_room, accessibility_params, depart_at)
+    routes = await _route_with_async(
+        order,
+        lambda: _local_routes(start_coords, end_coords, accessibility_params, k, start_room, end_room, depart_at),
+        lambda: get_osrm_routes_async(start_coords, end_coords, accessibility_params, alternatives=k),
+    )
+    return await _to_thread(_rank_alternatives, routes, start_coords, end_coords, accessibility_params, k,
+                            start_room, end_room, depart_at)
+
+def _rank_alternatives(routes, start_coords, end_coords, accessibility_params, k, start_room, end_room, depart_at):
+    config = current_app.config
+    t = schedule.timestamp(depart_at)
+    obstacles = obstacle_filter.get_active_obstacles(config["OBSTACLE_INACTIVE_STATUSES"]).during(
+        t, t + max(route["summary"]["duration"] for route in routes))
+
+    def reroute(blocked_edges):
+        try:
+            return _local_routes(start_coords, end_coords, accessibility_params, 1, start_room, end_room,
+                                 depart_at, blocked_edges)[0]
+        except routing_engine.NoRouteError:
+            return None
+
+    with metrics.span("obstacles.check"):
+        ranked = obstacle_filter.rank(
+            routes, obstacles,
+            buffer_m=config["OBSTACLE_BUFFER_M"],
+            reroute_severity=config["OBSTACLE_REROUTE_SEVERITY"],
+            reroute=reroute,
+            obstacle_score_m=config["ROUTE_OBSTACLE_SCORE_M"],
+        )[:k]
+    route_data = dict(ranked[0])
+    route_data["alternatives"] = ranked[1:]
+    return route_data
+
+# --- Helper function to pick a routing engine for a matrix ---
+def compute_matrix(sources, destinations, accessibility_params):
+    """
+    Matrix counterpart of compute_route, with the same engine fallback
+    rules; a maxIncline limit is only known to the local graph.
+    """
+    config = current_app.config
+
+    def local():
+        with metrics.span("routing.local_matrix"):
+            return routing_engine.find_matrix(
+                sources, destinations, accessibility_params,
+                walking_speed=config["WALKING_SPEED_MPS"],
+                max_snap_m=config["ROUTING_MAX_SNAP_M"],
+            )
+
+    if routing_engine.max_grade_for(accessibility_params):
+        return local()
+    if config["ROUTING_ENGINE"] == "osrm":
+        try:
+            return get_osrm_table(sources, destinations, accessibility_params)
+        except Exception as osrm_error:
+            try:
+                return local()
+            except routing_engine.NoRouteError:
+                raise osrm_error
+
+    try:
+        return local()
+    except routing_engine.NoRouteError as e:
+        logger.info("Local matrix unavailable, falling back to OSRM", extra={"reason": str(e)})
+        return get_osrm_table(sources, destinations, accessibility_params)
 
 
 #-------------------------------------------------------------------------
@@ -652,45 +1444,299 @@ def get_route():
     """
     API endpoint to get an optimized walking route.
     Requires 'start' and 'end' parameters in 'lat,lng' format.
-    Optional accessibility parameters: 'avoidStairs=true', etc.
+    Either can be replaced by 'startRoom'/'endRoom', the id of an indoor room
+    (a floor plan feature), to route into or out of a building.
+    Optional accessibility parameters: 'avoidStairs=true', 'maxIncline=<percent>'
+    (leaves out paths steeper than that, as sampled by `flask import-dem`;
+    paths without elevation data are kept), etc.
+    Optional 'alternatives=k': up to k diverse routes, best first, with the
+    others listed under "alternatives" and every route "score"d.
+    Optional 'format=polyline6|delta' encodes the geometry compactly, and
+    'tolerance=<meters>' simplifies it (see app/geometry.py).
+    Optional 'depart_at' (ISO 8601, campus local time unless it has an
+    offset; default now): closures, entrance opening hours and obstacle
+    windows are applied at the time the walk reaches them, and the response
+    carries depart_at/arrive_at. 404 when closures leave no way through.
     Example: /api/get_route?start=33.9,-84.5&end=33.91,-84.51&avoidStairs=true
+    Example: /api/get_route?start=33.9,-84.5&endRoom=412&avoidStairs=true
+    """
+    route_request, error = _parse_route_request()
+    if error is not None:
+        return error
+    try:
+        cache_key, window, route_data = _cached_route(route_request)
+        if route_data is None:
+            args = _route_args(route_request)
+            if route_request["alternatives"] > 1:
+                route_data = compute_alternatives(*args)
+            else:
+                route_data = compute_route_avoiding_obstacles(*args)
+            _cache_route(route_request, cache_key, window, route_data)
+        return _route_response(route_request, route_data)
+    except Exception as e:
+        return _route_error(e)
+
+async def get_route_async():
+    """
+    get_route for the ASGI app (app/asgi.py): the same parameters and
+    responses, but a route that goes to OSRM awaits it instead of holding a
+    worker thread. Blocking steps run in worker threads.
     """
+    route_request, error = await _to_thread(_parse_route_request)
+    if error is not None:
+        return error
+    try:
+        cache_key, window, route_data = await _to_thread(_cached_route, route_request)
+        if route_data is None:
+            args = _route_args(route_request)
+            if route_request["alternatives"] > 1:
+                route_data = await compute_alternatives_async(*args)
+            else:
+                route_data = await compute_route_avoiding_obstacles_async(*args)
+            _cache_route(route_request, cache_key, window, route_data)
+        return await _to_thread(_route_response, route_request, route_data)
+    except Exception as e:
+        return _route_error(e)
+
+# --- Helper functions shared by get_route and get_route_async ---
+def _parse_route_request():
+    """(parsed request, None) or (None, error response) for the current request's arguments."""
     start = request.args.get("start")
     end = request.args.get("end")
+    start_room = request.args.get("startRoom", type=int)
+    end_room = request.args.get("endRoom", type=int)
+    # A value that is not a number is an error, not the default
+    alternatives = request.args.get("alternatives", type=int) if "alternatives" in request.args else 1
+    geometry_format = request.args.get("format", "geojson")
+    tolerance = request.args.get("tolerance", type=float) if "tolerance" in request.args else 0.0
+    depart_param = request.args.get("depart_at")
 
     # --- Parse Accessibility Params ---
     accessibility_params = {
         "avoidStairs": request.args.get("avoidStairs", "false").lower() == "true",
-        # Add other params as needed (e.g., maxIncline, preferRamps)
-        # "maxIncline": request.args.get("maxIncline", type=int),
+        # Steepest grade in percent (8.33 is the ADA ramp limit); None for no limit
+        "maxIncline": request.args.get("maxIncline", type=float),
+        # Add other params as needed (e.g., preferRamps)
     }
     # ---------------------------------
 
 
-    if not start or not end:
-        return jsonify({"error": "Missing 'start' or 'end' parameters"}), 400
+    if not (start or start_room is not None) or not (end or end_room is not None):
+        return None, (jsonify({"error": "Missing 'start' or 'end' parameters"}), 400)
+    max_alternatives = current_app.config["ROUTE_ALTERNATIVES_MAX"]
+    if alternatives is None or not 1 <= alternatives <= max_alternatives:
+        return None, (jsonify({"error": f"'alternatives' must be an integer between 1 and {max_alternatives}"}), 400)
+    if geometry_format not in geometry.FORMATS:
+        return None, (jsonify({"error": f"Unknown format '{geometry_format}'"}), 400)
+    if tolerance is None or not tolerance >= 0:
+        return None, (jsonify({"error": "'tolerance' must be a non-negative number of meters"}), 400)
+    max_incline = accessibility_params["maxIncline"]
+    if "maxIncline" in request.args and not (max_incline is not None and 0 < max_incline < math.inf):
+        return None, (jsonify({"error": "'maxIncline' must be a positive grade in percent"}), 400)
+    try:
+        depart_at = schedule.parse_time(depart_param) if depart_param else schedule.now()
+    except ValueError:
+        return None, (jsonify({"error": f"Invalid 'depart_at' '{depart_param}', expected ISO 8601"}), 400)
+
+    # --- Rooms stand in for their position in the routing graph ---
+    room_coords = {}
+    for room in (start_room, end_room):
+        if room is not None:
+            room_coords[room] = routing_engine.room_location(room)
+            if room_coords[room] is None:
+                return None, (jsonify({"error": f"Room {room} not found"}), 404)
 
     try:
         # Parse coordinates
-        start_coords = tuple(map(float, start.split(",")))
-        end_coords = tuple(map(float, end.split(",")))
+        start_coords = room_coords[start_room] if start_room is not None else tuple(map(float, start.split(",")))
+        end_coords = room_coords[end_room] if end_room is not None else tuple(map(float, end.split(",")))
 
         if len(start_coords) != 2 or len(end_coords) != 2:
              raise ValueError("Coordinates must be in 'lat,lng' format")
+    except ValueError as ve:
+        logger.info("Invalid route request", extra={"error": str(ve)})
+        return None, (jsonify({"error": f"Invalid coordinate format: {ve}"}), 400)
+
+    return {
+        "start_coords": start_coords,
+        "end_coords": end_coords,
+        "accessibility_params": accessibility_params,
+        "start_room": start_room,
+        "end_room": end_room,
+        "alternatives": alternatives,
+        "geometry_format": geometry_format,
+        "tolerance": tolerance,
+        "depart_param": depart_param,
+        "depart_at": depart_at,
+    }, None
+
+def _route_args(route_request):
+    """Positional arguments of compute_route_avoiding_obstacles / compute_alternatives."""
+    r = route_request
+    if r["alternatives"] > 1:
+        return (r["start_coords"], r["end_coords"], r["accessibility_params"], r["alternatives"],
+                r["start_room"], r["end_room"], r["depart_at"])
+    return r["start_coords"], r["end_coords"], r["accessibility_params"], r["start_room"], r["end_room"], r["depart_at"]
 
-        # --- Call the OSRM helper ---
-        # Note: We removed the 'provider' logic for now, assuming OSRM
-        route_data = get_osrm_route(start_coords, end_coords, accessibility_params)
-        # ----------------------------
+def _cached_route(route_request):
+    """(cache key, schedule window, cached route or None) for a parsed route request."""
+    # Routes are cached per stretch of time in which no closure, opening
+    # hour or obstacle window changes, and not at all close to a change
+    r = route_request
+    horizon = current_app.config["ROUTE_SCHEDULE_HORIZON_S"]
+    window = schedule.get_schedule().cache_key(schedule.timestamp(r["depart_at"]), horizon)
+    cache_key = route_cache.make_key(r["start_coords"], r["end_coords"], r["accessibility_params"],
+                                     start_room=r["start_room"], end_room=r["end_room"],
+                                     alternatives=r["alternatives"], window=window)
+    route_data = route_cache.get(cache_key, r["start_coords"], r["end_coords"]) if window is not None else None
+    return cache_key, window, route_data
 
+def _cache_route(route_request, cache_key, window, route_data):
+    r = route_request
+    if window is not None and route_data["summary"]["duration"] <= current_app.config["ROUTE_SCHEDULE_HORIZON_S"]:
+        route_cache.put(cache_key, route_data, r["start_coords"], r["end_coords"], r["accessibility_params"])
+
+def _route_response(route_request, route_data):
+    """A route formatted as the request asked."""
+    r = route_request
+    with metrics.span("serialize"):
+        route_data = geometry.format_route(route_data, r["geometry_format"], r["tolerance"])
+        if r["depart_param"]:
+            route_data = dict(route_data)
+            route_data["depart_at"] = r["depart_at"].isoformat()
+            route_data["arrive_at"] = (
+                r["depart_at"] + timedelta(seconds=route_data["summary"]["duration"])).isoformat()
         return jsonify(route_data) # Return the structured route data
 
-    except ValueError as ve:
-         print(f"Value Error: {ve}")
-         return jsonify({"error": f"Invalid coordinate format: {ve}"}), 400
+def _route_error(e):
+    # The request itself was validated by _parse_route_request, so anything else is on our side
+    if isinstance(e, routing_engine.NoRouteError):
+        # Only room routes and routes cut off by closures get here; every other route falls back to OSRM
+        return jsonify({"error": str(e)}), 404
+    logger.error("Routing error", extra={"error": str(e)}) # Log the specific error on the server
+    # Return a generic error to the client
+    return jsonify({"error": f"Failed to calculate route. {str(e)}"}), 500
+
+
+
+
+# --- Helper function to parse a list of points ---
+def _parse_points(points):
+    """Accepts [[lat, lng], ...] or ["lat,lng", ...] and returns a list of (lat, lng) tuples."""
+    if not isinstance(points, list):
+        raise ValueError("Expected a list of points")
+    parsed = []
+    for point in points:
+        if isinstance(point, str):
+            point = point.split(",")
+        coords = tuple(map(float, point))
+        if len(coords) != 2:
+            raise ValueError("Coordinates must be in 'lat,lng' format")
+        parsed.append(coords)
+    return parsed
+
+# POST a many-to-many distance/duration matrix
+@main.route("/api/route_matrix", methods=["POST"])
+def get_route_matrix():
+    """
+    API endpoint to get walking distances between many points in one call.
+    Body: {"sources": [[lat, lng], ...], "destinations": [[lat, lng], ...], "avoidStairs": true,
+           "maxIncline": 8.33}
+    Points may also be given as "lat,lng" strings; maxIncline (percent)
+    leaves out paths steeper than that, as for get_route.
+    Returns dense row-per-source "distances" (meters) and "durations" (seconds)
+    matrices; unreachable pairs are null.
+    """
+    data = request.json or {}
+    accessibility_params = {
+        "avoidStairs": bool(data.get("avoidStairs", False)),
+        "maxIncline": data.get("maxIncline"),
+    }
+    max_incline = accessibility_params["maxIncline"]
+    if max_incline is not None and not (isinstance(max_incline, (int, float)) and not isinstance(max_incline, bool)
+                                        and 0 < max_incline < math.inf):
+        return jsonify({"error": "'maxIncline' must be a positive grade in percent"}), 400
+
+    try:
+        sources = _parse_points(data.get("sources"))
+        destinations = _parse_points(data.get("destinations"))
+    except (TypeError, ValueError) as ve:
+        return jsonify({"error": f"Invalid coordinate format: {ve}"}), 400
+
+    if not sources or not destinations:
+        return jsonify({"error": "Missing 'sources' or 'destinations'"}), 400
+
+    max_cells = current_app.config["ROUTE_MATRIX_MAX_CELLS"]
+    if len(sources) * len(destinations) > max_cells:
+        return jsonify({"error": f"Matrix too large: at most {max_cells} cells are allowed"}), 400
+
+    try:
+        matrix = compute_matrix(sources, destinations, accessibility_params)
     except Exception as e:
-        print(f"Routing Error: {e}") # Log the specific error on the server
-        # Return a generic error to the client
-        return jsonify({"error": f"Failed to calculate route. {str(e)}"}), 500
+        logger.error("Route matrix error", extra={"error": str(e)})
+        return jsonify({"error": f"Failed to calculate route matrix. {str(e)}"}), 500
 
+    with metrics.span("serialize"):
+        return jsonify(matrix)
+
+# GET route cache counters (for sizing ROUTE_CACHE_MAX_ENTRIES / TTL)
+@main.route("/api/route_cache/stats", methods=["GET"])
+def get_route_cache_stats():
+    return jsonify(route_cache.stats())
+
+
+#-------------------------------------------------------------------------
+# Metrics Methods
+#-------------------------------------------------------------------------
 
+# GET request/DB/span histograms in Prometheus text format
+@main.route("/metrics", methods=["GET"])
+def get_metrics():
+    stats = route_cache.stats()
+    extra = [
+        (f"mobinav_route_cache_{name}_total", "counter", f"Route cache {name}.", stats[name])
+        for name in ("hits", "misses", "evictions", "expirations", "invalidations")
+    ]
+    extra.append(("mobinav_route_cache_entries", "gauge", "Routes currently cached.", stats["entries"]))
+    table_stats = route_table.stats()
+    extra.extend([
+        ("mobinav_route_table_lookups_total", "counter", "Route table lookups.", table_stats["lookups"]),
+        ("mobinav_route_table_hits_total", "counter", "Routes answered from the route table.", table_stats["hits"]),
+        ("mobinav_route_table_repairs_total", "counter", "Route table rebuilds and repairs.", table_stats["repairs"]),
+        ("mobinav_route_table_columns_recomputed_total", "counter",
+         "Target columns recomputed by route table repairs.", table_stats["columns_recomputed"]),
+    ])
+    tile_stats = tile_cache.stats()
+    extra.extend([
+        ("mobinav_tile_cache_hits_total", "counter", "Vector tiles served from the tile cache.", tile_stats["hits"]),
+        ("mobinav_tile_cache_misses_total", "counter", "Vector tiles rendered.", tile_stats["misses"]),
+        ("mobinav_tile_cache_invalidated_total", "counter",
+         "Cached vector tiles deleted by row changes.", tile_stats["invalidated"]),
+    ])
+    feed_stats = obstacle_feed.stats()
+    extra.extend([
+        ("mobinav_obstacle_stream_subscribers", "gauge", "Open obstacle stream connections.", feed_stats["subscribers"]),
+        ("mobinav_obstacle_stream_events_total", "counter", "Obstacle stream events published.", feed_stats["published"]),
+    ])
+    report_stats = obstacle_ingest.stats()
+    extra.extend([
+        ("mobinav_obstacle_reports_total", "counter", "Obstacle reports received.", report_stats["reports"]),
+        ("mobinav_obstacle_reports_merged_total", "counter",
+         "Obstacle reports merged into an existing obstacle.", report_stats["merged"]),
+        ("mobinav_obstacle_report_flushes_total", "counter",
+         "Group commits of obstacle reports.", report_stats["flushes"]),
+    ])
+    ch_stats = contraction.stats()
+    extra.extend([
+        ("mobinav_ch_queries_total", "counter", "Contraction hierarchy queries.", ch_stats["queries"]),
+        ("mobinav_ch_settled_fraction", "gauge",
+         "Average share of graph nodes a contraction hierarchy query settles.", ch_stats["settled_fraction"]),
+    ])
+    snapshot_stats = graph_snapshot.stats()
+    extra.extend([
+        ("mobinav_graph_snapshot_loads_total", "counter",
+         "Routing graph snapshots mapped from another worker.", snapshot_stats["loads"]),
+        ("mobinav_graph_snapshot_writes_total", "counter",
+         "Routing graph snapshots built and published.", snapshot_stats["writes"]),
+    ])
+    return Response(metrics.render(extra), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,1084 @@
+"""
+In-process pedestrian routing over the campus Path graph.
+
+Building, Entrance and Path rows are loaded once into a compact CSR
+(compressed sparse row) adjacency structure made of flat typed arrays, and
+shortest-path queries are answered with A* using a haversine heuristic.
+This lets /api/get_route answer without a round trip to OSRM.
+
+Indoor floor plans (IndoorFeature rows) add rooms, corridor vertices and
+the per-floor stops of elevators, stairs and ramps as further nodes. Each
+entrance is linked to the floor given by its floor_level, so a route can
+run from an outdoor point to a specific room.
+"""
+import hashlib
+import heapq
+import math
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+import numpy as np
+
+from app import db
+from app.graph_snapshot import graph_snapshot
+from app.models import Building, Entrance, IndoorFeature, Path
+
+EARTH_RADIUS_M = 6371008.8
+INF = float("inf")
+
+# --- Node kinds ---
+# Buildings and entrances always come first in the node arrays and are the
+# only snapping targets; indoor nodes are reached through entrances.
+NODE_BUILDING = 0
+NODE_ENTRANCE = 1
+NODE_ROOM = 2    # node_ref is the IndoorFeature id
+NODE_INDOOR = 3  # corridor vertex or one floor's stop of an elevator/stairs/ramp
+NO_LEVEL = -32768  # node_level of outdoor nodes
+
+# --- Edge flag bits (derived from the Path / Entrance columns) ---
+FLAG_STAIRS = 1          # Path.has_stairs
+FLAG_INCLINE = 2         # Path.had_incline
+FLAG_UNPAVED = 4         # not Path.is_paved
+FLAG_NOT_ACCESSIBLE = 8  # not Path.is_wheelchair_accessible / Entrance.wheelchair_accessible
+
+# --- Grades (Path.max_grade, from app/elevation.py) ---
+# A path steeper than this (ADA: a ramp) is an incline whatever had_incline says
+INCLINE_GRADE_PCT = 5.0
+# Weights kept per profile for distinct maxIncline limits
+GRADED_WEIGHTS_KEPT = 8
+
+# --- Indoor vertical connectors ---
+# Walking length charged per floor climbed, and the flags of the climb
+VERTICAL_LENGTH_M = {"elevator": 10.0, "stairs": 8.0, "ramp": 48.0}
+VERTICAL_FLAGS = {"elevator": 0, "stairs": FLAG_STAIRS, "ramp": FLAG_INCLINE}
+
+# --- Routing profiles ---
+# Profile names match the OSRM profiles used by get_osrm_route so both
+# engines are selected the same way from the accessibility params.
+# 'forbidden' edges are never traversed; 'penalties' multiply the edge length.
+PROFILES = {
+    "foot": {
+        "forbidden": 0,
+        "penalties": {},
+    },
+    "foot-accessible": {
+        "forbidden": FLAG_STAIRS | FLAG_NOT_ACCESSIBLE,
+        "penalties": {FLAG_INCLINE: 1.5, FLAG_UNPAVED: 1.25},
+    },
+}
+
+# --- Route features reported with alternatives ---
+FEATURE_FLAGS = {"stairs_m": FLAG_STAIRS, "incline_m": FLAG_INCLINE, "unpaved_m": FLAG_UNPAVED}
+# Extra score per meter of each feature when ranking alternatives; the same
+# for every profile so routes found by either engine compare alike
+FEATURE_SCORES = {"stairs_m": 2.0, "incline_m": 0.5, "unpaved_m": 0.25}
+
+# --- Graph snapshot (app/graph_snapshot.py) ---
+# Bump whenever the arrays in a snapshot change meaning
+SNAPSHOT_FORMAT = 1
+# CampusGraph arrays a snapshot stores as they are
+SNAPSHOT_ARRAYS = ("node_lat", "node_lng", "node_kind", "node_ref", "node_flags", "node_level",
+                   "node_building", "offsets", "targets", "lengths", "flags", "path_ids", "grades")
+
+
+class NoRouteError(Exception):
+    """Raised when the local graph cannot answer a route query."""
+
+
+class RouteClosedError(NoRouteError):
+    """Raised when a route exists but closures or opening hours block it at that time."""
+
+
+class _Labels:
+    """node_label of a snapshot graph: one UTF-8 blob cut at offsets, decoded on access."""
+
+    def __init__(self, blob, offsets):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, node):
+        return str(self._blob[self._offsets[node]:self._offsets[node + 1]], "utf-8")
+
+
+class _NodeIndex:
+    """node_index of a snapshot graph: (kind, ref) -> node by bisecting sorted packed keys."""
+
+    def __init__(self, keys, nodes):
+        self._keys = keys
+        self._nodes = nodes
+
+    def get(self, key, default=None):
+        packed = _index_key(*key)
+        i = bisect_left(self._keys, packed)
+        if i < len(self._keys) and self._keys[i] == packed:
+            return self._nodes[i]
+        return default
+
+
+def _index_key(kind, ref):
+    return (int(kind) << 56) | int(ref)
+
+
+def _profiles_key():
+    """The routing profiles as a string, so a snapshot with other weights is not reused."""
+    return repr(sorted((name, spec["forbidden"], sorted(spec["penalties"].items()))
+                       for name, spec in PROFILES.items()))
+
+
+def _anchor(geometry):
+    """(lat, lng) a point-like indoor feature is routed to: the point, ring centroid or middle vertex."""
+    kind = geometry.get("type")
+    coords = geometry.get("coordinates")
+    if not coords:
+        return None
+    if kind == "MultiPolygon":
+        kind, coords = "Polygon", coords[0]
+    if kind == "Polygon":
+        ring = coords[0][:-1] if len(coords[0]) > 1 and coords[0][0] == coords[0][-1] else coords[0]
+        if not ring:
+            return None
+        return (sum(p[1] for p in ring) / len(ring), sum(p[0] for p in ring) / len(ring))
+    if kind == "LineString":
+        coords = coords[len(coords) // 2]
+    elif kind != "Point":
+        return None
+    return float(coords[1]), float(coords[0])
+
+
+def _lines(geometry):
+    """Vertex lists ([lng, lat] pairs) of a corridor's LineString or MultiLineString."""
+    kind = geometry.get("type")
+    if kind == "LineString":
+        return [geometry.get("coordinates") or []]
+    if kind == "MultiLineString":
+        return geometry.get("coordinates") or []
+    return []
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """Great-circle distance in meters between two lat/lng points."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def profile_for(accessibility_params):
+    """Pick the routing profile for the parsed accessibility params."""
+    return "foot-accessible" if accessibility_params.get("avoidStairs", False) else "foot"
+
+
+def max_grade_for(accessibility_params):
+    """The steepest grade (percent) a route may have, or None for no limit."""
+    return accessibility_params.get("maxIncline")
+
+
+def max_penalty(profile):
+    """Largest factor by which a profile can inflate an edge's length."""
+    factor = 1.0
+    for penalty in PROFILES[profile]["penalties"].values():
+        factor *= penalty
+    return factor
+
+
+def edge_weight(length, flags, profile):
+    """Cost of traversing an edge under a profile (INF when forbidden)."""
+    spec = PROFILES[profile]
+    if flags & spec["forbidden"]:
+        return INF
+    weight = length
+    for flag, factor in spec["penalties"].items():
+        if flags & flag:
+            weight *= factor
+    return weight
+
+
+class CampusGraph:
+    """
+    Immutable CSR adjacency over buildings and entrances.
+
+    Node i has coordinates (node_lat[i], node_lng[i]); its outgoing edges are
+    the half-open range offsets[i]:offsets[i + 1] of the edge arrays.
+    Every Path is stored in both directions since walkways are two-way.
+    grades[e] is the path's steepest grade in percent, NaN where unknown.
+    """
+
+    def __init__(self, node_lat, node_lng, node_kind, node_ref, node_flags, node_label, node_level,
+                 node_building, offsets, targets, lengths, flags, path_ids, grades,
+                 node_index=None, outdoor_count=None, heuristic_scale=None, weights=None):
+        self.node_lat = node_lat
+        self.node_lng = node_lng
+        self.node_kind = node_kind
+        self.node_ref = node_ref
+        self.node_flags = node_flags
+        self.node_label = node_label
+        self.node_level = node_level
+        self.node_building = node_building
+        self.offsets = offsets
+        self.targets = targets
+        self.lengths = lengths
+        self.flags = flags
+        self.path_ids = path_ids
+        self.grades = grades
+        if node_index is None:
+            node_index = {(node_kind[i], node_ref[i]): i for i in range(len(node_ref))}
+        self.node_index = node_index
+        if outdoor_count is None:
+            outdoor_count = sum(1 for kind in node_kind if kind in (NODE_BUILDING, NODE_ENTRANCE))
+        self.outdoor_count = outdoor_count
+        self._weights = dict(weights or {})
+        self._graded_weights = OrderedDict()
+        self._weights_lock = threading.Lock()
+        if heuristic_scale is None:
+            heuristic_scale = self._compute_heuristic_scale()
+        self.heuristic_scale = heuristic_scale
+        # Campus version the graph was loaded at and the snapshot file it lives in, if any
+        self.version = None
+        self.snapshot_identity = None
+
+    @property
+    def node_count(self):
+        return len(self.node_ref)
+
+    @property
+    def edge_count(self):
+        return len(self.targets)
+
+    @classmethod
+    def from_rows(cls, buildings, entrances, paths, indoor=()):
+        """
+        Build the graph from plain row tuples.
+        buildings: (building_id, name, latitude, longitude)
+        entrances: (entrance_id, building_id, entrance_name, latitude, longitude,
+                    wheelchair_accessible, floor_level)
+        paths: (path_id, start_location_id, end_location_id, distance,
+                has_stairs, had_incline, is_paved, is_wheelchair_accessible, max_grade)
+        indoor: (feature_id, building_id, level, category, name, ref, geometry,
+                 wheelchair_accessible)
+        """
+        node_lat = array("d")
+        node_lng = array("d")
+        node_kind = array("b")
+        node_ref = array("q")
+        node_flags = array("B")
+        node_level = array("h")
+        node_building = array("i")  # building node each node belongs to
+        node_label = []
+        building_node = {}
+
+        def add_node(lat, lng, kind, ref, flag, label, building, level=NO_LEVEL):
+            node = len(node_ref)
+            node_lat.append(float(lat))
+            node_lng.append(float(lng))
+            node_kind.append(kind)
+            node_ref.append(ref)
+            node_flags.append(flag)
+            node_level.append(level)
+            node_building.append(node if building is None else building)
+            node_label.append(label)
+            return node
+
+        for building_id, name, lat, lng in buildings:
+            if lat is None or lng is None:
+                continue
+            building_node[building_id] = add_node(lat, lng, NODE_BUILDING, building_id, 0,
+                                                  name or f"Building {building_id}", None)
+
+        # Collect edges as (source, target, length, flags, path_id, grade) before packing
+        edges = []
+
+        def link(u, v, flag, length=None):
+            if length is None:
+                length = haversine_m(node_lat[u], node_lng[u], node_lat[v], node_lng[v])
+            edges.append((u, v, length, flag, 0, math.nan))
+            edges.append((v, u, length, flag, 0, math.nan))
+
+        # (building_id, level) -> [(entrance node, flags)] for linking indoor floors
+        entrance_floors = {}
+        for entrance_id, building_id, name, lat, lng, accessible, floor_level in entrances:
+            if lat is None or lng is None or building_id not in building_node:
+                continue
+            flag = 0 if accessible else FLAG_NOT_ACCESSIBLE
+            b = building_node[building_id]
+            node = add_node(lat, lng, NODE_ENTRANCE, entrance_id, flag, name or f"Entrance {entrance_id}", b)
+            # Short connector between the entrance and its building
+            link(node, b, flag)
+            if floor_level is not None:
+                entrance_floors.setdefault((building_id, floor_level), []).append((node, flag))
+
+        for (path_id, start_id, end_id, distance,
+             has_stairs, had_incline, is_paved, accessible, max_grade) in paths:
+            u = building_node.get(start_id)
+            v = building_node.get(end_id)
+            if u is None or v is None or u == v:
+                continue
+            if distance is not None:
+                length = float(distance)
+            else:
+                length = haversine_m(node_lat[u], node_lng[u], node_lat[v], node_lng[v])
+            flag = 0
+            if has_stairs:
+                flag |= FLAG_STAIRS
+            if had_incline or (max_grade is not None and max_grade > INCLINE_GRADE_PCT):
+                flag |= FLAG_INCLINE
+            if is_paved is False:
+                flag |= FLAG_UNPAVED
+            if accessible is False:
+                flag |= FLAG_NOT_ACCESSIBLE
+            grade = math.nan if max_grade is None else float(max_grade)
+            edges.append((u, v, length, flag, path_id, grade))
+            edges.append((v, u, length, flag, path_id, grade))
+
+        # --- Indoor floors ---
+        floors = {}   # (building_id, level) -> {"corridor": [node], "stop": [(node, flags)], "room": [...]}
+        vertex_at = {}  # corridor vertices shared by several corridors become one node
+        climbs = {}   # (building_id, category, ref) -> [(level, node, flags)]
+        for (feature_id, building_id, level, category, name, ref, geometry,
+             accessible) in indoor:
+            if building_id not in building_node or level is None or not geometry:
+                continue
+            category = (category or "").lower()
+            b = building_node[building_id]
+            flag = FLAG_NOT_ACCESSIBLE if accessible is False else 0
+            floor = floors.setdefault((building_id, level), {"corridor": [], "stop": [], "room": []})
+            if category == "corridor":
+                for line in _lines(geometry):
+                    previous = None
+                    for lng, lat in line:
+                        key = (building_id, level, round(lat, 7), round(lng, 7))
+                        node = vertex_at.get(key)
+                        if node is None:
+                            node = vertex_at[key] = add_node(lat, lng, NODE_INDOOR, len(node_ref), 0,
+                                                             name or "Corridor", b, level)
+                            floor["corridor"].append(node)
+                        if previous is not None and previous != node:
+                            link(previous, node, flag)
+                        previous = node
+                continue
+            anchor = _anchor(geometry)
+            if anchor is None:
+                continue
+            if category == "room":
+                label = name or (f"Room {ref}" if ref else f"Room {feature_id}")
+                floor["room"].append((add_node(*anchor, NODE_ROOM, feature_id, flag, label, b, level), flag))
+            elif category in VERTICAL_LENGTH_M:
+                label = name or f"{category.capitalize()} {ref or feature_id}"
+                node = add_node(*anchor, NODE_INDOOR, len(node_ref), flag, label, b, level)
+                floor["stop"].append((node, flag))
+                if ref:
+                    climbs.setdefault((building_id, category, ref), []).append((level, node, flag))
+
+        for key, floor in floors.items():
+            stops = floor["stop"] + entrance_floors.get(key, [])
+            corridor = floor["corridor"]
+            if corridor:
+                # Rooms, lifts, stairs and entrances join the closest corridor vertex
+                for node, flag in stops + floor["room"]:
+                    kx = math.cos(math.radians(node_lat[node]))
+                    nearest = min(corridor, key=lambda c: (node_lat[c] - node_lat[node]) ** 2
+                                  + ((node_lng[c] - node_lng[node]) * kx) ** 2)
+                    link(node, nearest, flag)
+            else:
+                # Open-plan floor: every stop reaches every other one and every room directly
+                for i, (u, u_flag) in enumerate(stops):
+                    for v, v_flag in stops[i + 1:]:
+                        link(u, v, u_flag | v_flag)
+                for room, room_flag in floor["room"]:
+                    for stop, stop_flag in stops:
+                        link(room, stop, room_flag | stop_flag)
+
+        for (building_id, category, ref), stops in climbs.items():
+            stops.sort()
+            for (low, u, u_flag), (high, v, v_flag) in zip(stops, stops[1:]):
+                if low == high:
+                    continue
+                straight = haversine_m(node_lat[u], node_lng[u], node_lat[v], node_lng[v])
+                length = max(straight, VERTICAL_LENGTH_M[category] * (high - low))
+                link(u, v, VERTICAL_FLAGS[category] | u_flag | v_flag, length)
+
+        # --- Pack into CSR arrays ---
+        edges.sort(key=lambda e: e[0])
+        n = len(node_ref)
+        offsets = array("i", [0] * (n + 1))
+        targets = array("i")
+        lengths = array("d")
+        flags = array("B")
+        path_ids = array("q")
+        grades = array("d")
+        for source, target, length, flag, path_id, grade in edges:
+            offsets[source + 1] += 1
+            targets.append(target)
+            lengths.append(length)
+            flags.append(flag)
+            path_ids.append(path_id)
+            grades.append(grade)
+        for i in range(n):
+            offsets[i + 1] += offsets[i]
+
+        return cls(node_lat, node_lng, node_kind, node_ref, node_flags, node_label, node_level,
+                   node_building, offsets, targets, lengths, flags, path_ids, grades)
+
+    def arrays(self):
+        """(meta, {name: ndarray}) to write this graph as a snapshot (see from_arrays)."""
+        arrays = {name: np.asarray(memoryview(getattr(self, name))) for name in SNAPSHOT_ARRAYS}
+        profiles = list(PROFILES)
+        arrays["weights"] = np.array([memoryview(self.weights(profile)) for profile in profiles],
+                                     dtype=np.float64).reshape(len(profiles), self.edge_count)
+        labels = [label.encode() for label in self.node_label]
+        arrays["label_blob"] = np.frombuffer(b"".join(labels), dtype=np.uint8)
+        arrays["label_offsets"] = np.cumsum([0] + [len(label) for label in labels], dtype=np.int64)
+        keys = np.array([_index_key(kind, ref) for kind, ref in zip(self.node_kind, self.node_ref)],
+                        dtype=np.int64)
+        order = np.argsort(keys, kind="stable")
+        arrays["index_keys"] = keys[order]
+        arrays["index_nodes"] = order.astype(np.int32)
+        meta = {
+            "format": SNAPSHOT_FORMAT,
+            "version": self.version,
+            "profiles": profiles,
+            "profiles_key": _profiles_key(),
+            "outdoor_count": self.outdoor_count,
+            "heuristic_scale": self.heuristic_scale,
+        }
+        return meta, arrays
+
+    @classmethod
+    def from_arrays(cls, mapped):
+        """
+        Graph over the arrays of a snapshot (a MappedArrays), without copying
+        them: memoryviews index as fast as array.array, unlike numpy scalars.
+        """
+        meta = mapped.meta
+        graph = cls(
+            **{name: memoryview(getattr(mapped, name)) for name in SNAPSHOT_ARRAYS},
+            node_label=_Labels(memoryview(mapped.label_blob), memoryview(mapped.label_offsets)),
+            node_index=_NodeIndex(memoryview(mapped.index_keys), memoryview(mapped.index_nodes)),
+            outdoor_count=meta["outdoor_count"],
+            heuristic_scale=meta["heuristic_scale"],
+            weights={profile: memoryview(mapped.weights[p]) for p, profile in enumerate(meta["profiles"])},
+        )
+        graph.version = meta["version"]
+        graph.snapshot_identity = mapped.identity
+        return graph
+
+    def _compute_heuristic_scale(self):
+        # A* stays admissible only if the heuristic never overestimates, and
+        # Path.distance is hand-entered, so scale the haversine estimate down
+        # to the smallest length/straight-line ratio seen on any edge.
+        scale = 1.0
+        lat, lng = self.node_lat, self.node_lng
+        for u in range(self.node_count):
+            for e in range(self.offsets[u], self.offsets[u + 1]):
+                v = self.targets[e]
+                straight = haversine_m(lat[u], lng[u], lat[v], lng[v])
+                if straight > 0:
+                    scale = min(scale, self.lengths[e] / straight)
+        return max(scale, 0.0)
+
+    def weights(self, profile, max_grade=None):
+        """
+        Per-edge costs for a profile, computed once and reused. With
+        max_grade (percent), edges steeper than it are forbidden too; the
+        last few limits asked for are kept.
+        """
+        weights = self._weights.get(profile)
+        if weights is None:
+            with self._weights_lock:
+                weights = self._weights.get(profile)
+                if weights is None:
+                    weights = array("d", (edge_weight(self.lengths[e], self.flags[e], profile)
+                                          for e in range(self.edge_count)))
+                    self._weights[profile] = weights
+        if max_grade is None:
+            return weights
+
+        key = (profile, max_grade)
+        with self._weights_lock:
+            graded = self._graded_weights.get(key)
+            if graded is not None:
+                self._graded_weights.move_to_end(key)
+                return graded
+        # NaN (unknown grade) never compares greater, so those edges stay usable
+        graded = array("d", (INF if grade > max_grade else w for w, grade in zip(weights, self.grades)))
+        with self._weights_lock:
+            self._graded_weights[key] = graded
+            while len(self._graded_weights) > GRADED_WEIGHTS_KEPT:
+                self._graded_weights.popitem(last=False)
+        return graded
+
+    def steepest(self, edges):
+        """Steepest known grade (percent) along edges, or None if none is known."""
+        grades = [self.grades[e] for e in edges if not math.isnan(self.grades[e])]
+        return max(grades) if grades else None
+
+    def nearest_node(self, lat, lng, profile="foot", kind=None, exclude=()):
+        """
+        Index and distance (m) of the closest building or entrance usable
+        under a profile, optionally restricted to one node kind and skipping
+        the nodes in exclude.
+        """
+        forbidden = PROFILES[profile]["forbidden"]
+        # Equirectangular distance is plenty to rank candidates on a campus
+        kx = math.cos(math.radians(lat))
+        best, best_d2 = -1, INF
+        node_lat, node_lng, node_flags = self.node_lat, self.node_lng, self.node_flags
+        node_kind = self.node_kind
+        for i in range(self.outdoor_count):
+            if node_flags[i] & forbidden:
+                continue
+            if kind is not None and node_kind[i] != kind:
+                continue
+            if exclude and i in exclude:
+                continue
+            dy = node_lat[i] - lat
+            dx = (node_lng[i] - lng) * kx
+            d2 = dx * dx + dy * dy
+            if d2 < best_d2:
+                best, best_d2 = i, d2
+        if best < 0:
+            return -1, INF
+        return best, haversine_m(lat, lng, node_lat[best], node_lng[best])
+
+    def room_node(self, feature_id):
+        """Node of an indoor room, or -1 if the room is not in the graph."""
+        return self.node_index.get((NODE_ROOM, feature_id), -1)
+
+    def _indoor_scope(self, endpoints):
+        """
+        Buildings whose indoor nodes a search between endpoints may enter.
+        Another building's floors only connect to its own entrances, and every
+        entrance's connector to the building is no longer than any way through
+        its floors, so only the endpoints' own buildings can matter.
+        """
+        return {self.node_building[node] for node in endpoints}
+
+    def shortest_path(self, source, target, profile="foot", blocked=None, weights=None, departure=None,
+                      max_grade=None):
+        """
+        A* from source to target, never using edge indices in blocked.
+        weights: per-edge costs to use instead of the profile's (never lower
+            than them, or the heuristic stops being admissible)
+        max_grade: skip edges steeper than this many percent (unless weights
+            are given, which must already leave them out)
+        departure: schedule.Departure; edges with a time window are skipped
+            when they are closed at the moment the walk along the current
+            path reaches them
+        Returns (cost, nodes, edges) or None when target is unreachable.
+        """
+        if weights is None:
+            weights = self.weights(profile, max_grade)
+        blocked = blocked or ()
+        outdoor, node_building = self.outdoor_count, self.node_building
+        scope = self._indoor_scope((source, target))
+        offsets, targets = self.offsets, self.targets
+        node_lat, node_lng = self.node_lat, self.node_lng
+        tlat, tlng = node_lat[target], node_lng[target]
+        scale = self.heuristic_scale
+        timed = departure.edges if departure is not None else {}
+        lengths = self.lengths
+
+        best = {source: 0.0}
+        walked = {source: 0.0}
+        came_from = {}
+        closed = set()
+        heap = [(scale * haversine_m(node_lat[source], node_lng[source], tlat, tlng), 0.0, source)]
+        while heap:
+            _, g, u = heapq.heappop(heap)
+            if u == target:
+                break
+            if u in closed:
+                continue
+            closed.add(u)
+            for e in range(offsets[u], offsets[u + 1]):
+                w = weights[e]
+                if w == INF or e in blocked:
+                    continue
+                if e in timed and departure.closed(e, walked[u]):
+                    continue
+                v = targets[e]
+                if v >= outdoor and node_building[v] not in scope:
+                    continue
+                ng = g + w
+                if ng < best.get(v, INF):
+                    best[v] = ng
+                    walked[v] = walked[u] + lengths[e]
+                    came_from[v] = (u, e)
+                    h = scale * haversine_m(node_lat[v], node_lng[v], tlat, tlng)
+                    heapq.heappush(heap, (ng + h, ng, v))
+        else:
+            return None
+
+        nodes = [target]
+        edges = []
+        while nodes[-1] != source:
+            u, e = came_from[nodes[-1]]
+            nodes.append(u)
+            edges.append(e)
+        nodes.reverse()
+        edges.reverse()
+        return best[target], nodes, edges
+
+    def alternative_paths(self, source, target, k, profile="foot", blocked=None,
+                          penalty=1.4, max_overlap=0.6, max_stretch=1.5, departure=None, max_grade=None):
+        """
+        Up to k diverse paths by the penalty method, in one search session:
+        after every A* run the edges of the path it found cost penalty times
+        more in a private copy of the weights, so the next run drifts away
+        from the routes already seen. A path is kept when its real cost is
+        within max_stretch of the shortest one and at most max_overlap of its
+        length is shared with any path kept before it.
+        departure, max_grade: as for shortest_path
+        Returns [(cost, nodes, edges), ...], shortest first.
+        """
+        base = self.weights(profile, max_grade)
+        found = self.shortest_path(source, target, profile, blocked, base, departure)
+        if found is None:
+            return []
+        kept = [found]
+        limit = found[0] * max_stretch
+        lengths = self.lengths
+        kept_edges = [set(found[2])]
+        weights = array("d", base)
+        last = found[2]
+        # Every round either keeps a path or pushes the search off a rejected one
+        for _ in range(3 * k):
+            if len(kept) >= k or not last:
+                break
+            for e in last:
+                weights[e] *= penalty
+            result = self.shortest_path(source, target, profile, blocked, weights, departure)
+            if result is None:
+                break
+            _, nodes, edges = result
+            last = edges
+            cost = sum(base[e] for e in edges)
+            if cost > limit:
+                continue
+            length = sum(lengths[e] for e in edges)
+            if length <= 0 or any(sum(lengths[e] for e in edges if e in seen) > max_overlap * length
+                                  for seen in kept_edges):
+                continue
+            kept.append((cost, nodes, edges))
+            kept_edges.append(set(edges))
+        kept.sort(key=lambda path: path[0])
+        return kept
+
+    def edge_features(self, edges):
+        """Meters of stairs, incline and unpaved surface along edges, and the steepest grade."""
+        flags, lengths = self.flags, self.lengths
+        features = {name: sum(lengths[e] for e in edges if flags[e] & flag)
+                    for name, flag in FEATURE_FLAGS.items()}
+        features["max_grade"] = self.steepest(edges)
+        return features
+
+    def distances_from(self, source, targets, profile="foot", max_grade=None):
+        """
+        Multi-target Dijkstra: one search from source that stops once every
+        node in targets is settled, skipping edges steeper than max_grade
+        (percent) when it is given.
+        Returns {target: walked length in meters} for the reachable targets;
+        the search minimises the profile cost but reports plain length.
+        """
+        weights = self.weights(profile, max_grade)
+        offsets, edge_targets, lengths = self.offsets, self.targets, self.lengths
+        outdoor, node_building = self.outdoor_count, self.node_building
+        scope = self._indoor_scope([source, *targets])
+        remaining = set(targets)
+        best = {source: 0.0}
+        walked = {source: 0.0}
+        found = {}
+        heap = [(0.0, source)]
+        while heap and remaining:
+            g, u = heapq.heappop(heap)
+            if u in found or g > best[u]:
+                continue
+            found[u] = walked[u]
+            remaining.discard(u)
+            for e in range(offsets[u], offsets[u + 1]):
+                w = weights[e]
+                if w == INF:
+                    continue
+                v = edge_targets[e]
+                if v >= outdoor and node_building[v] not in scope:
+                    continue
+                ng = g + w
+                if ng < best.get(v, INF):
+                    best[v] = ng
+                    walked[v] = walked[u] + lengths[e]
+                    heapq.heappush(heap, (ng, v))
+        return {t: found[t] for t in targets if t in found}
+
+    def build_route(self, start_coords, end_coords, nodes, edges, walking_speed):
+        """Format a node sequence like get_osrm_route's response."""
+        node_level = self.node_level
+        geometry = [{"lat": start_coords[0], "lng": start_coords[1]}]
+        for i in nodes:
+            point = {"lat": self.node_lat[i], "lng": self.node_lng[i]}
+            # Indoor points carry their floor so clients can draw them on the right plan
+            if node_level[i] != NO_LEVEL:
+                point["level"] = node_level[i]
+            geometry.append(point)
+        geometry.append({"lat": end_coords[0], "lng": end_coords[1]})
+
+        # Legs: start -> first node, each graph edge, last node -> end
+        legs = [("depart", haversine_m(start_coords[0], start_coords[1],
+                                       self.node_lat[nodes[0]], self.node_lng[nodes[0]]), nodes[0])]
+        for e, u, v in zip(edges, nodes, nodes[1:]):
+            changes_floor = node_level[u] != node_level[v] and NO_LEVEL not in (node_level[u], node_level[v])
+            legs.append(("floor" if changes_floor else "continue", self.lengths[e], v))
+        legs.append(("arrive", haversine_m(self.node_lat[nodes[-1]], self.node_lng[nodes[-1]],
+                                           end_coords[0], end_coords[1]), nodes[-1]))
+
+        instructions = []
+        total = 0.0
+        for maneuver, length, node in legs:
+            total += length
+            label = self.node_label[node]
+            if maneuver == "depart":
+                text = f"Head towards {label}"
+            elif maneuver == "arrive":
+                text = f"Arrive at your destination near {label}"
+            elif maneuver == "floor":
+                text = f"Take {label} to level {node_level[node]}"
+            else:
+                text = f"Continue to {label}"
+            instructions.append({
+                "maneuver": maneuver,
+                "instruction": text,
+                "distance": length,
+                "duration": length / walking_speed,
+                "name": label,
+            })
+
+        summary = {
+            "distance": total,
+            "duration": total / walking_speed,
+        }
+        steepest = self.steepest(edges)
+        if steepest is not None:
+            summary["max_grade"] = steepest
+        return {
+            "geometry": geometry,
+            "instructions": instructions,
+            "summary": summary,
+            "warnings": [],
+            "path_ids": sorted({self.path_ids[e] for e in edges if self.path_ids[e]}),
+        }
+
+
+#-------------------------------------------------------------------------
+# Graph lifecycle
+#-------------------------------------------------------------------------
+
+_graph = None
+_graph_version = 0
+_graph_checked = 0.0  # time.monotonic() of the last look for changes made elsewhere
+_graph_lock = threading.Lock()
+
+
+def campus_version():
+    """
+    Fingerprint of the campus tables the graph is built from: row counts and
+    the latest updated_at of each, read in one query.
+    """
+    columns = []
+    for model, key in ((Building, Building.building_id), (Entrance, Entrance.entrance_id),
+                       (Path, Path.path_id), (IndoorFeature, IndoorFeature.feature_id)):
+        columns.append(db.select(db.func.count(key)).scalar_subquery())
+        columns.append(db.select(db.func.max(model.updated_at)).scalar_subquery())
+    row = db.session.query(*columns).one()
+    return hashlib.sha1(repr(tuple(row)).encode()).hexdigest()
+
+
+def load_graph():
+    """Read the campus tables as plain column tuples and build a CampusGraph."""
+    buildings = db.session.query(
+        Building.building_id, Building.name, Building.latitude, Building.longitude
+    ).all()
+    entrances = db.session.query(
+        Entrance.entrance_id, Entrance.building_id, Entrance.entrance_name,
+        Entrance.latitude, Entrance.longitude, Entrance.wheelchair_accessible, Entrance.floor_level
+    ).all()
+    paths = db.session.query(
+        Path.path_id, Path.start_location_id, Path.end_location_id, Path.distance,
+        Path.has_stairs, Path.had_incline, Path.is_paved, Path.is_wheelchair_accessible, Path.max_grade
+    ).all()
+    # Only the features routing uses; walls, labels and the like stay out of the graph
+    indoor = db.session.query(
+        IndoorFeature.feature_id, IndoorFeature.building_id, IndoorFeature.level,
+        IndoorFeature.category, IndoorFeature.name, IndoorFeature.ref,
+        IndoorFeature.geometry, IndoorFeature.wheelchair_accessible
+    ).filter(
+        db.func.lower(IndoorFeature.category).in_(("room", "corridor") + tuple(VERTICAL_LENGTH_M))
+    ).order_by(IndoorFeature.feature_id).all()
+    return CampusGraph.from_rows(buildings, entrances, paths, indoor)
+
+
+def _usable(mapped, version=None):
+    """Whether a snapshot file was written in this format (and at version, if given)."""
+    meta = mapped.meta
+    return (meta.get("format") == SNAPSHOT_FORMAT and meta.get("profiles_key") == _profiles_key()
+            and (version is None or meta.get("version") == version))
+
+
+def _build():
+    """
+    The graph for the current campus version: mapped from the shared
+    snapshot when another worker already wrote it, else loaded from the
+    database and published as the new snapshot.
+    """
+    if not graph_snapshot.enabled:
+        return load_graph()
+    version = campus_version()
+    mapped = graph_snapshot.read()
+    if mapped is not None and _usable(mapped, version):
+        return CampusGraph.from_arrays(mapped)
+    graph = load_graph()
+    graph.version = version
+    mapped = graph_snapshot.write(*graph.arrays())
+    # Serve from the shared pages rather than this process's private copy
+    return CampusGraph.from_arrays(mapped) if mapped is not None else graph
+
+
+def _replacement(graph):
+    """
+    A graph to use instead of graph if the campus changed outside this
+    process (another worker published a snapshot, or the database moved on),
+    else None.
+    """
+    mapped = graph_snapshot.newer(graph.snapshot_identity)
+    # Also move onto the shared copy of a graph this process built but could not publish
+    if mapped is not None and _usable(mapped) and (mapped.meta["version"] != graph.version
+                                                   or graph.snapshot_identity is None):
+        return CampusGraph.from_arrays(mapped)
+    if campus_version() != graph.version:
+        return _build()
+    return None
+
+
+def get_graph():
+    """
+    Return the shared graph, building it on first use after an invalidation.
+    Every GRAPH_SNAPSHOT_CHECK_S it also picks up changes made by other
+    workers or the CLI.
+    """
+    global _graph, _graph_checked
+    graph = _graph
+    if graph is not None and not graph_snapshot.check_due(_graph_checked):
+        return graph
+    with _graph_lock:
+        graph = _graph
+        if graph is not None:
+            if not graph_snapshot.check_due(_graph_checked):
+                return graph
+            _graph_checked = time.monotonic()
+            version = _graph_version
+            replacement = _replacement(graph)
+            if replacement is None or version != _graph_version:
+                return graph
+            _graph = replacement
+        else:
+            version = _graph_version
+            graph = _build()
+            _graph_checked = time.monotonic()
+            # Don't publish a graph that was invalidated while it was loading
+            if version == _graph_version:
+                _graph = graph
+            return graph
+    # Caches derived from the old graph in this process are stale too
+    from app import hooks
+    hooks.graph_replaced()
+    return replacement
+
+
+def loaded_graph():
+    """The shared graph if one is loaded, without building one (None after an invalidation)."""
+    return _graph
+
+
+def invalidate_graph():
+    """Drop the shared graph so the next query reloads it from the database."""
+    global _graph, _graph_version
+    _graph_version += 1
+    _graph = None
+
+
+def _snap(graph, coords, profile, max_snap_m, exclude=()):
+    """Nearest usable node for a (lat, lng) point, or NoRouteError if off campus."""
+    node, distance = graph.nearest_node(coords[0], coords[1], profile, exclude=exclude)
+    if node < 0 or distance > max_snap_m:
+        raise NoRouteError(f"Point {coords[0]},{coords[1]} is outside the campus graph")
+    return node, distance
+
+
+def room_location(feature_id):
+    """(lat, lng) of an indoor room in the routing graph, or None if it has none."""
+    graph = get_graph()
+    node = graph.room_node(feature_id)
+    if node < 0:
+        return None
+    return graph.node_lat[node], graph.node_lng[node]
+
+
+def _endpoint(graph, coords, room, profile, max_snap_m, exclude=()):
+    if room is None:
+        return _snap(graph, coords, profile, max_snap_m, exclude)[0]
+    node = graph.room_node(room)
+    if node < 0:
+        raise NoRouteError(f"Room {room} is not in the campus graph")
+    return node
+
+
+def _endpoints(graph, start_coords, end_coords, start_room, end_room, profile, max_snap_m, timed):
+    """
+    Source and target nodes. With a departure, points are not snapped to
+    entrances that are locked when the walk starts (or, for the end, at the
+    earliest it could get there).
+    """
+    start_closed = end_closed = ()
+    if timed is not None and timed.schedule.doors:
+        start_closed = timed.closed_doors()
+        end_closed = timed.closed_doors(haversine_m(*start_coords, *end_coords))
+    source = _endpoint(graph, start_coords, start_room, profile, max_snap_m, start_closed)
+    target = _endpoint(graph, end_coords, end_room, profile, max_snap_m, end_closed)
+    return source, target
+
+
+def _no_route(graph, source, target, profile, blocked, timed, max_grade=None):
+    """
+    The error for a failed search: RouteClosedError if only the schedule is
+    in the way, and a pointed NoRouteError if only the grade limit is.
+    """
+    if (timed is not None and timed.skipped
+            and graph.shortest_path(source, target, profile, blocked, max_grade=max_grade) is not None):
+        return RouteClosedError("Every route is closed at that time")
+    if max_grade is not None and graph.shortest_path(source, target, profile, blocked) is not None:
+        return NoRouteError(f"Every route has a grade steeper than {max_grade:g}%")
+    return NoRouteError("No route found in the campus graph")
+
+
+def find_route(start_coords, end_coords, accessibility_params, walking_speed=1.4, max_snap_m=500.0,
+               blocked_edges=None, lookup=None, start_room=None, end_room=None, departure=None):
+    """
+    Route between two (lat, lng) points over the local Path graph.
+    Endpoints are snapped to the nearest building or entrance node; points
+    farther than max_snap_m from campus raise NoRouteError.
+    start_room / end_room: IndoorFeature ids of rooms to start or end at
+        instead of the snapped point
+    blocked_edges: optional callable graph -> set of edge indices to avoid
+    lookup: optional callable (source, target, profile) -> (nodes, edges,
+        ids of obstacles the route was diverted around) or None (precomputed
+        table, contraction hierarchy), tried before A* when nothing is
+        blocked; those ids are returned as "avoided_obstacles"
+    departure: optional callable graph -> schedule.Departure; closures and
+        opening hours are then checked when the walk reaches each edge, and
+        RouteClosedError is raised when only they stand in the way
+    accessibility_params["maxIncline"]: leave out paths steeper than that
+        many percent
+    """
+    graph = get_graph()
+    if graph.node_count == 0:
+        raise NoRouteError("Campus graph is empty")
+
+    profile = profile_for(accessibility_params)
+    max_grade = max_grade_for(accessibility_params)
+    timed = departure(graph) if departure is not None else None
+    source, target = _endpoints(graph, start_coords, end_coords, start_room, end_room, profile, max_snap_m, timed)
+
+    blocked = blocked_edges(graph) if blocked_edges is not None else None
+    found = lookup(source, target, profile) if lookup is not None and blocked is None else None
+    # Precomputed routes know nothing of the schedule or the grade limit
+    if found is not None and timed is not None and timed.edges and not timed.open_along(found[1]):
+        found = None
+    if found is not None and max_grade is not None and (graph.steepest(found[1]) or 0.0) > max_grade:
+        found = None
+    if found is None:
+        found = graph.shortest_path(source, target, profile, blocked, departure=timed, max_grade=max_grade)
+        if found is None:
+            raise _no_route(graph, source, target, profile, blocked, timed, max_grade)
+        _, nodes, edges = found
+        avoided = ()
+    else:
+        nodes, edges, avoided = found
+    route = graph.build_route(start_coords, end_coords, nodes, edges, walking_speed)
+    if avoided:
+        route["avoided_obstacles"] = list(avoided)
+    return route
+
+
+def find_routes(start_coords, end_coords, accessibility_params, k, walking_speed=1.4, max_snap_m=500.0,
+                blocked_edges=None, start_room=None, end_room=None, departure=None, **search):
+    """
+    find_route for up to k diverse routes from one search session
+    (CampusGraph.alternative_paths; search: penalty, max_overlap,
+    max_stretch). Each route carries "features", the meters of stairs,
+    incline and unpaved surface on it and its steepest grade. Cheapest
+    route first.
+    """
+    graph = get_graph()
+    if graph.node_count == 0:
+        raise NoRouteError("Campus graph is empty")
+
+    profile = profile_for(accessibility_params)
+    max_grade = max_grade_for(accessibility_params)
+    timed = departure(graph) if departure is not None else None
+    source, target = _endpoints(graph, start_coords, end_coords, start_room, end_room, profile, max_snap_m, timed)
+
+    blocked = blocked_edges(graph) if blocked_edges is not None else None
+    paths = graph.alternative_paths(source, target, k, profile, blocked, departure=timed, max_grade=max_grade,
+                                    **search)
+    if not paths:
+        raise _no_route(graph, source, target, profile, blocked, timed, max_grade)
+    routes = []
+    for _, nodes, edges in paths:
+        route = graph.build_route(start_coords, end_coords, nodes, edges, walking_speed)
+        route["features"] = graph.edge_features(edges)
+        routes.append(route)
+    return routes
+
+
+def find_matrix(sources, destinations, accessibility_params, walking_speed=1.4, max_snap_m=500.0):
+    """
+    Distance/duration matrix between lists of (lat, lng) points.
+    Runs one multi-target Dijkstra per distinct snapped source; unreachable
+    cells (including those only reachable over paths steeper than
+    accessibility_params["maxIncline"]) are None.
+    """
+    graph = get_graph()
+    if graph.node_count == 0:
+        raise NoRouteError("Campus graph is empty")
+
+    profile = profile_for(accessibility_params)
+    max_grade = max_grade_for(accessibility_params)
+    source_snaps = [_snap(graph, coords, profile, max_snap_m) for coords in sources]
+    dest_snaps = [_snap(graph, coords, profile, max_snap_m) for coords in destinations]
+    dest_nodes = {node for node, _ in dest_snaps}
+
+    searches = {}
+    distances = []
+    durations = []
+    for source, source_d in source_snaps:
+        if source not in searches:
+            searches[source] = graph.distances_from(source, dest_nodes, profile, max_grade)
+        reached = searches[source]
+        row_dist = []
+        row_dur = []
+        for target, target_d in dest_snaps:
+            if target in reached:
+                total = source_d + reached[target] + target_d
+                row_dist.append(total)
+                row_dur.append(total / walking_speed)
+            else:
+                row_dist.append(None)
+                row_dur.append(None)
+        distances.append(row_dist)
+        durations.append(row_dur)
+    return {"distances": distances, "durations": durations}
@@ -0,0 +1,373 @@
+"""
+Time windows for routing: scheduled closures, opening hours and
+construction windows.
+
+- A Closure row closes a Path or an Entrance from starts_at until ends_at
+  (either may be NULL: closed since forever / until further notice), e.g.
+  a walkway shut for a weekend.
+- Entrance.opening_hours is a weekly schedule,
+  {"mon": [["07:00", "22:00"]], "sat": [], ...}; outside it the door is
+  locked. Days left out are closed all day, NULL is always open, and an
+  interval ending before it starts runs past midnight.
+- Obstacle.starts_at / ends_at bound when a report (typically planned
+  construction) applies; obstacle_filter drops obstacles outside their
+  window.
+
+All times are naive campus local time (CAMPUS_TIMEZONE); aware datetimes
+are converted on the way in.
+
+EdgeSchedule turns closures and opening hours into merged, sorted closed
+intervals per edge of the routing graph, one-off ones in seconds since the
+epoch and weekly ones in seconds since Monday 00:00. Whether an edge can
+be used at time t is then a dict miss (most edges have no windows) or one
+bisect, so the A* search checks every edge at the moment the walk reaches
+it without scanning the closures. The union of all windows and every
+window boundary are indexed the same way, which gives "is anything closed
+during this walk" and the cache segment a departure time falls in.
+"""
+import threading
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from flask import current_app
+from sqlalchemy import or_
+
+from app import db, routing_engine
+from app.models import Closure, Entrance, Obstacle
+
+DAY_S = 86400
+WEEK_S = 7 * DAY_S
+DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+INF = float("inf")
+
+_EPOCH = datetime(1970, 1, 1)
+# 1970-01-01 was a Thursday
+_MONDAY_OFFSET_S = 3 * DAY_S
+
+
+#-------------------------------------------------------------------------
+# Times
+#-------------------------------------------------------------------------
+
+def now():
+    """Current campus local time (naive)."""
+    return datetime.now(ZoneInfo(current_app.config["CAMPUS_TIMEZONE"])).replace(tzinfo=None)
+
+
+def parse_time(value):
+    """Naive campus local datetime for an ISO 8601 string; ValueError if it isn't one."""
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(ZoneInfo(current_app.config["CAMPUS_TIMEZONE"])).replace(tzinfo=None)
+    return moment
+
+
+def timestamp(moment, default=None):
+    """Seconds since the epoch for a naive datetime (default for None)."""
+    if moment is None:
+        return default
+    return (moment - _EPOCH) / timedelta(seconds=1)
+
+
+def _clock(value):
+    """Seconds since midnight for "HH:MM" ("24:00" allowed)."""
+    hours, _, minutes = value.partition(":")
+    seconds = int(hours) * 3600 + int(minutes or 0) * 60
+    if not 0 <= seconds <= DAY_S or not 0 <= int(minutes or 0) < 60:
+        raise ValueError(f"Invalid time of day '{value}'")
+    return seconds
+
+
+def parse_opening_hours(value):
+    """
+    Validate an opening_hours object and return it, or None for "always
+    open"; raises ValueError on unknown days or malformed intervals.
+    """
+    if value is None:
+        return None
+    if not isinstance(value, dict):
+        raise ValueError("opening_hours must be an object keyed by day (mon..sun)")
+    for day, intervals in value.items():
+        if day not in DAYS:
+            raise ValueError(f"Unknown day '{day}' in opening_hours")
+        if not isinstance(intervals, list):
+            raise ValueError(f"opening_hours['{day}'] must be a list of [open, close] pairs")
+        for interval in intervals:
+            if not (isinstance(interval, list) and len(interval) == 2
+                    and all(isinstance(t, str) for t in interval)):
+                raise ValueError(f"opening_hours['{day}'] must be a list of [open, close] pairs")
+            _clock(interval[0]), _clock(interval[1])
+    return value
+
+
+def weekly_closed(opening_hours):
+    """Closed (start, end) intervals in seconds since Monday 00:00 for an opening_hours object."""
+    open_intervals = []
+    for index, day in enumerate(DAYS):
+        for opens, closes in opening_hours.get(day, ()):
+            start, end = index * DAY_S + _clock(opens), index * DAY_S + _clock(closes)
+            if end <= start:
+                end += DAY_S
+            if end > WEEK_S:
+                # Sunday night into Monday morning
+                open_intervals.append((0, end - WEEK_S))
+                end = WEEK_S
+            open_intervals.append((start, end))
+    closed = []
+    position = 0
+    for start, end in sorted(open_intervals):
+        if start > position:
+            closed.append((position, start))
+        position = max(position, end)
+    if position < WEEK_S:
+        closed.append((position, WEEK_S))
+    return closed
+
+
+#-------------------------------------------------------------------------
+# Interval index
+#-------------------------------------------------------------------------
+
+class Windows:
+    """Disjoint closed intervals [start, end), sorted, with bisect lookups."""
+
+    __slots__ = ("starts", "ends")
+
+    def __init__(self, intervals):
+        starts, ends = [], []
+        for start, end in sorted(intervals):
+            if end <= start:
+                continue
+            if ends and start <= ends[-1]:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        self.starts = starts
+        self.ends = ends
+
+    def __bool__(self):
+        return bool(self.starts)
+
+    def contains(self, t):
+        i = bisect_right(self.starts, t) - 1
+        return i >= 0 and t < self.ends[i]
+
+    def overlaps(self, t0, t1):
+        i = bisect_right(self.ends, t0)
+        return i < len(self.starts) and self.starts[i] < t1
+
+
+def _week_second(t):
+    return (t + _MONDAY_OFFSET_S) % WEEK_S
+
+
+class _Weekly:
+    """Windows repeating every week, in seconds since Monday 00:00."""
+
+    __slots__ = ("windows",)
+
+    def __init__(self, intervals):
+        self.windows = Windows(intervals)
+
+    def __bool__(self):
+        return bool(self.windows)
+
+    def contains(self, t):
+        return self.windows.contains(_week_second(t))
+
+    def overlaps(self, t0, t1):
+        if not self.windows or t1 <= t0:
+            return False
+        if t1 - t0 >= WEEK_S:
+            return True
+        a = _week_second(t0)
+        b = a + (t1 - t0)
+        if b <= WEEK_S:
+            return self.windows.overlaps(a, b)
+        return self.windows.overlaps(a, WEEK_S) or self.windows.overlaps(0, b - WEEK_S)
+
+
+class EdgeSchedule:
+    """
+    Closed windows per edge of one CampusGraph.
+    once: [(start, end)] in epoch seconds per edge; weekly: [(start, end)]
+    in seconds since Monday 00:00 per edge; doors: entrance node -> (once,
+    weekly) windows of the entrance itself; boundaries: further epoch
+    seconds at which routing can change (obstacle windows).
+    """
+
+    def __init__(self, graph, once, weekly, doors=None, boundaries=()):
+        self.graph = graph
+        edges = set(once) | set(weekly)
+        self.edges = {e: (Windows(once.get(e, ())), _Weekly(weekly.get(e, ()))) for e in edges}
+        self.once = Windows([w for intervals in once.values() for w in intervals])
+        self.weekly = _Weekly([w for intervals in weekly.values() for w in intervals])
+        self._bounds = sorted({t for intervals in once.values() for w in intervals for t in w
+                               if abs(t) != INF} | set(boundaries))
+        self._weekly_bounds = sorted({t for intervals in weekly.values() for w in intervals for t in w})
+        doors = doors or {}
+        self.doors = {node: (Windows(o), _Weekly(w)) for node, (o, w) in doors.items()}
+        self._door_once = Windows([window for o, _ in doors.values() for window in o])
+        self._door_weekly = _Weekly([window for _, w in doors.values() for window in w])
+
+    def __bool__(self):
+        return bool(self.edges) or bool(self._bounds)
+
+    def closed(self, e, t):
+        windows = self.edges.get(e)
+        return windows is not None and (windows[0].contains(t) or windows[1].contains(t))
+
+    def closed_between(self, t0, t1):
+        """Whether any edge is closed at some time in [t0, t1)."""
+        return self.once.overlaps(t0, t1) or self.weekly.overlaps(t0, t1)
+
+    def closed_doors(self, t):
+        """Entrance nodes that cannot be passed at time t."""
+        if not (self._door_once.contains(t) or self._door_weekly.contains(t)):
+            return set()
+        return {node for node, (once, weekly) in self.doors.items() if once.contains(t) or weekly.contains(t)}
+
+    def segment(self, t):
+        """Token naming the stretch of time around t in which no window opens or closes."""
+        week = 0
+        if self._weekly_bounds:
+            week = int((t + _MONDAY_OFFSET_S) // WEEK_S)
+        return (bisect_right(self._bounds, t), week, bisect_right(self._weekly_bounds, _week_second(t)))
+
+    def cache_key(self, t, horizon):
+        """
+        () when nothing is scheduled, the segment of t when no window opens
+        or closes within horizon seconds of it, or None: a route computed
+        now may not hold for another departure, so don't cache it.
+        """
+        if not self:
+            return ()
+        key = self.segment(t)
+        return key if self.segment(t + horizon) == key else None
+
+
+class Departure:
+    """Edge availability along a walk that starts at a given time."""
+
+    def __init__(self, schedule, t, walking_speed):
+        self.schedule = schedule
+        self.t = t
+        self.walking_speed = walking_speed
+        self.edges = schedule.edges
+        # Edges found closed so far: a failed search that never met one wasn't cut off by the schedule
+        self.skipped = 0
+
+    def closed(self, e, walked_m):
+        """Whether edge e is closed when the walk reaches it after walked_m meters."""
+        if self.schedule.closed(e, self.t + walked_m / self.walking_speed):
+            self.skipped += 1
+            return True
+        return False
+
+    def open_along(self, edges):
+        """Whether every edge of a path is open when the walk gets there."""
+        lengths = self.schedule.graph.lengths
+        walked = 0.0
+        for e in edges:
+            if e in self.edges and self.closed(e, walked):
+                return False
+            walked += lengths[e]
+        return True
+
+    def closed_doors(self, walked_m=0.0):
+        return self.schedule.closed_doors(self.t + walked_m / self.walking_speed)
+
+
+#-------------------------------------------------------------------------
+# Schedule lifecycle
+#-------------------------------------------------------------------------
+
+_schedule = None
+_schedule_version = 0
+_schedule_lock = threading.Lock()
+
+
+def _incident_edges(graph):
+    """Node -> every edge into or out of it."""
+    incident = {}
+    for u in range(graph.node_count):
+        for e in range(graph.offsets[u], graph.offsets[u + 1]):
+            incident.setdefault(u, []).append(e)
+            incident.setdefault(graph.targets[e], []).append(e)
+    return incident
+
+
+def load_schedule(graph, moment=None):
+    """Build the EdgeSchedule of a graph from the closures, opening hours and obstacle windows."""
+    moment = moment or now()
+    closures = db.session.query(
+        Closure.path_id, Closure.entrance_id, Closure.starts_at, Closure.ends_at
+    ).filter(or_(Closure.ends_at.is_(None), Closure.ends_at > moment)).all()
+    hours = db.session.query(
+        Entrance.entrance_id, Entrance.opening_hours
+    ).filter(Entrance.opening_hours.isnot(None)).all()
+    obstacle_windows = db.session.query(
+        Obstacle.starts_at, Obstacle.ends_at
+    ).filter(or_(Obstacle.starts_at.isnot(None), Obstacle.ends_at.isnot(None))).all()
+
+    path_edges = {}
+    for e, path_id in enumerate(graph.path_ids):
+        if path_id:
+            path_edges.setdefault(path_id, []).append(e)
+    incident = _incident_edges(graph) if closures or hours else {}
+
+    doors = {}
+
+    def entrance_edges(entrance_id, kind, windows):
+        node = graph.node_index.get((routing_engine.NODE_ENTRANCE, entrance_id))
+        if node is None:
+            return []
+        doors.setdefault(node, ([], []))[kind].extend(windows)
+        return incident.get(node, [])
+
+    once = {}
+    for path_id, entrance_id, starts_at, ends_at in closures:
+        window = (timestamp(starts_at, -INF), timestamp(ends_at, INF))
+        if path_id is not None:
+            edges = path_edges.get(path_id, [])
+        else:
+            edges = entrance_edges(entrance_id, 0, [window])
+        for e in edges:
+            once.setdefault(e, []).append(window)
+    weekly = {}
+    for entrance_id, opening_hours in hours:
+        closed = weekly_closed(opening_hours)
+        for e in entrance_edges(entrance_id, 1, closed):
+            weekly.setdefault(e, []).extend(closed)
+    boundaries = [t for window in obstacle_windows for t in map(timestamp, window) if t is not None]
+    return EdgeSchedule(graph, once, weekly, doors, boundaries)
+
+
+def get_schedule(graph=None):
+    """Shared schedule of the current routing graph, rebuilt after invalidate() or a graph reload."""
+    global _schedule
+    graph = graph or routing_engine.get_graph()
+    schedule = _schedule
+    if schedule is not None and schedule.graph is graph:
+        return schedule
+    with _schedule_lock:
+        if _schedule is None or _schedule.graph is not graph:
+            version = _schedule_version
+            schedule = load_schedule(graph)
+            if version == _schedule_version:
+                _schedule = schedule
+            return schedule
+        return _schedule
+
+
+def invalidate():
+    global _schedule, _schedule_version
+    _schedule_version += 1
+    _schedule = None
+
+
+def departure(graph, moment, walking_speed):
+    """Departure at a naive local datetime over a graph's schedule."""
+    return Departure(get_schedule(graph), timestamp(moment), walking_speed)
@@ -0,0 +1,281 @@
+"""
+In-memory grid-hash spatial index over campus points.
+
+Holds the coordinates of buildings, entrances, obstacles and accessibility
+features so nearest/radius lookups (entrance snapping, /api/nearest) don't
+scan whole tables. It is loaded from the database once and then kept in
+step by the write handlers instead of being rebuilt.
+"""
+import heapq
+import math
+import threading
+from collections import defaultdict
+
+from app import db
+from app.models import Building, Entrance, Obstacle, AccessibilityFeature
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEG_LAT = math.pi * EARTH_RADIUS_M / 180.0
+
+# --- Indexed kinds ---
+BUILDING = "building"
+ENTRANCE = "entrance"
+OBSTACLE = "obstacle"
+FEATURE = "accessibility_feature"
+KINDS = (BUILDING, ENTRANCE, OBSTACLE, FEATURE)
+
+
+def _distance_m(lat1, lng1, lat2, lng2):
+    # Equirectangular approximation; exact enough at campus scale
+    kx = math.cos(math.radians((lat1 + lat2) / 2))
+    dy = (lat2 - lat1) * METERS_PER_DEG_LAT
+    dx = (lng2 - lng1) * METERS_PER_DEG_LAT * kx
+    return math.hypot(dx, dy)
+
+
+def _equal(attr, value):
+    """attr == value, reading a string value (a query-string filter) as attr's type."""
+    if isinstance(value, str) and attr is not None and not isinstance(attr, str):
+        if isinstance(attr, bool):
+            return value.lower() == ("true" if attr else "false")
+        try:
+            return attr == type(attr)(value)
+        except (TypeError, ValueError):
+            return False
+    return attr == value
+
+
+def _matches(attrs, filters):
+    return all(_equal(attrs.get(name), value) for name, value in filters.items())
+
+
+class SpatialIndex:
+    """
+    Uniform grid hash: each point lives in the cell
+    (floor(lat / cell_deg), floor(lng / cell_deg)).
+    Items are keyed by (kind, id) and carry a small dict of filterable attributes.
+    """
+
+    def __init__(self, cell_deg=0.0005, max_radius_m=0):
+        self.cell_deg = cell_deg
+        # Lookups never search farther than this; 0 for no limit
+        self.max_radius_m = max_radius_m
+        self._cells = defaultdict(set)
+        self._items = {}
+        self._lock = threading.RLock()
+        self._loaded = False
+
+    def init_app(self, app):
+        self.cell_deg = app.config["SPATIAL_INDEX_CELL_DEG"]
+        self.max_radius_m = app.config["SPATIAL_INDEX_MAX_RADIUS_M"]
+
+    # --- Maintenance ---
+
+    def _cell(self, lat, lng):
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    def _insert(self, key, lat, lng, attrs):
+        old = self._items.get(key)
+        if old is not None:
+            self._cells[self._cell(old[0], old[1])].discard(key)
+        self._items[key] = (lat, lng, attrs)
+        self._cells[self._cell(lat, lng)].add(key)
+
+    def _remove(self, key):
+        old = self._items.pop(key, None)
+        if old is not None:
+            cell = self._cell(old[0], old[1])
+            self._cells[cell].discard(key)
+            if not self._cells[cell]:
+                del self._cells[cell]
+
+    def upsert(self, kind, item_id, lat, lng, **attrs):
+        """Insert or move an item; items without coordinates are removed."""
+        with self._lock:
+            if not self._loaded:
+                return
+            if lat is None or lng is None:
+                self._remove((kind, item_id))
+            else:
+                self._insert((kind, item_id), float(lat), float(lng), attrs)
+
+    def remove(self, kind, item_id):
+        with self._lock:
+            self._remove((kind, item_id))
+
+    def remove_where(self, kind, **filters):
+        """Remove every item of a kind whose attributes match (for cascaded deletes)."""
+        with self._lock:
+            stale = [key for key, (_, _, attrs) in self._items.items()
+                     if key[0] == kind and _matches(attrs, filters)]
+            for key in stale:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._cells.clear()
+            self._items.clear()
+            self._loaded = False
+
+    # --- Row helpers used by the write handlers ---
+
+    def upsert_building(self, building):
+        self.upsert(BUILDING, building.building_id, building.latitude, building.longitude,
+                    name=building.name)
+
+    def upsert_entrance(self, entrance):
+        self.upsert(ENTRANCE, entrance.entrance_id, entrance.latitude, entrance.longitude,
+                    building_id=entrance.building_id,
+                    entrance_name=entrance.entrance_name,
+                    floor_level=entrance.floor_level,
+                    wheelchair_accessible=entrance.wheelchair_accessible)
+
+    def upsert_obstacle(self, obstacle):
+        self.upsert(OBSTACLE, obstacle.obstacle_id, obstacle.latitude, obstacle.longitude,
+                    obstacle_type=obstacle.obstacle_type,
+                    severity_level=obstacle.severity_level,
+                    status=obstacle.status,
+                    building_id=obstacle.building_id,
+                    path_id=obstacle.path_id,
+                    entrance_id=obstacle.entrance_id)
+
+    def upsert_feature(self, feature):
+        self.upsert(FEATURE, feature.id, feature.latitude, feature.longitude,
+                    feature_type=feature.feature_type,
+                    description=feature.description,
+                    building_id=feature.building_id)
+
+    def ensure_loaded(self):
+        """Load every indexed table once; later changes arrive through upsert/remove."""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            for building in db.session.query(
+                    Building.building_id, Building.name, Building.latitude, Building.longitude):
+                self.upsert_building(building)
+            for entrance in db.session.query(
+                    Entrance.entrance_id, Entrance.building_id, Entrance.entrance_name,
+                    Entrance.floor_level, Entrance.wheelchair_accessible,
+                    Entrance.latitude, Entrance.longitude):
+                self.upsert_entrance(entrance)
+            for obstacle in db.session.query(
+                    Obstacle.obstacle_id, Obstacle.obstacle_type, Obstacle.severity_level,
+                    Obstacle.status, Obstacle.building_id, Obstacle.path_id,
+                    Obstacle.entrance_id, Obstacle.latitude, Obstacle.longitude):
+                self.upsert_obstacle(obstacle)
+            for feature in db.session.query(
+                    AccessibilityFeature.id, AccessibilityFeature.feature_type,
+                    AccessibilityFeature.description, AccessibilityFeature.building_id,
+                    AccessibilityFeature.latitude, AccessibilityFeature.longitude):
+                self.upsert_feature(feature)
+
+    # --- Queries ---
+
+    def _candidates(self, lat, lng, kinds, filters):
+        """
+        Yield (min_distance, [(distance, key, item), ...]) expanding outwards
+        ring by ring, min_distance being a lower bound on the distance of
+        anything in later rings (rings without any occupied cell may be
+        skipped). Only the part of each ring inside the occupied cells'
+        bounding box is visited, and nothing beyond max_radius_m.
+        """
+        if not self._cells:
+            return
+        cy, cx = self._cell(lat, lng)
+        ys = [c[0] for c in self._cells]
+        xs = [c[1] for c in self._cells]
+        min_y, max_y, min_x, max_x = min(ys), max(ys), min(xs), max(xs)
+        # The shortest side of a cell anywhere between the query and the indexed points
+        widest_lat = max(abs(lat), abs(min_y * self.cell_deg), abs((max_y + 1) * self.cell_deg))
+        cell_m = self.cell_deg * METERS_PER_DEG_LAT * math.cos(math.radians(min(widest_lat, 90.0)))
+        # Rings before first_ring don't reach the bounding box, those after last_ring lie outside it
+        first_ring = max(0, min_y - cy, cy - max_y, min_x - cx, cx - max_x)
+        last_ring = max(abs(cy - min_y), abs(cy - max_y), abs(cx - min_x), abs(cx - max_x))
+        if self.max_radius_m:
+            last_ring = min(last_ring, int(self.max_radius_m / max(cell_m, 1e-9)) + 1)
+
+        def items(cells):
+            found = []
+            for keys in cells:
+                for key in keys:
+                    if kinds and key[0] not in kinds:
+                        continue
+                    item = self._items[key]
+                    if not _matches(item[2], filters):
+                        continue
+                    distance = _distance_m(lat, lng, item[0], item[1])
+                    if self.max_radius_m and distance > self.max_radius_m:
+                        continue
+                    found.append((distance, key, item))
+            return found
+
+        visited = 0
+        ring = first_ring
+        while ring <= last_ring and visited <= len(self._cells):
+            cells = []
+            for y in range(max(cy - ring, min_y), min(cy + ring, max_y) + 1):
+                if y in (cy - ring, cy + ring):
+                    columns = range(max(cx - ring, min_x), min(cx + ring, max_x) + 1)
+                else:
+                    # Only the border of the square is new at this ring
+                    columns = [x for x in {cx - ring, cx + ring} if min_x <= x <= max_x]
+                visited += len(columns)
+                cells.extend(self._cells[(y, x)] for x in columns if (y, x) in self._cells)
+            # Anything in ring r is at least (r - 1) whole cells away on some axis
+            yield max(0, ring - 1) * cell_m, items(cells)
+            ring += 1
+        if ring > last_ring:
+            return
+
+        # Mostly empty rings from here on (a query far from campus, or stray
+        # points far out): bucket the remaining occupied cells by ring instead
+        rings = defaultdict(list)
+        for (y, x), keys in self._cells.items():
+            cell_ring = max(abs(y - cy), abs(x - cx))
+            if ring <= cell_ring <= last_ring:
+                rings[cell_ring].append(keys)
+        for cell_ring in sorted(rings):
+            yield max(0, cell_ring - 1) * cell_m, items(rings[cell_ring])
+
+    def nearest(self, lat, lng, k=1, kinds=None, max_distance_m=None, **filters):
+        """
+        Up to k closest items, sorted by distance.
+        Returns [(distance_m, kind, id, lat, lng, attrs), ...].
+        """
+        if k < 1:
+            return []
+        self.ensure_loaded()
+        best = []  # max-heap of (-distance, key, item)
+        with self._lock:
+            for bound, found in self._candidates(lat, lng, kinds, filters):
+                if len(best) >= k and bound > -best[0][0]:
+                    break
+                if max_distance_m is not None and bound > max_distance_m:
+                    break
+                for distance, key, item in found:
+                    if max_distance_m is not None and distance > max_distance_m:
+                        continue
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, key, item))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, key, item))
+        results = sorted((-d, key, item) for d, key, item in best)
+        return [(d, key[0], key[1], item[0], item[1], item[2]) for d, key, item in results]
+
+    def within(self, lat, lng, radius_m, kinds=None, **filters):
+        """Every item within radius_m, sorted by distance (same tuples as nearest)."""
+        self.ensure_loaded()
+        results = []
+        with self._lock:
+            for bound, found in self._candidates(lat, lng, kinds, filters):
+                if bound > radius_m:
+                    break
+                results.extend(f for f in found if f[0] <= radius_m)
+        results.sort(key=lambda f: f[0])
+        return [(d, key[0], key[1], item[0], item[1], item[2]) for d, key, item in results]
+
+
+spatial_index = SpatialIndex()
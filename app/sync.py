@@ -0,0 +1,126 @@
+"""
+Delta sync for the mobile client's offline cache.
+
+GET /api/sync returns every building, entrance and path together with a
+cursor; GET /api/sync?since=<cursor> returns only the rows whose
+updated_at is at or after the cursor, plus the ids deleted since then.
+Deletes are recorded as Tombstone rows by a before_flush hook, so they
+commit (or roll back) with the delete itself, ORM cascades included.
+
+The cursor is a timestamp SYNC_CURSOR_GRACE_S seconds before the read
+started: a write stamped just before the read but committed just after
+it is still picked up by the next sync, at the cost of resending a few
+seconds of rows that clients simply upsert again. Cursors older than
+SYNC_TOMBSTONE_RETENTION_DAYS get a full changeset ("full": true, replace
+the cache) because the tombstones they would need may have been purged.
+
+Each table is sent column-wise ({"fields": [...], "rows": [[...], ...],
+"deleted": [...]}) as JSON, or as MessagePack when msgpack is installed
+and the client asks for it.
+"""
+from datetime import datetime, timedelta
+
+import click
+from flask import Response, current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from app import db
+from app.collection_query import BUILDING_FIELDS, ENTRANCE_FIELDS, PATH_FIELDS
+from app.metrics import metrics
+from app.models import Building, Entrance, Path, Tombstone, utcnow
+
+# Changeset key -> (model, field spec); the first field is the primary key
+TABLES = {
+    'buildings': (Building, BUILDING_FIELDS),
+    'entrances': (Entrance, ENTRANCE_FIELDS),
+    'paths': (Path, PATH_FIELDS),
+}
+SYNCED_MODELS = tuple(model for model, _ in TABLES.values())
+
+FORMATS = {
+    'json': "application/json",
+    'msgpack': "application/msgpack",
+}
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+@event.listens_for(Session, "before_flush")
+def _record_deletes(session, flush_context, instances):
+    for obj in list(session.deleted):
+        if isinstance(obj, SYNCED_MODELS):
+            row_id = db.inspect(obj).identity[0]
+            session.add(Tombstone(table_name=obj.__tablename__, row_id=row_id))
+
+
+def encode_cursor(moment):
+    return str((moment - _EPOCH) // _MICROSECOND)
+
+
+def decode_cursor(cursor):
+    """datetime for a cursor string; ValueError if it isn't one."""
+    if not cursor.isdigit():
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    return _EPOCH + int(cursor) * _MICROSECOND
+
+
+def changeset(since=None):
+    """Rows changed and ids deleted since a datetime, or everything when since is None or too old."""
+    now = utcnow()
+    retention = timedelta(days=current_app.config["SYNC_TOMBSTONE_RETENTION_DAYS"])
+    full = since is None or since < now - retention
+    grace = timedelta(seconds=current_app.config["SYNC_CURSOR_GRACE_S"])
+    result = {"cursor": encode_cursor(now - grace), "full": full}
+
+    for key, (model, fields) in TABLES.items():
+        query = select(*(column for column, _ in fields.values()))
+        if not full:
+            query = query.where(model.updated_at >= since)
+        converters = [converter for _, converter in fields.values()]
+        rows = [
+            [convert(value) if convert else value for convert, value in zip(converters, row)]
+            for row in db.session.execute(query)
+        ]
+        deleted = []
+        if not full:
+            tombstones = db.session.execute(
+                select(Tombstone.row_id).where(
+                    Tombstone.table_name == model.__tablename__, Tombstone.deleted_at >= since)
+            ).scalars()
+            # An id deleted and then imported again is an upsert, not a delete
+            upserted = {row[0] for row in rows}
+            deleted = sorted(set(tombstones) - upserted)
+        result[key] = {"fields": list(fields), "rows": rows, "deleted": deleted}
+    return result
+
+
+def response(since=None, fmt='json'):
+    """Changeset response in 'json' or 'msgpack'."""
+    data = changeset(since)
+    with metrics.span("serialize"):
+        if fmt == 'msgpack':
+            body = msgpack.packb(data, use_bin_type=True)
+        else:
+            body = current_app.json.dumps(data).encode("utf-8")
+    response = Response(body, mimetype=FORMATS[fmt])
+    response.vary.add("Accept")
+    response.cache_control.no_store = True
+    return response
+
+
+@click.command('purge-tombstones')
+@with_appcontext
+def purge_tombstones_command():
+    """Delete tombstones older than SYNC_TOMBSTONE_RETENTION_DAYS."""
+    cutoff = utcnow() - timedelta(days=current_app.config["SYNC_TOMBSTONE_RETENTION_DAYS"])
+    purged = Tombstone.query.filter(Tombstone.deleted_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    click.echo(f"{purged} tombstone(s) purged")
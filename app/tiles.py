@@ -0,0 +1,412 @@
+"""
+Vector tiles for the campus map layers, with an on-disk tile cache.
+
+/api/tiles/<layer>/<z>/<x>/<y>.mvt renders one layer of one Web Mercator
+tile from the database (buildings, entrances, paths, obstacles,
+accessibility features or indoor floor plans) so the map only downloads
+what is on screen. Rendered tiles are written under TILE_CACHE_DIR, which
+all workers share. The change hooks delete exactly the tiles, at every
+zoom, that a changed row was or is drawn in.
+
+A stamp file records the time of the last invalidation. A tile rendered
+from data read before that time is served but not stored, so a write
+racing a render (in this or another worker) cannot leave a stale tile
+behind.
+"""
+import hashlib
+import math
+import os
+import shutil
+import threading
+import time
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import aliased
+
+from app import db, mvt
+from app.metrics import metrics
+from app.models import AccessibilityFeature, Building, Entrance, IndoorFeature, Obstacle, Path
+
+# Features within this many tile units of a tile's edge are drawn in it too,
+# so symbols and line joins are not cut off at tile boundaries
+BUFFER = 64
+
+# Filesystem timestamps can lag the clock by a timer tick; renders started
+# this soon after an invalidation are not stored
+CLOCK_SLACK_NS = 50_000_000
+
+# Buildings' floor plans extend at most this far (degrees, ~220 m) from the building point
+INDOOR_REACH_DEG = 0.002
+
+# layer -> lowest zoom it is drawn at
+LAYERS = {
+    'building': 13,
+    'path': 14,
+    'obstacle': 14,
+    'accessibility_feature': 15,
+    'entrance': 16,
+    'indoor': 17,
+}
+
+
+#-------------------------------------------------------------------------
+# Tile math
+#-------------------------------------------------------------------------
+
+def _world(lat, lng):
+    """Web Mercator position in [0, 1) x [0, 1), y pointing south."""
+    lat = max(-85.0511, min(85.0511, lat))
+    x = (lng + 180.0) / 360.0
+    s = math.sin(math.radians(lat))
+    y = 0.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi)
+    return x, y
+
+
+def _lat(y):
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+
+
+def tile_bounds(z, x, y, buffer=0):
+    """(min_lng, min_lat, max_lng, max_lat) of a tile plus buffer tile units on each side."""
+    n = 2 ** z
+    pad = buffer / mvt.EXTENT
+    return (
+        (x - pad) / n * 360.0 - 180.0,
+        _lat((y + 1 + pad) / n),
+        (x + 1 + pad) / n * 360.0 - 180.0,
+        _lat((y - pad) / n),
+    )
+
+
+def tiles_covering(bbox, z, buffer=BUFFER):
+    """(x, y) of every tile at zoom z that draws something inside bbox."""
+    min_lng, min_lat, max_lng, max_lat = bbox
+    n = 2 ** z
+    pad = buffer / mvt.EXTENT
+    x0, y0 = _world(max_lat, min_lng)
+    x1, y1 = _world(min_lat, max_lng)
+    for x in range(max(0, int(x0 * n - pad)), min(n - 1, int(x1 * n + pad)) + 1):
+        for y in range(max(0, int(y0 * n - pad)), min(n - 1, int(y1 * n + pad)) + 1):
+            yield x, y
+
+
+class _Projector:
+    """lat/lng -> tile units for one tile."""
+
+    def __init__(self, z, x, y):
+        self.n = 2 ** z
+        self.x = x
+        self.y = y
+
+    def __call__(self, lat, lng):
+        wx, wy = _world(lat, lng)
+        return (wx * self.n - self.x) * mvt.EXTENT, (wy * self.n - self.y) * mvt.EXTENT
+
+
+def _in_bbox(lat_col, lng_col, bbox):
+    min_lng, min_lat, max_lng, max_lat = bbox
+    return and_(lat_col.between(min_lat, max_lat), lng_col.between(min_lng, max_lng))
+
+
+def _intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def _geometry_bbox(geometry):
+    coords = []
+    stack = [geometry.get("coordinates") or []]
+    while stack:
+        item = stack.pop()
+        if item and isinstance(item[0], (int, float)):
+            coords.append(item)
+        else:
+            stack.extend(item)
+    if not coords:
+        return None
+    lngs = [c[0] for c in coords]
+    lats = [c[1] for c in coords]
+    return min(lngs), min(lats), max(lngs), max(lats)
+
+
+#-------------------------------------------------------------------------
+# Layer queries -> features
+#-------------------------------------------------------------------------
+
+def _float(value):
+    return float(value) if value is not None else None
+
+
+def _points(query, bbox, lat_col, lng_col, id_col, properties):
+    """(id, POINT, [(lat, lng)], props) for point rows inside bbox."""
+    for row in query.filter(_in_bbox(lat_col, lng_col, bbox)):
+        lat, lng = _float(row.latitude), _float(row.longitude)
+        yield getattr(row, id_col), mvt.POINT, [(lat, lng)], properties(row)
+
+
+def _building_features(bbox):
+    query = db.session.query(Building.building_id, Building.name, Building.latitude, Building.longitude)
+    return _points(query, bbox, Building.latitude, Building.longitude, 'building_id',
+                   lambda r: {'name': r.name})
+
+
+def _entrance_features(bbox):
+    query = db.session.query(
+        Entrance.entrance_id, Entrance.building_id, Entrance.entrance_name, Entrance.latitude,
+        Entrance.longitude, Entrance.floor_level, Entrance.wheelchair_accessible)
+    return _points(query, bbox, Entrance.latitude, Entrance.longitude, 'entrance_id',
+                   lambda r: {'building_id': r.building_id, 'name': r.entrance_name,
+                              'floor_level': r.floor_level, 'wheelchair_accessible': r.wheelchair_accessible})
+
+
+def _obstacle_features(bbox):
+    query = db.session.query(
+        Obstacle.obstacle_id, Obstacle.latitude, Obstacle.longitude, Obstacle.obstacle_type,
+        Obstacle.severity_level, Obstacle.status, Obstacle.path_id)
+    return _points(query, bbox, Obstacle.latitude, Obstacle.longitude, 'obstacle_id',
+                   lambda r: {'obstacle_type': r.obstacle_type, 'severity_level': r.severity_level,
+                              'status': r.status, 'path_id': r.path_id})
+
+
+def _accessibility_features(bbox):
+    query = db.session.query(
+        AccessibilityFeature.id, AccessibilityFeature.latitude, AccessibilityFeature.longitude,
+        AccessibilityFeature.feature_type, AccessibilityFeature.description)
+    return _points(query, bbox, AccessibilityFeature.latitude, AccessibilityFeature.longitude, 'id',
+                   lambda r: {'feature_type': r.feature_type, 'description': r.description})
+
+
+def _path_features(bbox):
+    min_lng, min_lat, max_lng, max_lat = bbox
+    start, end = aliased(Building), aliased(Building)
+    query = db.session.query(
+        Path.path_id, Path.has_stairs, Path.had_incline, Path.is_paved, Path.is_wheelchair_accessible,
+        Path.max_grade, start.latitude, start.longitude, end.latitude, end.longitude,
+    ).join(start, Path.start_location_id == start.building_id
+    ).join(end, Path.end_location_id == end.building_id
+    ).filter(
+        # The segment's bounding box overlaps the tile
+        or_(start.latitude >= min_lat, end.latitude >= min_lat),
+        or_(start.latitude <= max_lat, end.latitude <= max_lat),
+        or_(start.longitude >= min_lng, end.longitude >= min_lng),
+        or_(start.longitude <= max_lng, end.longitude <= max_lng),
+    )
+    for (path_id, stairs, incline, paved, accessible, max_grade, lat1, lng1, lat2, lng2) in query:
+        if None in (lat1, lng1, lat2, lng2):
+            continue
+        line = [(float(lat1), float(lng1)), (float(lat2), float(lng2))]
+        yield path_id, mvt.LINESTRING, [line], {
+            'has_stairs': stairs, 'had_incline': incline, 'is_paved': paved,
+            'is_wheelchair_accessible': accessible, 'max_grade': max_grade,
+        }
+
+
+def _indoor_features(bbox):
+    min_lng, min_lat, max_lng, max_lat = bbox
+    reach = (min_lng - INDOOR_REACH_DEG, min_lat - INDOOR_REACH_DEG,
+             max_lng + INDOOR_REACH_DEG, max_lat + INDOOR_REACH_DEG)
+    query = db.session.query(IndoorFeature).join(Building).filter(
+        _in_bbox(Building.latitude, Building.longitude, reach))
+    for row in query:
+        geometry = row.geometry or {}
+        extent = _geometry_bbox(geometry)
+        if extent is None or not _intersects(extent, bbox):
+            continue
+        kind = geometry.get("type")
+        coords = geometry["coordinates"]
+        if kind in ("Point", "MultiPoint"):
+            geom_type, parts = mvt.POINT, [coords] if kind == "Point" else coords
+            parts = [(c[1], c[0]) for c in parts]
+        elif kind in ("LineString", "MultiLineString"):
+            geom_type = mvt.LINESTRING
+            lines = [coords] if kind == "LineString" else coords
+            parts = [[(c[1], c[0]) for c in line] for line in lines]
+        elif kind in ("Polygon", "MultiPolygon"):
+            geom_type = mvt.POLYGON
+            polygons = [coords] if kind == "Polygon" else coords
+            parts = [[[(c[1], c[0]) for c in ring] for ring in polygon] for polygon in polygons]
+        else:
+            continue
+        yield row.feature_id, geom_type, parts, {
+            'building_id': row.building_id, 'level': row.level, 'category': row.category,
+            'name': row.name, 'ref': row.ref, 'wheelchair_accessible': row.wheelchair_accessible,
+        }
+
+
+SOURCES = {
+    'building': _building_features,
+    'entrance': _entrance_features,
+    'path': _path_features,
+    'obstacle': _obstacle_features,
+    'accessibility_feature': _accessibility_features,
+    'indoor': _indoor_features,
+}
+
+
+def _project(geom_type, parts, project):
+    if geom_type == mvt.POINT:
+        return [project(*p) for p in parts]
+    if geom_type == mvt.LINESTRING:
+        return [[project(*p) for p in line] for line in parts]
+    return [[[project(*p) for p in ring] for ring in polygon] for polygon in parts]
+
+
+def render_tile(layer, z, x, y, tolerance):
+    """Encoded MVT bytes for one layer of one tile (empty below the layer's minimum zoom)."""
+    if z < LAYERS[layer]:
+        return b""
+    project = _Projector(z, x, y)
+    builder = mvt.LayerBuilder(layer)
+    for feature_id, geom_type, parts, properties in SOURCES[layer](tile_bounds(z, x, y, BUFFER)):
+        geometry = mvt.encode_geometry(geom_type, _project(geom_type, parts, project), tolerance)
+        if geometry is not None:
+            builder.add(feature_id, geom_type, geometry, properties)
+    return builder.encode()
+
+
+#-------------------------------------------------------------------------
+# Tile cache
+#-------------------------------------------------------------------------
+
+class TileCache:
+    """Rendered tiles on disk, {TILE_CACHE_DIR}/{layer}/{z}/{x}/{y}.mvt."""
+
+    def __init__(self):
+        self.enabled = True
+        self.root = None
+        self.max_zoom = 20
+        self.tolerance = 1.0
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config["TILE_CACHE_ENABLED"]
+        self.root = config["TILE_CACHE_DIR"] or os.path.join(app.instance_path, "tiles")
+        self.max_zoom = config["TILE_MAX_ZOOM"]
+        self.tolerance = config["TILE_SIMPLIFY_TOLERANCE"]
+
+    def _file(self, layer, z, x, y):
+        return os.path.join(self.root, layer, str(z), str(x), f"{y}.mvt")
+
+    def _stamp(self):
+        return os.path.join(self.root, ".invalidated")
+
+    def _invalidated_at(self):
+        try:
+            return os.stat(self._stamp()).st_mtime_ns
+        except OSError:
+            return 0
+
+    def _touch(self):
+        os.makedirs(self.root, exist_ok=True)
+        with open(self._stamp(), "a"):
+            pass
+        os.utime(self._stamp())
+
+    def get(self, layer, z, x, y):
+        """(body, etag) for a tile, rendering and storing it on a miss."""
+        path = self._file(layer, z, x, y)
+        if self.enabled:
+            try:
+                with open(path, "rb") as f:
+                    body = f.read()
+                with self._lock:
+                    self.hits += 1
+                return body, hashlib.sha1(body).hexdigest()[:27]
+            except OSError:
+                pass
+        with self._lock:
+            self.misses += 1
+
+        started = time.time_ns()
+        with metrics.span("tiles.render"):
+            body = render_tile(layer, z, x, y, self.tolerance)
+        if self.enabled and self._invalidated_at() < started - CLOCK_SLACK_NS:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(body)
+            os.replace(tmp, path)
+            # An invalidation may have deleted the file just before our rename
+            if self._invalidated_at() >= started - CLOCK_SLACK_NS:
+                self._unlink(path)
+        return body, hashlib.sha1(body).hexdigest()[:27]
+
+    def _unlink(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def invalidate(self, layer, bbox):
+        """Delete every cached tile of layer that draws something inside bbox."""
+        if not self.enabled:
+            return
+        self._touch()
+        removed = 0
+        for z in range(LAYERS[layer], self.max_zoom + 1):
+            for x, y in tiles_covering(bbox, z):
+                removed += self._unlink(self._file(layer, z, x, y))
+        with self._lock:
+            self.invalidated += removed
+
+    def invalidate_point(self, layer, lat, lng):
+        if lat is not None and lng is not None:
+            self.invalidate(layer, (float(lng), float(lat), float(lng), float(lat)))
+
+    def invalidate_path(self, start_id, end_id):
+        """Tiles of the path layer a path between two buildings is drawn in."""
+        rows = db.session.query(Building.latitude, Building.longitude).filter(
+            Building.building_id.in_((start_id, end_id))).all()
+        points = [(float(lat), float(lng)) for lat, lng in rows if lat is not None and lng is not None]
+        if points:
+            lats = [p[0] for p in points]
+            lngs = [p[1] for p in points]
+            self.invalidate('path', (min(lngs), min(lats), max(lngs), max(lats)))
+
+    def invalidate_building(self, building, previous=None):
+        """A building and the paths drawn from it, at its previous and current position."""
+        positions = [(building.latitude, building.longitude)]
+        if previous is not None:
+            positions.append(previous)
+        positions = [(float(lat), float(lng)) for lat, lng in positions if lat is not None and lng is not None]
+        for lat, lng in positions:
+            self.invalidate_point('building', lat, lng)
+        if previous is None or len(set(positions)) < 2:
+            return
+        # It moved: so did one end of each of its paths
+        building_id = building.building_id
+        ends = db.session.query(Path.start_location_id, Path.end_location_id).filter(
+            or_(Path.start_location_id == building_id, Path.end_location_id == building_id)).all()
+        others = {end if start == building_id else start for start, end in ends}
+        other = db.session.query(Building.latitude, Building.longitude).filter(
+            Building.building_id.in_(others)).all() if others else []
+        for lat, lng in other:
+            if lat is None or lng is None:
+                continue
+            for p_lat, p_lng in positions:
+                self.invalidate('path', (min(p_lng, float(lng)), min(p_lat, float(lat)),
+                                         max(p_lng, float(lng)), max(p_lat, float(lat))))
+
+    def clear(self, *layers):
+        """Drop the given layers (default: all) from the cache."""
+        if not self.enabled:
+            return
+        self._touch()
+        for layer in layers or LAYERS:
+            shutil.rmtree(os.path.join(self.root, layer), ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidated': self.invalidated,
+            }
+
+
+tile_cache = TileCache()
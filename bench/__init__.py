@@ -0,0 +1,10 @@
+"""
+Benchmark suite for the MobiNav API.
+
+    python -m bench run --buildings 200 --obstacles 100
+    python -m bench compare bench/results/OLD.json bench/results/NEW.json
+
+A synthetic campus is generated into SQLite (in memory by default), the
+endpoints are driven through the Flask test client, and OSRM calls go to
+a local stub server so network latency does not drown out our own code.
+"""
@@ -0,0 +1,183 @@
+"""
+Command line entry point: `python -m bench run ...` / `python -m bench compare A B`.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _print_table(results):
+    header = f"{'scenario':32} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'req/s':>9} {'peak KiB':>9} {'errors':>6}"
+    print(header)
+    print("-" * len(header))
+    for name, r in results.items():
+        print(f"{name:32} {r['p50_ms']:9.3f} {r['p90_ms']:9.3f} {r['p99_ms']:9.3f} "
+              f"{r['throughput_rps']:9.1f} {r['alloc_peak_kib_mean']:9.1f} {r['errors']:6d}")
+
+
+def run(args):
+    # The app reads its database URL at import time
+    if args.db == ":memory:":
+        os.environ["DATABASE_URL"] = "sqlite://"
+    else:
+        if os.path.exists(args.db):
+            os.remove(args.db)
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(args.db)}"
+
+    from app import create_app, db, elevation, routing_engine
+    from app.contraction import contraction
+    from app.graph_snapshot import graph_snapshot
+    from app.osrm_client import osrm_client
+    from app.route_table import route_table
+    from app.tiles import tile_cache
+    from bench import scenarios, synthetic
+    from bench.harness import measure
+    from bench.stub_osrm import StubOSRM
+
+    app = create_app()
+    with StubOSRM(latency_s=args.osrm_latency_ms / 1000.0) as stub, \
+            tempfile.TemporaryDirectory() as workdir, app.app_context():
+        app.config.update(
+            OSRM_URL=stub.url,
+            # Keep precomputed files away from the real instance folder
+            ROUTE_TABLE_PATH=os.path.join(workdir, "route_table.bin"),
+            ROUTING_CH_PATH=os.path.join(workdir, "contraction.bin"),
+            GRAPH_SNAPSHOT_PATH=os.path.join(workdir, "graph.bin"),
+            TILE_CACHE_DIR=os.path.join(workdir, "tiles"),
+        )
+        osrm_client.init_app(app)
+        route_table.init_app(app)
+        contraction.init_app(app)
+        graph_snapshot.init_app(app)
+        tile_cache.init_app(app)
+        db.create_all()
+
+        campus = synthetic.generate(
+            buildings=args.buildings, entrances_per_building=args.entrances,
+            paths_per_building=args.paths, obstacles=args.obstacles, closures=args.closures, seed=args.seed)
+        counts = synthetic.load(campus)
+        dem_path = os.path.join(workdir, "dem.tif")
+        synthetic.write_dem(dem_path, campus, seed=args.seed)
+        elevation.ingest(elevation.DEM(dem_path), app.config["DEM_SAMPLE_STEP_M"])
+        print("Campus: " + ", ".join(f"{n} {layer}(s)" for layer, n in counts.items()), file=sys.stderr)
+
+        # Measure the steady state rather than a background build racing the requests
+        if route_table.enabled:
+            route_table.repair(route_table.current_state())
+        if contraction.enabled:
+            contraction.hierarchies(routing_engine.get_graph()) or contraction.build(routing_engine.get_graph())
+
+        selected = set(args.scenarios.split(",")) if args.scenarios else None
+        results = {}
+        client = app.test_client()
+        for scenario in scenarios.build(client, campus, seed=args.seed, dem_path=dem_path):
+            if selected is not None and scenario.name not in selected:
+                continue
+            saved = {key: app.config[key] for key in scenario.config}
+            app.config.update(scenario.config)
+            try:
+                results[scenario.name] = measure(scenario, args.iterations, warmup=args.warmup,
+                                                 alloc_iterations=args.alloc_iterations)
+            finally:
+                app.config.update(saved)
+            print(f"  {scenario.name}: p50 {results[scenario.name]['p50_ms']:.3f} ms", file=sys.stderr)
+
+    output = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {k: v for k, v in vars(args).items() if k != "func"},
+            "campus": counts,
+        },
+        "scenarios": results,
+    }
+    _print_table(results)
+
+    path = args.output
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{output['meta']['commit']}.json")
+    with open(path, "w") as f:
+        json.dump(output, f, indent=2)
+    print(f"Results written to {path}", file=sys.stderr)
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    metric = args.metric
+    print(f"{baseline['meta']['commit']} -> {candidate['meta']['commit']} ({metric})")
+    header = f"{'scenario':32} {'before':>10} {'after':>10} {'change':>8}"
+    print(header)
+    print("-" * len(header))
+    regressions = 0
+    for name, after in candidate["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if before is None or not before.get(metric):
+            print(f"{name:32} {'-':>10} {after[metric]:10.3f} {'new':>8}")
+            continue
+        change = (after[metric] - before[metric]) / before[metric] * 100.0
+        # Higher is better for throughput, lower for everything else
+        worse = -change if metric == "throughput_rps" else change
+        flag = "  !" if worse > args.threshold else ""
+        regressions += bool(flag)
+        print(f"{name:32} {before[metric]:10.3f} {after[metric]:10.3f} {change:+7.1f}%{flag}")
+    if regressions:
+        print(f"{regressions} scenario(s) regressed by more than {args.threshold:.0f}%")
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("run", help="generate a synthetic campus and benchmark the API")
+    p.add_argument("--buildings", type=int, default=200)
+    p.add_argument("--entrances", type=int, default=2, help="entrances per building")
+    p.add_argument("--paths", type=int, default=3, help="paths to nearest neighbours per building")
+    p.add_argument("--obstacles", type=int, default=100)
+    p.add_argument("--closures", type=int, default=20, help="paths and entrances closed over a future weekend")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--db", default=":memory:", help="SQLite file (recreated) or :memory:")
+    p.add_argument("--iterations", type=int, default=200)
+    p.add_argument("--warmup", type=int, default=10)
+    p.add_argument("--alloc-iterations", type=int, default=50)
+    p.add_argument("--osrm-latency-ms", type=float, default=0.0, help="artificial stub OSRM delay")
+    p.add_argument("--scenarios", help="comma-separated scenario names (default: all)")
+    p.add_argument("--output", help="result file (default: bench/results/<commit>.json)")
+    p.set_defaults(func=run)
+
+    p = commands.add_parser("compare", help="diff two result files")
+    p.add_argument("baseline")
+    p.add_argument("candidate")
+    p.add_argument("--metric", default="p50_ms")
+    p.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent")
+    p.add_argument("--fail-on-regression", action="store_true")
+    p.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
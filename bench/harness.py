@@ -0,0 +1,100 @@
+"""
+Timing and allocation measurement for benchmark scenarios.
+"""
+import gc
+import time
+import tracemalloc
+
+
+class Scenario:
+    """
+    One benchmarked operation.
+    call() performs it and returns a Flask response (or any other value
+    for non-HTTP scenarios); setup(), when given, runs untimed before each
+    call. config is applied to app.config for the duration of the scenario.
+    """
+
+    def __init__(self, name, call, setup=None, config=None, expect=(200,)):
+        self.name = name
+        self.call = call
+        self.setup = setup
+        self.config = config or {}
+        self.expect = expect
+
+
+def percentile(sorted_values, q):
+    """Linearly interpolated q-th percentile (0-100) of pre-sorted values."""
+    if not sorted_values:
+        return None
+    pos = (len(sorted_values) - 1) * q / 100.0
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def _ok(scenario, result):
+    status = getattr(result, "status_code", None)
+    return status is None or status in scenario.expect
+
+
+def _run_once(scenario):
+    if scenario.setup is not None:
+        scenario.setup()
+    start = time.perf_counter()
+    result = scenario.call()
+    elapsed = time.perf_counter() - start
+    return elapsed, _ok(scenario, result)
+
+
+def measure(scenario, iterations, warmup=10, alloc_iterations=50):
+    """
+    Time `iterations` calls after `warmup` untimed ones, then repeat a
+    shorter pass under tracemalloc (kept separate so tracing overhead does
+    not distort the latencies). Returns a JSON-ready dict.
+    """
+    for _ in range(warmup):
+        _run_once(scenario)
+
+    timings = []
+    errors = 0
+    for _ in range(iterations):
+        elapsed, ok = _run_once(scenario)
+        timings.append(elapsed)
+        errors += not ok
+    timings.sort()
+    total = sum(timings)
+
+    gc.collect()
+    tracemalloc.start()
+    peaks = []
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        for _ in range(alloc_iterations):
+            if scenario.setup is not None:
+                scenario.setup()
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            scenario.call()
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] - baseline
+    finally:
+        tracemalloc.stop()
+
+    ms = [t * 1000.0 for t in timings]
+    return {
+        "iterations": iterations,
+        "errors": errors,
+        "mean_ms": total * 1000.0 / iterations if iterations else None,
+        "min_ms": ms[0] if ms else None,
+        "p50_ms": percentile(ms, 50),
+        "p90_ms": percentile(ms, 90),
+        "p95_ms": percentile(ms, 95),
+        "p99_ms": percentile(ms, 99),
+        "max_ms": ms[-1] if ms else None,
+        "throughput_rps": iterations / total if total > 0 else None,
+        "alloc_peak_kib_mean": sum(peaks) / len(peaks) / 1024.0 if peaks else None,
+        "alloc_peak_kib_max": max(peaks) / 1024.0 if peaks else None,
+        # Growth over the whole allocation pass: caches filling up, or a leak
+        "retained_kib": retained / 1024.0 if alloc_iterations else None,
+    }
@@ -0,0 +1,217 @@
+"""
+The benchmarked operations: CRUD endpoints, collection reads, spatial
+queries and route planning with the local engine and (stubbed) OSRM.
+"""
+import asyncio
+import itertools
+import random
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+from app import elevation, routes
+from app.asgi import RoutingASGI
+from app.models import utcnow
+from app.route_cache import route_cache
+from app.sync import encode_cursor
+from app.tiles import tile_cache, tiles_covering
+from bench.harness import Scenario
+from bench.synthetic import METERS_PER_DEG_LAT, WEEKEND, random_point
+
+
+def _fmt(point):
+    return f"{point[0]:.6f},{point[1]:.6f}"
+
+
+def _route_url(start, end, avoid_stairs=False, alternatives=1):
+    url = f"/api/get_route?start={_fmt(start)}&end={_fmt(end)}"
+    if alternatives > 1:
+        url += f"&alternatives={alternatives}"
+    return url + "&avoidStairs=true" if avoid_stairs else url
+
+
+def build(client, campus, seed=0, pool=200, dem_path=None):
+    """
+    All scenarios in run order (writes last, so reads see the generated
+    campus). dem_path: the GeoTIFF the campus grades were imported from.
+    """
+    rnd = random.Random(seed)
+    building_ids = [b["building_id"] for b in campus["building"]]
+    obstacle_ids = [o["obstacle_id"] for o in campus["obstacle"]]
+
+    points = [random_point(campus, rnd) for _ in range(pool)]
+    pairs = itertools.cycle(list(zip(points, points[1:] + points[:1])))
+    hot_pairs = itertools.cycle(list(zip(points[:20], points[1:21])))
+    buildings = itertools.cycle(rnd.choice(building_ids) for _ in range(pool))
+    rooms = [f for f in campus["indoor"] if f["category"] == "room"]
+    room_routes = itertools.cycle([(point, rnd.choice(rooms)["feature_id"]) for point in points])
+    near = itertools.cycle(points)
+
+    box = 200.0 / METERS_PER_DEG_LAT
+    bboxes = itertools.cycle(
+        f"{p[1] - box:.6f},{p[0] - box:.6f},{p[1] + box:.6f},{p[0] + box:.6f}" for p in points)
+
+    tiles = itertools.cycle(sorted({
+        tile for p in points for tile in tiles_covering((p[1], p[0], p[1], p[0]), 16, buffer=0)}))
+
+    matrix_points = [[p[0], p[1]] for p in points[:10]]
+    matrix_body = {"sources": matrix_points, "destinations": matrix_points}
+
+    created = []
+    existing = itertools.cycle(obstacle_ids or [0])
+
+    def get(url):
+        return lambda: client.get(url)
+
+    def route(pairs_iter, avoid_stairs=False, alternatives=1):
+        def call():
+            start, end = next(pairs_iter)
+            return client.get(_route_url(start, end, avoid_stairs, alternatives))
+        return call
+
+    def weekend_route():
+        # Accessible routes while the synthetic closures are in effect
+        start, end = next(pairs)
+        depart_at = (WEEKEND[0] + (WEEKEND[1] - WEEKEND[0]) / 2).isoformat()
+        return client.get(_route_url(start, end, avoid_stairs=True) + f"&depart_at={depart_at}")
+
+    def steep_route():
+        start, end = next(pairs)
+        return client.get(_route_url(start, end, avoid_stairs=True) + "&maxIncline=8.33")
+
+    def reimport_dem():
+        # Every profile is unchanged, so this is the sampling and comparison alone
+        return elevation.ingest(elevation.DEM(dem_path), client.application.config["DEM_SAMPLE_STEP_M"])
+
+    def room_route():
+        start, room = next(room_routes)
+        return client.get(f"/api/get_route?start={_fmt(start)}&endRoom={room}&avoidStairs=true")
+
+    def floor_plan():
+        building_id = next(buildings)
+        return client.get(f"/api/buildings/{building_id}/floors/1", headers={"Accept-Encoding": "gzip"})
+
+    def tile(layer):
+        def call():
+            x, y = next(tiles)
+            return client.get(f"/api/tiles/{layer}/16/{x}/{y}.mvt")
+        return call
+
+    def sync_delta():
+        # A phone that synced a moment ago, so nothing has changed since
+        return client.get(f"/api/sync?since={encode_cursor(utcnow())}")
+
+    def create_obstacle():
+        lat, lng = next(near)
+        response = client.post("/api/obstacles", json={
+            "latitude": lat, "longitude": lng, "obstacle_type": "construction",
+            "severity_level": 2, "status": "active", "description": "Benchmark obstacle",
+        })
+        if response.status_code == 201:
+            created.append(response.get_json()["obstacle_id"])
+        return response
+
+    def duplicate_report():
+        # Everyone reporting the same blocked walkway: merged into one obstacle
+        lat, lng = points[0]
+        return client.post("/api/obstacles", json={
+            "latitude": lat, "longitude": lng, "obstacle_type": "blocked_path", "severity_level": 3,
+        })
+
+    def update_obstacle():
+        return client.put(f"/api/obstacles/{next(existing)}", json={"severity_level": rnd.randint(1, 5)})
+
+    def delete_obstacle():
+        while not created:
+            create_obstacle()
+        return client.delete(f"/api/obstacles/{created.pop()}")
+
+    def asgi_routes(n):
+        # n concurrent requests to the ASGI app, awaited together
+        asgi = RoutingASGI(client.application)
+
+        async def one(url):
+            parts = urlsplit(url)
+            sent = []
+
+            async def receive():
+                await asyncio.Event().wait()
+
+            async def send(message):
+                sent.append(message)
+
+            await asgi({"type": "http", "method": "GET", "path": parts.path,
+                        "query_string": parts.query.encode(), "headers": []}, receive, send)
+            return sent[0]["status"]
+
+        async def batch():
+            return await asyncio.gather(*(one(_route_url(*next(pairs))) for _ in range(n)))
+
+        def call():
+            statuses = asyncio.run(batch())
+            return SimpleNamespace(status_code=max(statuses))
+        return call
+
+    def sync_routes(n):
+        single = route(pairs)
+
+        def call():
+            statuses = [single().status_code for _ in range(n)]
+            return SimpleNamespace(status_code=max(statuses))
+        return call
+
+    def osrm_helper():
+        start, end = next(pairs)
+        return routes.get_osrm_route(start, end, {"avoidStairs": False})
+
+    local = {"ROUTING_ENGINE": "local"}
+    osrm = {"ROUTING_ENGINE": "osrm"}
+    return [
+        Scenario("buildings.list", get("/api/buildings")),
+        Scenario("buildings.list.gzip", lambda: client.get("/api/buildings", headers={"Accept-Encoding": "gzip"})),
+        Scenario("entrances.list", get("/api/entrances")),
+        Scenario("paths.list", get("/api/paths")),
+        Scenario("obstacles.list", get("/api/obstacles")),
+        Scenario("entrances.bbox", lambda: client.get(f"/api/entrances?bbox={next(bboxes)}&limit=100")),
+        Scenario("buildings.get", lambda: client.get(f"/api/buildings/{next(buildings)}")),
+        Scenario("buildings.indoor", lambda: client.get(f"/api/buildings/{next(buildings)}/indoor")),
+        Scenario("buildings.full", lambda: client.get(f"/api/buildings/{next(buildings)}/full")),
+        Scenario("buildings.full.bulk", lambda: client.get(
+            "/api/buildings/full?ids=" + ",".join(str(next(buildings)) for _ in range(20)))),
+        Scenario("buildings.floor_plan", floor_plan),
+        Scenario("tiles.path.cold", tile("path"), setup=lambda: tile_cache.clear("path")),
+        Scenario("tiles.building.cached", tile("building")),
+        Scenario("sync.full", get("/api/sync")),
+        Scenario("sync.delta", sync_delta),
+        Scenario("nearest.entrance", lambda: client.get(
+            "/api/nearest?lat={:.6f}&lng={:.6f}&type=entrance&k=5".format(*next(near)))),
+        Scenario("route.local.cold", route(pairs), setup=route_cache.clear, config=local),
+        Scenario("route.local.accessible.cold", route(pairs, avoid_stairs=True),
+                 setup=route_cache.clear, config=local),
+        Scenario("route.local.cached", route(hot_pairs), config=local),
+        Scenario("route.local.polyline6", lambda: client.get(
+            _route_url(*next(hot_pairs)) + "&format=polyline6&tolerance=2"), config=local),
+        Scenario("route.local.alternatives.cold", route(pairs, alternatives=3),
+                 setup=route_cache.clear, config=local),
+        # Closures may cut some pairs apart, which is an answer too
+        Scenario("route.local.weekend.cold", weekend_route, setup=route_cache.clear, config=local,
+                 expect=(200, 404)),
+        # Hills can leave no gentle way between some pairs
+        Scenario("route.local.max_incline.cold", steep_route, setup=route_cache.clear, config=local,
+                 expect=(200, 404)),
+        # Some rooms have no step-free way in (every entrance on their side is inaccessible)
+        Scenario("route.local.room.cold", room_route, setup=route_cache.clear, config=local,
+                 expect=(200, 404)),
+        Scenario("route.osrm.cold", route(pairs), setup=route_cache.clear, config=osrm),
+        # 8 routes one after another through WSGI vs. concurrently through the ASGI app
+        Scenario("route.osrm.x8.cold", sync_routes(8), setup=route_cache.clear, config=osrm),
+        Scenario("route.osrm.async.x8.cold", asgi_routes(8), setup=route_cache.clear, config=osrm),
+        Scenario("osrm.get_osrm_route", osrm_helper),
+        Scenario("route_matrix.local.10x10", lambda: client.post("/api/route_matrix", json=matrix_body),
+                 config=local),
+        # Repeated pool points can land on an obstacle created earlier and merge into it
+        Scenario("obstacles.create", create_obstacle, expect=(201, 200)),
+        Scenario("obstacles.report.duplicate", duplicate_report, expect=(201, 200)),
+        Scenario("obstacles.update", update_obstacle),
+        Scenario("obstacles.delete", delete_obstacle),
+        *([Scenario("dem.reimport", reimport_dem)] if dem_path else []),
+    ]
@@ -0,0 +1,138 @@
+"""
+Minimal stand-in for an OSRM server.
+
+Answers /route and /table with straight-line results after an optional
+artificial delay, so the OSRM code path (pooling, retries, response
+parsing) can be benchmarked without a real routing server. fail() makes
+the next requests answer with an error status instead, for the tests.
+"""
+import json
+import math
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+WALKING_SPEED_MPS = 1.4
+# fail(status=DROP): close the connection without answering
+DROP = "drop"
+
+
+def _haversine_m(a, b):
+    lng1, lat1 = map(math.radians, a)
+    lng2, lat2 = map(math.radians, b)
+    h = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * 6371000.0 * math.asin(math.sqrt(h))
+
+
+def _route_body(coords):
+    distance = sum(_haversine_m(a, b) for a, b in zip(coords, coords[1:]))
+    duration = distance / WALKING_SPEED_MPS
+    return {
+        "code": "Ok",
+        "routes": [{
+            "geometry": {"type": "LineString", "coordinates": coords},
+            "distance": distance,
+            "duration": duration,
+            "legs": [{"steps": [
+                {"maneuver": {"type": "depart"}, "distance": distance, "duration": duration, "name": ""},
+                {"maneuver": {"type": "arrive"}, "distance": 0, "duration": 0, "name": ""},
+            ]}],
+        }],
+    }
+
+
+def _table_body(coords, query):
+    params = dict(parse_qsl(query))
+    sources = [int(i) for i in params.get("sources", "").split(";") if i] or range(len(coords))
+    destinations = [int(i) for i in params.get("destinations", "").split(";") if i] or range(len(coords))
+    distances = [[_haversine_m(coords[s], coords[d]) for d in destinations] for s in sources]
+    durations = [[d / WALKING_SPEED_MPS for d in row] for row in distances]
+    return {"code": "Ok", "distances": distances, "durations": durations}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like OSRM
+    disable_nagle_algorithm = True  # headers and body are separate writes
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            failure = server.failures.popleft() if server.failures else None
+        if server.latency_s:
+            time.sleep(server.latency_s)
+
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        status, body = 400, {"code": "InvalidUrl"}
+        payload = None
+        if failure is not None and failure[0] == DROP:
+            self.close_connection = True
+            return
+        if failure is not None:
+            status, payload = failure
+            body = {"code": "Error"}
+        elif len(parts) == 4:
+            service = parts[0]
+            coords = [[float(v) for v in c.split(",")] for c in parts[3].split(";")]
+            if service == "route":
+                status, body = 200, _route_body(coords)
+            elif service == "table":
+                status, body = 200, _table_body(coords, url.query)
+
+        content_type = "application/json" if payload is None else "text/html"
+        if payload is None:
+            payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class StubOSRM:
+    """Context manager running the stub on a free local port."""
+
+    def __init__(self, latency_s=0.0):
+        self.latency_s = latency_s
+        self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def requests(self):
+        return self._server.requests
+
+    def set_latency(self, latency_s):
+        self._server.latency_s = latency_s
+
+    def fail(self, count=1, status=503, body=None):
+        """
+        Answer the next count requests with status (or drop them, status=DROP),
+        with body (bytes, sent as text/html) instead of an OSRM JSON error.
+        """
+        with self._server.lock:
+            self._server.failures.extend([(status, body)] * count)
+
+    def __enter__(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.latency_s = self.latency_s
+        self._server.requests = 0
+        self._server.failures = deque()
+        self._server.lock = threading.Lock()
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,230 @@
+"""
+Synthetic campus generator.
+
+Buildings are scattered around the Marietta campus, each gets a few
+entrances and floors (a corridor with rooms either side, an elevator and
+stairs at its ends), and paths join every building to its nearest
+neighbours (plus a spanning chain so the graph is connected). The same
+seed always produces the same campus.
+"""
+import math
+import random
+import struct
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import insert
+
+from app import db, bulk
+from app.hooks import campus_reloaded
+from app.models import Obstacle
+
+CENTER = (33.9380, -84.5200)
+METERS_PER_DEG_LAT = 111320.0
+
+OBSTACLE_TYPES = ("construction", "stairs", "steep", "flooding", "blocked", "other")
+# Far enough ahead that closures never expire and "now" routes never hit them
+WEEKEND = (datetime(2099, 6, 6), datetime(2099, 6, 8))  # Saturday 00:00 to Monday 00:00
+
+
+def _distance_m(a, b):
+    dlat = (a[0] - b[0]) * METERS_PER_DEG_LAT
+    dlng = (a[1] - b[1]) * METERS_PER_DEG_LAT * math.cos(math.radians(a[0]))
+    return math.hypot(dlat, dlng)
+
+
+def _floor_plan(building_id, level, lat, lng, rooms, first_id):
+    """Indoor feature rows for one floor: corridor, elevator, stairs and rooms."""
+    half = 15.0 / METERS_PER_DEG_LAT / math.cos(math.radians(lat))
+    room = 6.0 / METERS_PER_DEG_LAT
+    rows = [
+        ("corridor", None, {"type": "LineString", "coordinates": [[lng - half, lat], [lng + half, lat]]}),
+        ("elevator", "EL1", {"type": "Point", "coordinates": [lng + half, lat]}),
+        ("stairs", "S1", {"type": "Point", "coordinates": [lng - half, lat]}),
+    ]
+    for n in range(rooms):
+        x = lng - half + 2 * half * (n // 2 + 0.5) / max(1, (rooms + 1) // 2)
+        y = lat + (room if n % 2 == 0 else -2 * room)
+        ring = [[x - room / 2, y], [x + room / 2, y], [x + room / 2, y + room], [x - room / 2, y + room], [x - room / 2, y]]
+        rows.append(("room", f"{level}{n + 1:02d}", {"type": "Polygon", "coordinates": [ring]}))
+    return [{
+        "feature_id": first_id + i, "building_id": building_id, "level": level,
+        "category": category, "ref": ref, "geometry": geometry,
+        "wheelchair_accessible": category != "stairs",
+    } for i, (category, ref, geometry) in enumerate(rows)]
+
+
+def generate(buildings=200, entrances_per_building=2, floors_per_building=3,
+             paths_per_building=3, obstacles=100, radius_m=900.0, seed=0, rooms_per_floor=4, closures=0):
+    """
+    Rows for a synthetic campus: {'building': [...], 'entrance': [...],
+    'floor': [...], 'indoor': [...], 'path': [...], 'closure': [...],
+    'obstacle': [...]} with explicit ids. closures paths and as many
+    entrances are closed over the WEEKEND.
+    """
+    rnd = random.Random(seed)
+    deg_lat = radius_m / METERS_PER_DEG_LAT
+    deg_lng = deg_lat / math.cos(math.radians(CENTER[0]))
+
+    campus = {"building": [], "entrance": [], "floor": [], "indoor": [], "path": [], "closure": [],
+              "obstacle": []}
+    points = []
+    for building_id in range(1, buildings + 1):
+        lat = round(CENTER[0] + rnd.uniform(-deg_lat, deg_lat), 6)
+        lng = round(CENTER[1] + rnd.uniform(-deg_lng, deg_lng), 6)
+        points.append((lat, lng))
+        campus["building"].append({
+            "building_id": building_id, "name": f"Building {building_id}",
+            "latitude": lat, "longitude": lng,
+        })
+        for level in range(1, floors_per_building + 1):
+            campus["floor"].append({
+                "building_id": building_id, "level": level, "name": f"Floor {level}",
+                "is_default": level == 1,
+            })
+            campus["indoor"].extend(_floor_plan(building_id, level, lat, lng, rooms_per_floor,
+                                                len(campus["indoor"]) + 1))
+
+    entrance_id = 0
+    for building_id, (lat, lng) in enumerate(points, start=1):
+        for n in range(entrances_per_building):
+            entrance_id += 1
+            # Entrances sit 10-25 m from the building centre
+            angle = rnd.uniform(0, 2 * math.pi)
+            offset = rnd.uniform(10, 25) / METERS_PER_DEG_LAT
+            campus["entrance"].append({
+                "entrance_id": entrance_id, "building_id": building_id,
+                "entrance_name": f"Entrance {n + 1}",
+                "latitude": round(lat + offset * math.sin(angle), 6),
+                "longitude": round(lng + offset * math.cos(angle) / math.cos(math.radians(lat)), 6),
+                "floor_level": rnd.choice((1, 1, 1, 2)),
+                "wheelchair_accessible": rnd.random() < 0.7,
+            })
+
+    pairs = set()
+    for i in range(1, buildings):
+        # Spanning chain: link to the nearest earlier building
+        j = min(range(i), key=lambda k: _distance_m(points[i], points[k]))
+        pairs.add((j, i))
+    for i, point in enumerate(points):
+        nearest = sorted(range(buildings), key=lambda k: _distance_m(point, points[k]))
+        for j in nearest[1:paths_per_building + 1]:
+            pairs.add((min(i, j), max(i, j)))
+
+    for path_id, (i, j) in enumerate(sorted(pairs), start=1):
+        campus["path"].append({
+            "path_id": path_id,
+            "start_location_id": i + 1, "end_location_id": j + 1,
+            "had_incline": rnd.random() < 0.15,
+            "has_stairs": rnd.random() < 0.15,
+            "is_wheelchair_accessible": rnd.random() < 0.85,
+            "is_paved": rnd.random() < 0.9,
+            "path_type": ["pedestrian"],
+            "distance": round(min(_distance_m(points[i], points[j]), 999.99), 2),
+        })
+
+    paths = campus["path"]
+    for obstacle_id in range(1, obstacles + 1):
+        path = rnd.choice(paths) if paths else None
+        if path is not None:
+            # Somewhere along a path, so route checks actually find them
+            a = points[path["start_location_id"] - 1]
+            b = points[path["end_location_id"] - 1]
+            t = rnd.random()
+            lat, lng = a[0] + (b[0] - a[0]) * t, a[1] + (b[1] - a[1]) * t
+        else:
+            lat, lng = CENTER
+        campus["obstacle"].append({
+            "obstacle_id": obstacle_id,
+            "latitude": lat, "longitude": lng,
+            "obstacle_type": rnd.choice(OBSTACLE_TYPES),
+            "path_id": path["path_id"] if path is not None and rnd.random() < 0.5 else None,
+            "description": "Synthetic obstacle",
+            "severity_level": rnd.randint(1, 5),
+            "status": rnd.choice(("active", "active", "active", "resolved")),
+        })
+
+    closed = ([{"path_id": p["path_id"]} for p in rnd.sample(paths, min(closures, len(paths)))]
+              + [{"entrance_id": e["entrance_id"]}
+                 for e in rnd.sample(campus["entrance"], min(closures, len(campus["entrance"])))])
+    for closure_id, target in enumerate(closed, start=1):
+        campus["closure"].append({
+            "closure_id": closure_id, "path_id": None, "entrance_id": None, **target,
+            "starts_at": WEEKEND[0], "ends_at": WEEKEND[1], "reason": "Synthetic weekend closure",
+        })
+    return campus
+
+
+def load(campus, batch_size=1000):
+    """Write a generated campus into the current app's database."""
+    rows = ((layer, row) for layer in bulk.LAYER_ORDER for row in campus[layer])
+    counts = bulk.import_rows(rows, batch_size=batch_size)
+    if campus["obstacle"]:
+        db.session.execute(insert(Obstacle), campus["obstacle"])
+        db.session.commit()
+        campus_reloaded()
+    counts["obstacle"] = len(campus["obstacle"])
+    return counts
+
+
+def write_dem(path, campus, resolution_m=2.0, margin_m=100.0, hills=8, seed=0):
+    """
+    Write a synthetic terrain under the campus as an uncompressed float32
+    lat/lng GeoTIFF (the input of `flask import-dem`): gaussian hills steep
+    enough that some paths exceed the usual maxIncline limits.
+    """
+    lats = [b["latitude"] for b in campus["building"]] or [CENTER[0]]
+    lngs = [b["longitude"] for b in campus["building"]] or [CENTER[1]]
+    kx = math.cos(math.radians(CENTER[0]))
+    dy = resolution_m / METERS_PER_DEG_LAT
+    dx = dy / kx
+    margin = margin_m / METERS_PER_DEG_LAT
+    west, north = min(lngs) - margin / kx, max(lats) + margin
+    width = int((max(lngs) + margin / kx - west) / dx) + 1
+    height = int((north - min(lats) + margin) / dy) + 1
+
+    rnd = np.random.default_rng(seed)
+    y = np.arange(height, dtype=np.float32)[:, None] * resolution_m
+    x = np.arange(width, dtype=np.float32)[None, :] * resolution_m
+    z = np.full((height, width), 300.0, dtype=np.float32)
+    for _ in range(hills):
+        cx, cy = rnd.uniform(0, width * resolution_m), rnd.uniform(0, height * resolution_m)
+        amplitude, spread = rnd.uniform(5.0, 30.0), rnd.uniform(60.0, 200.0)
+        z += amplitude * np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (2 * spread ** 2))
+
+    # (tag, TIFF type, values); the strip offset is filled in below
+    entries = [
+        (256, 4, [width]), (257, 4, [height]), (258, 3, [32]), (259, 3, [1]), (262, 3, [1]),
+        (273, 4, [0]), (277, 3, [1]), (278, 4, [height]), (279, 4, [z.nbytes]), (339, 3, [3]),
+        (33550, 12, [dx, dy, 0.0]), (33922, 12, [0.0, 0.0, 0.0, west, north, 0.0]),
+        # GeoKeyDirectory: geographic model, PixelIsArea
+        (34735, 3, [1, 1, 0, 2, 1024, 0, 1, 2, 1025, 0, 1, 1]),
+    ]
+    formats = {3: "H", 4: "I", 12: "d"}
+    extra_at = 8 + 2 + 12 * len(entries) + 4
+    extra = b""
+    fields = []
+    for tag, kind, values in entries:
+        packed = struct.pack(f"<{len(values)}{formats[kind]}", *values)
+        if len(packed) > 4:
+            fields.append((tag, kind, len(values), struct.pack("<I", extra_at + len(extra))))
+            extra += packed
+        else:
+            fields.append((tag, kind, len(values), packed.ljust(4, b"\0")))
+    data_at = extra_at + len(extra)
+    with open(path, "wb") as f:
+        f.write(b"II" + struct.pack("<HI", 42, 8) + struct.pack("<H", len(fields)))
+        for tag, kind, count, value in fields:
+            if tag == 273:
+                value = struct.pack("<I", data_at)
+            f.write(struct.pack("<HHI", tag, kind, count) + value)
+        f.write(struct.pack("<I", 0) + extra)
+        f.write(z.astype("<f4").tobytes())
+
+
+def random_point(campus, rnd, jitter_m=30.0):
+    """A point near a random building, like a user standing outside it."""
+    building = rnd.choice(campus["building"])
+    jitter = jitter_m / METERS_PER_DEG_LAT
+    return (building["latitude"] + rnd.uniform(-jitter, jitter),
+            building["longitude"] + rnd.uniform(-jitter, jitter))
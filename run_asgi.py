@@ -0,0 +1,5 @@
+from app import create_app
+from app.asgi import RoutingASGI
+
+# uvicorn run_asgi:application
+application = RoutingASGI(create_app())
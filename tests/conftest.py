@@ -0,0 +1,14 @@
+import os
+
+# Config reads the environment on import: keep the tests off the real database
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import pytest
+
+from bench.stub_osrm import StubOSRM
+
+
+@pytest.fixture
+def stub():
+    with StubOSRM() as server:
+        yield server
@@ -0,0 +1,59 @@
+import pytest
+from sqlalchemy import event
+
+from app import create_app, db
+from app.models import AccessibilityFeature
+from bench import synthetic
+
+BUILDINGS = 20
+
+
+@pytest.fixture(scope="module")
+def client():
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        synthetic.load(synthetic.generate(buildings=BUILDINGS, obstacles=60, rooms_per_floor=1))
+        for building_id in range(1, BUILDINGS + 1):
+            db.session.add(AccessibilityFeature(latitude=0.0, longitude=0.0, feature_type="elevator",
+                                                building_id=str(building_id)))
+        db.session.commit()
+        yield app.test_client()
+        db.session.remove()
+        db.drop_all()
+
+
+def count_statements(client, url):
+    """(response, number of SQL statements the request ran)."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+    assert response.status_code == 200, response.get_json()
+    return response, len(statements)
+
+
+def test_full_building(client):
+    response, _ = count_statements(client, "/api/buildings/1/full")
+    body = response.get_json()
+    assert body["building_id"] == 1
+    assert body["entrances"] and body["paths"]
+    assert [f["feature_type"] for f in body["accessibility_features"]] == ["elevator"]
+
+
+def test_statements_do_not_grow_with_ids(client):
+    _, single = count_statements(client, "/api/buildings/1/full")
+    _, one = count_statements(client, "/api/buildings/full?ids=1")
+    ids = ",".join(str(i) for i in range(1, BUILDINGS + 1))
+    response, many = count_statements(client, f"/api/buildings/full?ids={ids}")
+
+    assert len(response.get_json()) == BUILDINGS
+    assert single == one == many
+    # Buildings, three relationships, obstacles and accessibility features
+    assert many <= 6
@@ -0,0 +1,36 @@
+import numpy as np
+
+from app import mmap_store
+from app.mmap_store import MappedArrays, open_if_changed, write_arrays
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "arrays.bin")
+    write_arrays(path, {"version": 1}, {"a": np.arange(5, dtype=np.int64), "b": np.eye(3, dtype=np.float32)})
+    mapped = MappedArrays(path)
+    assert mapped.meta == {"version": 1}
+    assert mapped.names == ("a", "b")
+    assert mapped.a.tolist() == [0, 1, 2, 3, 4]
+    assert np.array_equal(mapped.b, np.eye(3))
+    assert open_if_changed(path, mapped) is mapped
+
+
+def test_file_replaced_while_opening(tmp_path, monkeypatch):
+    path = str(tmp_path / "arrays.bin")
+    write_arrays(path, {"version": 1}, {"a": np.arange(5, dtype=np.int64)})
+    loads = mmap_store.json.loads
+
+    def replace_after_header(data):
+        # Another worker swaps in a new file between the header read and the mapping
+        write_arrays(path, {"version": 2}, {"pad": np.zeros(100), "a": np.arange(100, 105, dtype=np.int32)})
+        return loads(data)
+
+    monkeypatch.setattr(mmap_store.json, "loads", replace_after_header)
+    mapped = MappedArrays(path)
+    monkeypatch.undo()
+
+    assert mapped.meta == {"version": 1}
+    assert mapped.a.tolist() == [0, 1, 2, 3, 4]
+    reopened = open_if_changed(path, mapped)
+    assert reopened.meta == {"version": 2}
+    assert reopened.a.tolist() == [100, 101, 102, 103, 104]
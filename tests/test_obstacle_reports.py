@@ -0,0 +1,155 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+
+from app import create_app, db
+from app import obstacle_reports
+from app.models import Obstacle
+from app.obstacle_reports import _Pending, obstacle_ingest
+from app.tiles import tile_cache
+
+SPOT = (33.9400, -84.5200)
+
+
+@pytest.fixture(scope="module")
+def app(tmp_path_factory):
+    app = create_app()
+    app.config.update(TILE_CACHE_DIR=str(tmp_path_factory.mktemp("tiles")))
+    tile_cache.init_app(app)
+    return app
+
+
+@pytest.fixture
+def ctx(app):
+    with app.test_request_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def report(latitude=SPOT[0], longitude=SPOT[1], obstacle_type="construction", **fields):
+    """A report as create_obstacle hands it to the ingester."""
+    body = {
+        "latitude": latitude, "longitude": longitude, "obstacle_type": obstacle_type,
+        "user_id": None, "building_id": None, "path_id": None, "entrance_id": None,
+        "description": "", "severity_level": 2, "status": "Pending", "starts_at": None, "ends_at": None,
+    }
+    body.update(fields)
+    return body
+
+
+def queue(*reports):
+    """Queue reports as if their callers were waiting behind a flush."""
+    items = [_Pending(r) for r in reports]
+    obstacle_ingest._queue.extend(items)
+    return items
+
+
+def test_nearby_report_of_same_type_is_merged(ctx):
+    first, status = obstacle_ingest.submit(report(severity_level=2))
+    assert status == 201
+    merged, status = obstacle_ingest.submit(report(SPOT[0] + 0.00005, severity_level=4))
+    assert status == 200
+    assert merged["obstacle_id"] == first["obstacle_id"]
+    assert merged["report_count"] == 2
+    assert merged["severity_level"] == 4
+
+
+def test_far_other_type_or_old_reports_are_not_merged(ctx):
+    first, _ = obstacle_ingest.submit(report())
+    # 100 m north, beyond OBSTACLE_DEDUP_RADIUS_M
+    assert obstacle_ingest.submit(report(SPOT[0] + 0.0009))[1] == 201
+    assert obstacle_ingest.submit(report(obstacle_type="stairs"))[1] == 201
+
+    window = ctx.config["OBSTACLE_DEDUP_WINDOW_S"]
+    old = datetime.now() - timedelta(seconds=window + 60)
+    db.session.execute(text("UPDATE obstacle SET reported_at = :t, last_reported_at = :t WHERE obstacle_id = :id"),
+                       {"t": old, "id": first["obstacle_id"]})
+    db.session.commit()
+    assert obstacle_ingest.submit(report())[1] == 201
+    assert Obstacle.query.count() == 4
+
+
+def test_queued_reports_are_written_in_one_flush(ctx):
+    flushes = obstacle_ingest.flushes
+    waiting = queue(report(), report(SPOT[0] + 0.00003), report(SPOT[0] + 0.0009))
+    result, status = obstacle_ingest.submit(report(SPOT[0] - 0.00003))
+
+    assert obstacle_ingest.flushes == flushes + 1
+    assert all(item.done and item.error is None for item in waiting)
+    assert [item.result[1] for item in waiting] == [201, 200, 201]
+    assert status == 200
+    assert result["report_count"] == 3
+    assert Obstacle.query.count() == 2
+
+
+def test_concurrent_reports_add_up(app, ctx):
+    n = 8
+    barrier = threading.Barrier(n)
+    statuses = []
+
+    def post():
+        client = app.test_client()
+        barrier.wait()
+        response = client.post("/api/obstacles", json={"latitude": SPOT[0], "longitude": SPOT[1],
+                                                       "obstacle_type": "construction"})
+        statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=post) for _ in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(statuses) == [200] * (n - 1) + [201]
+    obstacle = Obstacle.query.one()
+    assert obstacle.report_count == n
+
+
+def test_report_count_is_incremented_in_sql(ctx, monkeypatch):
+    first, _ = obstacle_ingest.submit(report())
+    candidates = obstacle_reports.ObstacleIngest._candidates
+
+    def candidates_then_other_worker(self, reports, now, config):
+        known = candidates(self, reports, now, config)
+        # Another worker merges two reports after this one read the row
+        db.session.execute(text("UPDATE obstacle SET report_count = report_count + 2"))
+        return known
+
+    monkeypatch.setattr(obstacle_reports.ObstacleIngest, "_candidates", candidates_then_other_worker)
+    merged, status = obstacle_ingest.submit(report())
+    assert status == 200
+    assert merged["report_count"] == 4
+    assert db.session.get(Obstacle, first["obstacle_id"]).report_count == 4
+
+
+def test_rejected_batch_is_retried_one_by_one(ctx):
+    bad, good = queue(report(obstacle_type=None), report(SPOT[0] + 0.0009))
+    result, status = obstacle_ingest.submit(report())
+
+    assert status == 201 and result["obstacle_type"] == "construction"
+    assert good.done and good.error is None and good.result[1] == 201
+    assert bad.done and bad.error is not None
+    assert Obstacle.query.count() == 2
+
+
+def test_rejected_report_raises(ctx):
+    with pytest.raises(Exception):
+        obstacle_ingest.submit(report(obstacle_type=None))
+    assert Obstacle.query.count() == 0
+    assert obstacle_ingest.submit(report())[1] == 201
+
+
+def test_failing_hook_still_answers_every_report(ctx, monkeypatch):
+    def broken_hook(obstacle, previous=None):
+        raise RuntimeError("hook failed")
+
+    monkeypatch.setattr(obstacle_reports, "obstacle_changed", broken_hook)
+    waiting = queue(report(SPOT[0] + 0.0009))
+    assert obstacle_ingest.submit(report())[1] == 201
+    assert waiting[0].done and waiting[0].error is None and waiting[0].result[1] == 201
+    assert not obstacle_ingest._queue
+    assert Obstacle.query.count() == 2
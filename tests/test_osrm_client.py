@@ -0,0 +1,165 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.osrm_client import AsyncOSRMClient, CircuitBreaker, CircuitOpenError, OSRMClient, OSRMError
+from bench.stub_osrm import DROP
+
+POINTS = [(33.9400, -84.5200), (33.9410, -84.5210)]
+
+
+def make_client(stub, **kwargs):
+    settings = dict(timeout=2.0, max_retries=2, backoff=0.001, breaker_failures=5, breaker_reset=30.0)
+    settings.update(kwargs)
+    return OSRMClient(stub.url, **settings)
+
+
+def test_route(stub):
+    body = make_client(stub).route("foot", POINTS)
+    assert body["code"] == "Ok"
+    assert body["routes"][0]["distance"] > 0
+    assert stub.requests == 1
+
+
+def test_table(stub):
+    body = make_client(stub).table("foot", POINTS[:1], POINTS)
+    assert len(body["distances"]) == 1
+    assert len(body["distances"][0]) == 2
+
+
+def test_retries_5xx(stub):
+    stub.fail(2, status=503)
+    assert make_client(stub).route("foot", POINTS)["code"] == "Ok"
+    assert stub.requests == 3
+
+
+def test_retries_dropped_connections(stub):
+    stub.fail(1, status=DROP)
+    assert make_client(stub).route("foot", POINTS)["code"] == "Ok"
+    assert stub.requests == 2
+
+
+def test_gives_up_after_max_retries(stub):
+    stub.fail(3, status=502)
+    with pytest.raises(OSRMError):
+        make_client(stub).route("foot", POINTS)
+    assert stub.requests == 3
+
+
+def test_osrm_400_is_an_answer(stub):
+    # NoRoute and friends come back as 400s: not retried, not a breaker failure
+    stub.fail(1, status=400)
+    client = make_client(stub)
+    assert client.route("foot", POINTS)["code"] == "Error"
+    assert stub.requests == 1
+    assert client.breaker.failures == 0
+
+
+@pytest.mark.parametrize("status, body", [(500, None), (500, b"<html>Internal Server Error</html>"),
+                                          (404, b"<html>Not Found</html>"), (200, b"not json")])
+def test_errors_that_are_not_answers_count_against_the_breaker(stub, status, body):
+    stub.fail(2, status=status, body=body)
+    client = make_client(stub, breaker_failures=2)
+    for _ in range(2):
+        with pytest.raises(OSRMError):
+            client.route("foot", POINTS)
+    # Not retried, but the breaker is now open
+    assert stub.requests == 2
+    assert client.breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        client.route("foot", POINTS)
+
+
+def test_deadline_covers_slow_responses(stub):
+    stub.set_latency(1.0)
+    client = make_client(stub, timeout=0.2)
+    start = time.monotonic()
+    with pytest.raises(OSRMError):
+        client.route("foot", POINTS)
+    assert time.monotonic() - start < 0.8
+
+
+def test_breaker_opens_then_half_open_trial_closes_it(stub):
+    client = make_client(stub, max_retries=0, breaker_failures=2, breaker_reset=0.2)
+    stub.fail(2, status=503)
+    for _ in range(2):
+        with pytest.raises(OSRMError):
+            client.route("foot", POINTS)
+    assert client.breaker.state == CircuitBreaker.OPEN
+
+    # Open: fails fast without contacting OSRM
+    with pytest.raises(CircuitOpenError):
+        client.route("foot", POINTS)
+    assert stub.requests == 2
+
+    time.sleep(0.25)
+    assert client.route("foot", POINTS)["code"] == "Ok"
+    assert client.breaker.state == CircuitBreaker.CLOSED
+    assert stub.requests == 3
+
+
+def test_failed_half_open_trial_reopens(stub):
+    client = make_client(stub, max_retries=0, breaker_failures=1, breaker_reset=0.2)
+    stub.fail(1, status=503)
+    with pytest.raises(OSRMError):
+        client.route("foot", POINTS)
+    time.sleep(0.25)
+    stub.fail(1, status=503)
+    with pytest.raises(OSRMError):
+        client.route("foot", POINTS)
+    assert client.breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        client.route("foot", POINTS)
+
+
+def test_half_open_lets_one_trial_through(stub):
+    client = make_client(stub, max_retries=0, breaker_failures=1, breaker_reset=0.1)
+    stub.fail(1, status=503)
+    with pytest.raises(OSRMError):
+        client.route("foot", POINTS)
+    time.sleep(0.15)
+
+    stub.set_latency(0.3)
+    results = []
+
+    def call():
+        try:
+            results.append(client.route("foot", POINTS)["code"])
+        except CircuitOpenError:
+            results.append("open")
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(results) == ["Ok", "open", "open"]
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_cancelled_async_trial_releases_half_open(stub):
+    pytest.importorskip("httpx")
+    client = make_client(stub, max_retries=0, breaker_failures=1, breaker_reset=0.1)
+    async_client = AsyncOSRMClient(client)
+    stub.fail(1, status=503)
+    with pytest.raises(OSRMError):
+        client.route("foot", POINTS)
+    time.sleep(0.15)
+
+    async def cancel_trial():
+        stub.set_latency(1.0)
+        trial = asyncio.ensure_future(async_client.route("foot", POINTS))
+        await asyncio.sleep(0.2)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        stub.set_latency(0.0)
+        try:
+            return await async_client.route("foot", POINTS)
+        finally:
+            await async_client.aclose()
+
+    assert asyncio.run(cancel_trial())["code"] == "Ok"
+    assert client.breaker.state == CircuitBreaker.CLOSED
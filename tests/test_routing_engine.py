@@ -0,0 +1,142 @@
+import random
+
+import pytest
+
+from app import create_app, db, routing_engine
+from app.graph_snapshot import graph_snapshot
+from app.routing_engine import CampusGraph, NoRouteError, RouteClosedError, find_route
+from app.schedule import INF, Departure, EdgeSchedule
+from bench import synthetic
+
+ACCESSIBLE = {"avoidStairs": True}
+
+
+@pytest.fixture(scope="module")
+def campus(tmp_path_factory):
+    app = create_app()
+    app.config.update(GRAPH_SNAPSHOT_PATH=str(tmp_path_factory.mktemp("graph") / "graph.bin"))
+    graph_snapshot.init_app(app)
+    with app.app_context():
+        db.create_all()
+        routing_engine.invalidate_graph()
+        campus = synthetic.generate(buildings=15, obstacles=0, rooms_per_floor=1)
+        synthetic.load(campus)
+        yield campus
+        routing_engine.invalidate_graph()
+        db.session.remove()
+        db.drop_all()
+
+
+def building_pairs(campus, n=20):
+    rnd = random.Random(1)
+    points = [(b["latitude"], b["longitude"]) for b in campus["building"]]
+    return [tuple(rnd.sample(points, 2)) for _ in range(n)]
+
+
+def test_route_between_buildings(campus):
+    for start, end in building_pairs(campus):
+        route = find_route(start, end, {}, walking_speed=1.4)
+        summary = route["summary"]
+        assert summary["distance"] > 0
+        assert summary["distance"] == pytest.approx(sum(step["distance"] for step in route["instructions"]))
+        assert summary["duration"] == pytest.approx(summary["distance"] / 1.4)
+        assert route["geometry"][0] == {"lat": start[0], "lng": start[1]}
+        assert route["geometry"][-1] == {"lat": end[0], "lng": end[1]}
+        assert route["path_ids"]
+
+
+def test_accessible_profile_keeps_off_stairs(campus):
+    paths = {p["path_id"]: p for p in campus["path"]}
+    found = 0
+    for start, end in building_pairs(campus):
+        foot = find_route(start, end, {})
+        try:
+            route = find_route(start, end, ACCESSIBLE)
+        except NoRouteError:
+            continue
+        found += 1
+        assert route["summary"]["distance"] >= foot["summary"]["distance"] - 1e-6
+        for path_id in route["path_ids"]:
+            assert not paths[path_id]["has_stairs"]
+            assert paths[path_id]["is_wheelchair_accessible"]
+    assert found
+
+
+def test_point_off_campus_has_no_route(campus):
+    start = (campus["building"][0]["latitude"], campus["building"][0]["longitude"])
+    with pytest.raises(NoRouteError, match="outside the campus graph"):
+        find_route(start, (start[0] + 0.1, start[1]), {})
+    with pytest.raises(NoRouteError, match="outside the campus graph"):
+        find_route(start, (start[0] + 0.001, start[1]), {}, max_snap_m=1.0)
+
+
+def test_empty_graph_has_no_route(monkeypatch):
+    monkeypatch.setattr(routing_engine, "get_graph", lambda: CampusGraph.from_rows([], [], []))
+    with pytest.raises(NoRouteError, match="empty"):
+        find_route((33.94, -84.52), (33.941, -84.52), {})
+
+
+#-------------------------------------------------------------------------
+# Three buildings: A-B direct over stairs, or around through C, the
+# second leg of which is 8% steep
+#-------------------------------------------------------------------------
+
+A, B, C = (33.9400, -84.5200), (33.9410, -84.5200), (33.9405, -84.5190)
+
+
+@pytest.fixture
+def triangle(monkeypatch):
+    buildings = [(1, "A", *A), (2, "B", *B), (3, "C", *C)]
+    paths = [
+        (1, 1, 2, None, True, False, True, True, None),
+        (2, 1, 3, None, False, False, True, True, 2.0),
+        (3, 3, 2, None, False, False, True, True, 8.0),
+    ]
+    graph = CampusGraph.from_rows(buildings, [], paths)
+    monkeypatch.setattr(routing_engine, "get_graph", lambda: graph)
+    return graph
+
+
+def path_edges(graph, *path_ids):
+    return [e for e, path_id in enumerate(graph.path_ids) if path_id in path_ids]
+
+
+def test_profiles_choose_between_stairs_and_detour(triangle):
+    assert find_route(A, B, {})["path_ids"] == [1]
+    route = find_route(A, B, ACCESSIBLE)
+    assert route["path_ids"] == [2, 3]
+    assert route["summary"]["max_grade"] == 8.0
+
+
+def test_grade_limit(triangle):
+    assert find_route(A, B, {"maxIncline": 5})["path_ids"] == [1]
+    assert find_route(A, B, {"avoidStairs": True, "maxIncline": 10})["path_ids"] == [2, 3]
+    with pytest.raises(NoRouteError, match="steeper than 5%") as error:
+        find_route(A, B, {"avoidStairs": True, "maxIncline": 5})
+    assert not isinstance(error.value, RouteClosedError)
+
+
+def test_blocked_edges_force_the_detour(triangle):
+    route = find_route(A, B, {}, blocked_edges=lambda graph: set(path_edges(graph, 1)))
+    assert route["path_ids"] == [2, 3]
+    with pytest.raises(NoRouteError, match="No route found"):
+        find_route(A, B, {}, blocked_edges=lambda graph: set(path_edges(graph, 1, 2)))
+
+
+def test_closures_at_departure(triangle):
+    t = 1_700_000_000.0
+    # Path 1 closed for an hour from t, path 2 from then on
+    once = {e: [(t, t + 3600)] for e in path_edges(triangle, 1)}
+    once.update({e: [(t, INF)] for e in path_edges(triangle, 2)})
+    schedule = EdgeSchedule(triangle, once, {})
+
+    def leaving(at):
+        return lambda graph: Departure(schedule, at, 1.4)
+
+    assert find_route(A, B, {}, departure=leaving(t - 3600))["path_ids"] == [1]
+    assert find_route(A, B, {}, departure=leaving(t + 7200))["path_ids"] == [1]
+    with pytest.raises(RouteClosedError):
+        find_route(A, B, {}, departure=leaving(t + 60))
+    # Stairs are off limits and the detour starts on path 2, which stays closed
+    with pytest.raises(RouteClosedError):
+        find_route(A, B, ACCESSIBLE, departure=leaving(t + 7200))
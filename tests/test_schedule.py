@@ -0,0 +1,103 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+from app.schedule import DAY_S, INF, WEEK_S, Departure, EdgeSchedule, Windows, _Weekly, timestamp, weekly_closed
+
+H = 3600
+# 2024-01-01 was a Monday
+MONDAY = timestamp(datetime(2024, 1, 1))
+
+
+def test_weekly_closed_outside_opening_hours():
+    assert weekly_closed({"mon": [["08:00", "17:00"]]}) == [(0, 8 * H), (17 * H, WEEK_S)]
+    assert weekly_closed({}) == [(0, WEEK_S)]
+    assert weekly_closed({day: [["00:00", "24:00"]] for day in ("mon", "tue", "wed", "thu", "fri", "sat", "sun")}) == []
+
+
+def test_weekly_closed_merges_overlapping_intervals():
+    hours = {"tue": [["08:00", "12:00"], ["11:00", "14:00"], ["14:00", "18:00"]]}
+    assert weekly_closed(hours) == [(0, DAY_S + 8 * H), (DAY_S + 18 * H, WEEK_S)]
+
+
+def test_weekly_closed_interval_past_midnight():
+    hours = {"fri": [["22:00", "02:00"]]}
+    assert weekly_closed(hours) == [(0, 4 * DAY_S + 22 * H), (5 * DAY_S + 2 * H, WEEK_S)]
+
+
+def test_weekly_closed_sunday_into_monday():
+    hours = {"sun": [["22:00", "06:00"]]}
+    assert weekly_closed(hours) == [(6 * H, 6 * DAY_S + 22 * H)]
+
+
+def test_windows_merge_and_lookup():
+    windows = Windows([(30, 40), (10, 20), (15, 25), (25, 28), (50, 50)])
+    assert (windows.starts, windows.ends) == ([10, 30], [28, 40])
+    assert windows.contains(10) and windows.contains(27.9)
+    assert not windows.contains(28) and not windows.contains(9) and not windows.contains(45)
+    assert windows.overlaps(0, 11)
+    assert windows.overlaps(35, 100)
+    assert not windows.overlaps(0, 10)
+    assert not windows.overlaps(28, 30)
+    assert not windows.overlaps(40, 100)
+    assert not Windows([(5, 5)])
+
+
+def test_weekly_overlaps_wrap_around_the_week():
+    # Closed Monday 00:00 to 06:00
+    weekly = _Weekly([(0, 6 * H)])
+    sunday_night = MONDAY - 2 * H
+    assert weekly.contains(MONDAY + 5 * H)
+    assert not weekly.contains(sunday_night)
+    assert weekly.overlaps(sunday_night, sunday_night + 3 * H)
+    assert not weekly.overlaps(sunday_night, sunday_night + 2 * H)
+    assert not weekly.overlaps(MONDAY + 6 * H, MONDAY + WEEK_S - H)
+    assert weekly.overlaps(MONDAY + 6 * H, MONDAY + 6 * H + WEEK_S)
+    assert not weekly.overlaps(MONDAY + H, MONDAY + H)
+    assert not _Weekly([]).overlaps(MONDAY, MONDAY + 2 * WEEK_S)
+
+
+def test_cache_key():
+    graph = SimpleNamespace(lengths=[100.0])
+    assert EdgeSchedule(graph, {}, {}).cache_key(MONDAY, 600) == ()
+
+    schedule = EdgeSchedule(graph, {0: [(MONDAY + 2 * H, MONDAY + 3 * H)]}, {})
+    before = schedule.cache_key(MONDAY, 600)
+    assert before is not None
+    assert schedule.cache_key(MONDAY + H, 600) == before
+    assert schedule.cache_key(MONDAY + 2 * H - 300, 600) is None
+    during = schedule.cache_key(MONDAY + 2 * H + 60, 600)
+    assert during is not None and during != before
+    assert schedule.cache_key(MONDAY + 4 * H, 600) not in (before, during, None)
+
+
+def test_cache_key_of_weekly_windows_changes_every_week():
+    graph = SimpleNamespace(lengths=[100.0])
+    schedule = EdgeSchedule(graph, {}, {0: [(0, 6 * H)]})
+    assert schedule.cache_key(MONDAY + 8 * H, 600) is not None
+    assert schedule.cache_key(MONDAY + 8 * H, 600) != schedule.cache_key(MONDAY + WEEK_S + 8 * H, 600)
+    assert schedule.cache_key(MONDAY + WEEK_S - 300, 600) is None
+
+
+def test_departure_open_along_checks_each_edge_on_arrival():
+    # Three 100 m edges walked at 1 m/s; edge 2 is reached after 200 s
+    graph = SimpleNamespace(lengths=[100.0, 100.0, 100.0])
+    schedule = EdgeSchedule(graph, {2: [(MONDAY + 150, MONDAY + 250)]}, {})
+
+    walk = Departure(schedule, MONDAY, 1.0)
+    assert not walk.open_along([0, 1, 2])
+    assert walk.skipped == 1
+    assert walk.open_along([0, 1])
+    assert Departure(schedule, MONDAY + 60, 1.0).open_along([0, 1, 2])
+    assert Departure(schedule, MONDAY - 100, 1.0).open_along([0, 1, 2])
+    # Reached after 300 s this time
+    assert not Departure(schedule, MONDAY - 100, 1.0).open_along([0, 1, 0, 2])
+
+
+def test_departure_open_ended_closure():
+    graph = SimpleNamespace(lengths=[100.0])
+    schedule = EdgeSchedule(graph, {0: [(MONDAY, INF)]}, {})
+    assert Departure(schedule, MONDAY - 200, 1.0).open_along([0])
+    # Entered before the closure starts, but walked again after it
+    assert Departure(schedule, MONDAY - 50, 1.0).open_along([0])
+    assert not Departure(schedule, MONDAY - 50, 1.0).open_along([0, 0])
+    assert not Departure(schedule, MONDAY + 10 * WEEK_S, 1.0).open_along([0])